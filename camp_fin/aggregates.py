@@ -0,0 +1,230 @@
+"""
+Reading the transaction aggregates.
+
+`aggregate_data` keeps the sums of each entity's contributions and
+expenditures by day, week and month in the contributions_by_* and
+expenditures_by_* tables. The tables are sparse: intervals without
+transactions have no row. The functions here read them for one entity, or
+for several at once in a single query, filling in intervals without
+transactions with 0 only where a continuous series is asked for.
+
+Intervals start at midnight in TIME_ZONE, which is how `aggregate_data`
+truncates transaction dates, so series are generated in local time.
+
+The query ranking top earners, which `aggregate_data` snapshots for
+TOP_EARNERS_WINDOWS and the top earners pages run live for other windows, is
+here too.
+"""
+from django.conf import settings
+from django.db import connection
+
+TRANSACTION_TYPES = ("contributions", "expenditures")
+
+INTERVALS = ("day", "week", "month")
+
+
+def aggregate_table(transaction_type, interval):
+    if transaction_type not in TRANSACTION_TYPES:
+        raise ValueError("Unknown transaction type: {}".format(transaction_type))
+
+    if interval not in INTERVALS:
+        raise ValueError("Unknown interval: {}".format(interval))
+
+    return "{}_by_{}".format(transaction_type, interval)
+
+
+def aggregate_totals(entity_ids, transaction_type, since=None):
+    """
+    Return a dict of the total amount of each of several entities'
+    contributions or expenditures, optionally from a date onward, in one
+    query. Entities without transactions get 0.
+    """
+    if not entity_ids:
+        return {}
+
+    query = """
+        SELECT entity_id, SUM(amount)
+        FROM {table}
+        WHERE entity_id IN %(entity_ids)s
+          AND (
+            %(since)s::timestamp IS NULL
+            OR month >= %(since)s::timestamp AT TIME ZONE %(time_zone)s
+          )
+        GROUP BY entity_id
+    """.format(
+        table=aggregate_table(transaction_type, "month")
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            query,
+            {
+                "entity_ids": tuple(entity_ids),
+                "since": since,
+                "time_zone": settings.TIME_ZONE,
+            },
+        )
+        totals = dict(cursor.fetchall())
+
+    return {entity_id: totals.get(entity_id, 0) for entity_id in entity_ids}
+
+
+def aggregate_total(entity_id, transaction_type, since=None):
+    """
+    Total amount of an entity's contributions or expenditures, optionally
+    from a date onward.
+    """
+    return aggregate_totals([entity_id], transaction_type, since=since)[entity_id]
+
+
+def first_interval(entity_id, interval="month"):
+    """
+    Local start of the first interval in which an entity had contributions
+    or expenditures, or None if it has had neither.
+    """
+    query = """
+        SELECT MIN({interval}) AT TIME ZONE %(time_zone)s
+        FROM (
+          SELECT MIN({interval}) AS {interval}
+          FROM {contributions}
+          WHERE entity_id = %(entity_id)s
+          UNION ALL
+          SELECT MIN({interval}) AS {interval}
+          FROM {expenditures}
+          WHERE entity_id = %(entity_id)s
+        ) AS firsts
+    """.format(
+        interval=interval,
+        contributions=aggregate_table("contributions", interval),
+        expenditures=aggregate_table("expenditures", interval),
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(query, {"entity_id": entity_id, "time_zone": settings.TIME_ZONE})
+        return cursor.fetchone()[0]
+
+
+def aggregate_series_by_entity(
+    entity_ids, transaction_type, interval="month", since=None
+):
+    """
+    Return a dict of the series of (local interval start, amount) tuples of
+    each of several entities' contributions or expenditures, as returned by
+    aggregate_series, in one query. Entities without transactions get an
+    empty list.
+    """
+    if not entity_ids:
+        return {}
+
+    query = """
+        WITH aggregate AS (
+          SELECT
+            entity_id,
+            {interval} AT TIME ZONE %(time_zone)s AS start,
+            amount
+          FROM {table}
+          WHERE entity_id IN %(entity_ids)s
+            AND (
+              %(since)s::timestamp IS NULL
+              OR {interval} >= %(since)s::timestamp AT TIME ZONE %(time_zone)s
+            )
+        )
+        SELECT series.entity_id, series.start, COALESCE(aggregate.amount, 0)
+        FROM (
+          SELECT
+            entity_id,
+            generate_series(MIN(start), MAX(start), '1 {interval}') AS start
+          FROM aggregate
+          GROUP BY entity_id
+        ) AS series
+        LEFT JOIN aggregate
+          USING (entity_id, start)
+        ORDER BY series.entity_id, series.start
+    """.format(
+        interval=interval, table=aggregate_table(transaction_type, interval)
+    )
+
+    series = {entity_id: [] for entity_id in entity_ids}
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            query,
+            {
+                "entity_ids": tuple(entity_ids),
+                "since": since,
+                "time_zone": settings.TIME_ZONE,
+            },
+        )
+
+        for entity_id, start, amount in cursor:
+            series[entity_id].append((start, amount))
+
+    return series
+
+
+def aggregate_series(entity_id, transaction_type, interval="month", since=None):
+    """
+    Return a list of (local interval start, amount) tuples for an entity's
+    contributions or expenditures, from its first interval with transactions
+    on or after `since` to its last, with an amount of 0 for the intervals in
+    between without transactions.
+    """
+    return aggregate_series_by_entity(
+        [entity_id], transaction_type, interval=interval, since=since
+    )[entity_id]
+
+
+# Windows, in days, of the top earners snapshots refreshed by aggregate_data.
+# 0 means since 2010.
+TOP_EARNERS_WINDOWS = (30, 90, 365, 0)
+
+
+def top_earners_query(days):
+    """
+    Return the query ranking candidates and PACs by the contributions they
+    received in the last `days` days, or since 2010 if `days` is 0, and its
+    args.
+    """
+    if days > 0:
+        where_clause = "AND t.received_date >= (NOW() - INTERVAL '%s days')"
+        args = [days]
+    else:
+        where_clause = "AND t.received_date >= '2010-01-01'"
+        args = []
+
+    query = """
+        SELECT * FROM (
+          SELECT
+            dense_rank() OVER (ORDER BY new_funds DESC) AS rank, *
+          FROM (
+            SELECT
+              MAX(COALESCE(c.slug, p.slug)) AS slug,
+              MAX(COALESCE(c.full_name, p.name)) AS name,
+              SUM(t.amount) AS new_funds,
+              (array_agg(f.closing_balance ORDER BY f.id DESC))[1] AS current_funds,
+              CASE WHEN p.id IS NULL
+                THEN 'Candidate'
+                ELSE 'PAC'
+              END AS committee_type
+              FROM camp_fin_transaction AS t
+              JOIN camp_fin_transactiontype AS tt
+                ON t.transaction_type_id = tt.id
+              JOIN camp_fin_filing AS f
+                ON t.filing_id = f.id
+              LEFT JOIN camp_fin_pac AS p
+                ON f.entity_id = p.entity_id
+              LEFT JOIN camp_fin_candidate AS c
+                ON f.entity_id = c.entity_id
+              WHERE tt.contribution = TRUE
+                {}
+              GROUP BY c.id, p.id
+            ) AS s
+            WHERE name NOT ILIKE '%%public election fund%%'
+              OR name NOT ILIKE '%%department of finance%%'
+          ORDER BY new_funds DESC
+        ) AS s
+    """.format(
+        where_clause
+    )
+
+    return query, args
@@ -1,8 +1,6 @@
-import csv
 import re
-import zipfile
-from io import BytesIO, StringIO
 
+from django.urls import reverse
 from rest_framework import pagination, renderers, serializers
 from rest_framework_csv.renderers import CSVStreamingRenderer
 
@@ -14,6 +12,7 @@ from camp_fin.models import (
     Lobbyist,
     LobbyistTransaction,
     Organization,
+    SearchDocument,
     Transaction,
 )
 
@@ -334,6 +333,47 @@ class TopMoneySerializer(serializers.Serializer):
         return ret
 
 
+class SearchDocumentSerializer(serializers.ModelSerializer):
+    # URL name and lookup of the page of each kind of document, where there
+    # is one
+    DETAIL_URLS = {
+        "candidate": ("candidate-detail", "slug"),
+        "pac": ("committee-detail", "slug"),
+        "organization": ("organization-detail", "slug"),
+        "contribution": ("contribution-detail", "object_id"),
+        "expenditure": ("expenditure-detail", "object_id"),
+    }
+
+    rank = serializers.FloatField()
+    url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = SearchDocument
+        fields = (
+            "kind",
+            "object_id",
+            "name",
+            "description",
+            "slug",
+            "amount",
+            "date",
+            "rank",
+            "url",
+        )
+
+    def get_url(self, instance):
+        if instance.kind not in self.DETAIL_URLS:
+            return None
+
+        url_name, lookup = self.DETAIL_URLS[instance.kind]
+        value = getattr(instance, lookup)
+
+        if not value:
+            return None
+
+        return reverse(url_name, args=[value])
+
+
 class DataTablesPagination(pagination.LimitOffsetPagination):
     limit_query_param = "length"
     offset_query_param = "start"
@@ -344,41 +384,42 @@ class TransactionCSVRenderer(CSVStreamingRenderer):
         return super().render(data["results"], *args, **kwargs)
 
 
-class SearchCSVRenderer(renderers.BaseRenderer):
-    media_type = "application/zip"
-    format = "csv"
-
-    def render(self, data, media_type=None, renderer_context=None):
-        table_names = [
-            "candidate",
-            "pac",
-            "contribution",
-            "expenditure",
-            "treasurer",
-            "lobbyisttransaction",
-        ]
-
-        zfoutp = BytesIO()
+class ParquetRenderer(renderers.BaseRenderer):
+    """
+    Renderer for downloads in Parquet format. Downloads are written by the
+    view, so this only lets format=parquet through content negotiation.
+    """
 
-        with zipfile.ZipFile(zfoutp, "w") as zf:
-            for table in table_names:
-                if data.get(table):
-                    try:
-                        first_record = data[table]["objects"][0]
-                    except IndexError:
-                        continue
+    media_type = "application/vnd.apache.parquet"
+    format = "parquet"
+    charset = None
+    render_style = "binary"
 
-                    outp = StringIO()
-
-                    fieldnames = first_record._fields
-                    writer = csv.writer(outp)
+    def render(self, data, media_type=None, renderer_context=None):
+        return data
 
-                    writer.writerow(fieldnames)
-                    writer.writerows(data[table]["objects"])
 
-                    outp.seek(0)
-                    zf.writestr("{}.csv".format(table), outp.getvalue())
+class SearchCSVRenderer(renderers.BaseRenderer):
+    """
+    Renderer for search results in CSV format, i.e., a ZIP of a CSV for each
+    table. The ZIP is streamed by the view, so this only lets format=csv
+    through content negotiation.
+    """
 
-        zfoutp.seek(0)
+    media_type = "application/zip"
+    format = "csv"
+    charset = None
+    render_style = "binary"
+
+    # Tables included in the ZIP, in order
+    table_names = [
+        "candidate",
+        "pac",
+        "contribution",
+        "expenditure",
+        "treasurer",
+        "lobbyisttransaction",
+    ]
 
-        return zfoutp.getvalue()
+    def render(self, data, media_type=None, renderer_context=None):
+        return data
@@ -1,23 +1,45 @@
 import csv
+import queue
+import threading
 from collections import namedtuple
 from datetime import datetime
 
+from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.db import connection
-from django.http import StreamingHttpResponse
+from django.db import connection, transaction
+from django.http import HttpResponseRedirect, StreamingHttpResponse
 from django.utils import timezone
 from django.utils.text import slugify
 from django.views.generic import DetailView, ListView, TemplateView
 from rest_framework import filters, viewsets
 from rest_framework.response import Response
 
+from camp_fin.aggregates import TOP_EARNERS_WINDOWS, top_earners_query
 from camp_fin.api_parts import (
+    ParquetRenderer,
     TopMoneySerializer,
     TransactionCSVRenderer,
     TransactionSerializer,
 )
-from camp_fin.models import PAC, Candidate, Lobbyist, Organization, Transaction
+from camp_fin.exports import (
+    CONTENT_TYPES,
+    accepts_export,
+    copy_csv,
+    find_export,
+    find_uploaded_export,
+    parquet_chunks,
+    serve_export,
+)
+from camp_fin.models import (
+    PAC,
+    Candidate,
+    Lobbyist,
+    Organization,
+    TopEarner,
+    Transaction,
+)
 from pages.models import Page
 
 TWENTY_TEN = timezone.make_aware(datetime(2010, 1, 1))
@@ -117,13 +139,19 @@ class TransactionDownload(viewsets.ViewSet):
 
     # Viewset class attributes
     serializer_class = TransactionSerializer
-    renderer_classes = (TransactionCSVRenderer,)
+    renderer_classes = (TransactionCSVRenderer, ParquetRenderer)
     allowed_methods = ["GET"]
 
     # Transaction download class attributes
     contribution = True
     entity_types = [(None, None, None)]
 
+    # Name of the pre-generated export of all transactions, if any
+    export = None
+
+    # Column whose years Parquet row groups are partitioned by, if any
+    partition_by = None
+
     def get_entity_id(self, request):
         """
         Given an `entity_types` tuple of (param, model, name_attr) pairs, parse URL params
@@ -170,38 +198,22 @@ class TransactionDownload(viewsets.ViewSet):
 
         query = self.transaction_query(self.entity_id, start_date, end_date)
 
-        cursor = connection.cursor()
-
         # Format args for the query
         args = [
             arg for arg in (self.entity_id, start_date, end_date) if arg is not None
         ]
 
-        if args:
-            cursor.execute(query, args)
-        else:
-            cursor.execute(query)
+        filename = "{0}-{1}-{{}}".format(ttype, slugify(self.entity_name))
 
-        header = [c[0] for c in cursor.description]
-
-        streaming_buffer = Echo()
-        writer = csv.writer(streaming_buffer)
-        writer.writerow(header)
-
-        response = StreamingHttpResponse(
-            (writer.writerow(row) for row in iterate_cursor(header, cursor)),
-            content_type="text/csv",
-        )
-
-        # Add appropriate filename and header for CSV response
-        filename = "{0}-{1}-{2}.csv".format(
-            ttype, slugify(self.entity_name), timezone.now().isoformat()
+        return download_response(
+            request,
+            query,
+            args,
+            filename,
+            export=self.export if self.entity_id is None else None,
+            partition_by=self.partition_by,
         )
 
-        response["Content-Disposition"] = "attachment; filename={}".format(filename)
-
-        return response
-
 
 class LobbyistTransactionDownloadViewSet(TransactionDownload):
     """
@@ -302,6 +314,8 @@ class TransactionDownloadViewSet(TransactionDownload):
         ("pac_id", PAC, "name"),
     ]
 
+    partition_by = "received_date"
+
     def transaction_query(self, entity_id=None, start_date=None, end_date=None):
         """
         Return a query corresponding to the request, either for transactions by
@@ -425,110 +439,55 @@ class TransactionBaseViewSet(viewsets.ModelViewSet):
 
 
 class TopMoneyView(viewsets.ViewSet):
+    """
+    Top donors or payees, read from the TopMoney leaderboards built by
+    aggregate_data. Lists are ranked by election year, or over all time with
+    ?entity_type=pac, and details are ranked for a candidate by election year
+    or, with ?entity_type=pac, for a PAC over all time.
+    """
+
     def list(self, request):
+        if self.request.GET.get("entity_type") == "pac":
+            return self.leaderboard("all")
+
+        return self.leaderboard("year")
+
+    def retrieve(self, request, pk=None):
+        if self.request.GET.get("entity_type") == "pac":
+            return self.leaderboard("pac", pk)
+
+        return self.leaderboard("candidate", pk)
+
+    def leaderboard(self, scope, scope_id=None):
         cursor = connection.cursor()
 
         query = """
-            SELECT * FROM (
-              SELECT
-                DENSE_RANK()
-                  OVER (
-                    PARTITION BY year
-                    ORDER BY amount DESC
-                  ) AS rank, *
-              FROM (
-                SELECT
-                  SUM(transaction.amount) AS amount,
-                  NULL AS latest_date,
-                  transaction.name_prefix,
-                  transaction.first_name,
-                  transaction.middle_name,
-                  transaction.last_name,
-                  transaction.suffix,
-                  transaction.company_name,
-                  election_season.year,
-                  redact,
-                  ct.description
-                FROM camp_fin_transaction AS transaction
-                JOIN camp_fin_transactiontype AS tt
-                  ON transaction.transaction_type_id = tt.id
-                JOIN camp_fin_filing AS f
-                  ON transaction.filing_id = f.id
-                JOIN camp_fin_campaign AS c
-                  ON f.campaign_id = c.id
-                JOIN camp_fin_electionseason AS election_season
-                  ON c.election_season_id = election_season.id
-                LEFT JOIN camp_fin_contact AS contact
-                  ON transaction.contact_id = contact.id
-                LEFT JOIN camp_fin_contacttype AS ct
-                  ON contact.contact_type_id = ct.id
-                WHERE tt.contribution = %s
-                  AND year >= '2010'
-                GROUP BY
-                  transaction.name_prefix,
-                  transaction.first_name,
-                  transaction.middle_name,
-                  transaction.last_name,
-                  transaction.suffix,
-                  transaction.company_name,
-                  year,
-                  redact,
-                  ct.description
-                ORDER BY SUM(amount) DESC
-              ) AS ranked_list
-              ORDER BY year DESC, amount DESC
-            ) AS election_groups
-            WHERE rank < 11
+            SELECT
+              rank,
+              amount,
+              latest_date,
+              name_prefix,
+              first_name,
+              middle_name,
+              last_name,
+              suffix,
+              company_name,
+              year,
+              redact,
+              description
+            FROM camp_fin_topmoney
+            WHERE contribution = %s
+              AND scope = %s
+              AND {scope_filter}
+            ORDER BY year DESC, amount DESC
         """
 
-        if self.request.GET.get("entity_type") == "pac":
-            query = """
-                SELECT *, NULL AS year FROM (
-                  SELECT
-                    DENSE_RANK()
-                      OVER (
-                        ORDER BY amount DESC
-                      ) AS rank, *
-                  FROM (
-                    SELECT
-                      SUM(transaction.amount) AS amount,
-                      MAX(transaction.received_date) AS latest_date,
-                      transaction.name_prefix,
-                      transaction.first_name,
-                      transaction.middle_name,
-                      transaction.last_name,
-                      transaction.suffix,
-                      transaction.company_name,
-                      transaction.redact,
-                      ct.description
-                    FROM camp_fin_transaction AS transaction
-                    JOIN camp_fin_transactiontype AS tt
-                      ON transaction.transaction_type_id = tt.id
-                    JOIN camp_fin_filing AS f
-                      ON transaction.filing_id = f.id
-                    LEFT JOIN camp_fin_contact AS contact
-                      ON transaction.contact_id = contact.id
-                    LEFT JOIN camp_fin_contacttype AS ct
-                      ON contact.contact_type_id = ct.id
-                    WHERE tt.contribution = %s
-                      AND transaction.received_date >= '2010-01-01'
-                    GROUP BY
-                      transaction.name_prefix,
-                      transaction.first_name,
-                      transaction.middle_name,
-                      transaction.last_name,
-                      transaction.suffix,
-                      transaction.company_name,
-                      transaction.redact,
-                      ct.description
-                    ORDER BY SUM(amount) DESC
-                  ) AS ranked_list
-                  ORDER BY amount DESC
-                ) AS election_groups
-                WHERE rank < 11
-            """
-
-        cursor.execute(query, [self.contribution])
+        if scope_id is None:
+            query = query.format(scope_filter="scope_id IS NULL")
+            cursor.execute(query, [self.contribution, scope])
+        else:
+            query = query.format(scope_filter="scope_id = %s")
+            cursor.execute(query, [self.contribution, scope, scope_id])
 
         columns = [c[0] for c in cursor.description]
         transaction_tuple = namedtuple("Transaction", columns)
@@ -539,173 +498,40 @@ class TopMoneyView(viewsets.ViewSet):
 
         return Response(serializer.data)
 
-    def retrieve(self, request, pk=None):
-        cursor = connection.cursor()
 
-        query = """
-            SELECT * FROM (
-              SELECT
-                DENSE_RANK()
-                  OVER (
-                    PARTITION BY year
-                    ORDER BY amount DESC
-                  ) AS rank, *
-              FROM (
-                SELECT
-                  SUM(transaction.amount) AS amount,
-                  MAX(transaction.received_date) AS latest_date,
-                  transaction.name_prefix,
-                  transaction.first_name,
-                  transaction.middle_name,
-                  transaction.last_name,
-                  transaction.suffix,
-                  transaction.company_name,
-                  election_season.year,
-                  transaction.redact,
-                  ct.description
-                FROM camp_fin_transaction AS transaction
-                JOIN camp_fin_transactiontype AS tt
-                  ON transaction.transaction_type_id = tt.id
-                JOIN camp_fin_filing AS f
-                  ON transaction.filing_id = f.id
-                JOIN camp_fin_campaign AS c
-                  ON f.campaign_id = c.id
-                JOIN camp_fin_candidate as candidate
-                  ON c.candidate_id = candidate.id
-                JOIN camp_fin_electionseason AS election_season
-                  ON c.election_season_id = election_season.id
-                LEFT JOIN camp_fin_contact AS contact
-                  ON transaction.contact_id = contact.id
-                LEFT JOIN camp_fin_contacttype AS ct
-                  ON contact.contact_type_id = ct.id
-                WHERE tt.contribution = %s
-                  AND candidate.id = %s
-                  AND transaction.received_date >= '2010-01-01'
-                GROUP BY
-                  transaction.name_prefix,
-                  transaction.first_name,
-                  transaction.middle_name,
-                  transaction.last_name,
-                  transaction.suffix,
-                  transaction.company_name,
-                  election_season.year,
-                  transaction.redact,
-                  ct.description
-                ORDER BY SUM(amount) DESC
-              ) AS ranked_list
-              ORDER BY year DESC, amount DESC
-            ) AS election_groups
-            WHERE rank < 11
-        """
-        if self.request.GET.get("entity_type") == "pac":
-            query = """
-                SELECT *, NULL AS year FROM (
-                  SELECT
-                    DENSE_RANK()
-                      OVER (
-                        ORDER BY amount DESC
-                      ) AS rank, *
-                  FROM (
-                    SELECT
-                      SUM(transaction.amount) AS amount,
-                      MAX(transaction.received_date) AS latest_date,
-                      transaction.name_prefix,
-                      transaction.first_name,
-                      transaction.middle_name,
-                      transaction.last_name,
-                      transaction.suffix,
-                      transaction.company_name,
-                      transaction.redact,
-                      ct.description
-                    FROM camp_fin_transaction AS transaction
-                    JOIN camp_fin_transactiontype AS tt
-                      ON transaction.transaction_type_id = tt.id
-                    JOIN camp_fin_filing AS f
-                      ON transaction.filing_id = f.id
-                    JOIN camp_fin_pac AS pac
-                      ON f.entity_id = pac.entity_id
-                    LEFT JOIN camp_fin_contact AS contact
-                      ON transaction.contact_id = contact.id
-                    LEFT JOIN camp_fin_contacttype AS ct
-                      ON contact.contact_type_id = ct.id
-                    WHERE tt.contribution = %s
-                      AND pac.id = %s
-                      AND transaction.received_date >= '2010-01-01'
-                    GROUP BY
-                      transaction.name_prefix,
-                      transaction.first_name,
-                      transaction.middle_name,
-                      transaction.last_name,
-                      transaction.suffix,
-                      transaction.company_name,
-                      transaction.redact,
-                      ct.description
-                    ORDER BY SUM(amount) DESC
-                  ) AS ranked_list
-                  ORDER BY amount DESC
-                ) AS election_groups
-                WHERE rank < 11
-            """
+def top_earners(days):
+    """
+    Return the candidates and PACs ranked by the contributions they received
+    in the last `days` days, or since 2010 if `days` is 0 or less. Standard
+    windows are read from their snapshot; other windows are queried live and
+    cached for TOP_EARNERS_CACHE_SECONDS.
+    """
+    days = max(days, 0)
 
-        cursor.execute(query, [self.contribution, pk])
+    if days in TOP_EARNERS_WINDOWS:
+        return TopEarner.objects.filter(days=days).order_by("rank", "-new_funds")
 
-        columns = [c[0] for c in cursor.description]
-        transaction_tuple = namedtuple("Transaction", columns)
+    def get_top_earners():
+        query, args = top_earners_query(days)
 
-        objects = [transaction_tuple(*r) for r in cursor]
+        with connection.cursor() as cursor:
+            cursor.execute(query, args)
+            columns = [c[0] for c in cursor.description]
 
-        serializer = TopMoneySerializer(objects, many=True)
+            return [TopEarner(days=days, **dict(zip(columns, row))) for row in cursor]
 
-        return Response(serializer.data)
+    return cache.get_or_set(
+        "top-earners:{}".format(days),
+        get_top_earners,
+        settings.TOP_EARNERS_CACHE_SECONDS,
+    )
 
 
 class TopEarnersBase(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        with connection.cursor() as cursor:
-            # Top earners
-            cursor.execute(
-                """
-              SELECT * FROM (
-                SELECT
-                  dense_rank() OVER (ORDER BY new_funds DESC) AS rank, *
-                FROM (
-                  SELECT
-                    MAX(COALESCE(c.slug, p.slug)) AS slug,
-                    MAX(COALESCE(c.full_name, p.name)) AS name,
-                    SUM(t.amount) AS new_funds,
-                    (array_agg(f.closing_balance ORDER BY f.id DESC))[1] AS current_funds,
-                    CASE WHEN p.id IS NULL
-                      THEN 'Candidate'
-                      ELSE 'PAC'
-                    END AS committee_type
-                    FROM camp_fin_transaction AS t
-                    JOIN camp_fin_transactiontype AS tt
-                      ON t.transaction_type_id = tt.id
-                    JOIN camp_fin_filing AS f
-                      ON t.filing_id = f.id
-                    LEFT JOIN camp_fin_pac AS p
-                      ON f.entity_id = p.entity_id
-                    LEFT JOIN camp_fin_candidate AS c
-                      ON f.entity_id = c.entity_id
-                    WHERE tt.contribution = TRUE
-                      AND t.received_date >= (NOW() - INTERVAL '90 days')
-                    GROUP BY c.id, p.id
-                  ) AS s
-                WHERE name NOT ILIKE '%public election fund%'
-                  OR name NOT ILIKE '%department of finance%'
-                ORDER BY new_funds DESC
-                LIMIT 10
-              ) AS s
-            """
-            )
-
-            columns = [c[0] for c in cursor.description]
-            transaction_tuple = namedtuple("Transaction", columns)
-            top_earners_objects = [transaction_tuple(*r) for r in cursor]
-
-        context["top_earners_objects"] = top_earners_objects
+        context["top_earners_objects"] = top_earners(90)[:10]
 
         return context
 
@@ -725,8 +551,194 @@ class PagesMixin(TemplateView):
         return context
 
 
-def iterate_cursor(header, cursor):
-    yield header
+def stream_query(query, args=None):
+    """
+    Yield the header, then each row, of the result of a query. Rows are read
+    from a named, server-side cursor BULK_DOWNLOAD_ITERSIZE rows at a time,
+    so memory use doesn't grow with the size of the result, and the first
+    rows can be sent before the query has been fully read.
+
+    The cursor is opened in a transaction, so that Postgres doesn't have to
+    materialize the whole result to hold the cursor open outside of one.
+    """
+    with transaction.atomic(), connection.chunked_cursor() as cursor:
+        cursor.cursor.itersize = settings.BULK_DOWNLOAD_ITERSIZE
+        cursor.execute(query, args or None)
+
+        # The description of a named cursor is only available once rows
+        # have been fetched
+        rows = iter(cursor)
+        first_row = next(rows, None)
+
+        yield [c[0] for c in cursor.description]
+
+        if first_row is not None:
+            yield first_row
+            yield from rows
+
+
+def stream_parquet(query, args=None, partition_by=None):
+    """
+    Yield the result of a query as chunks of a Parquet file, reading rows
+    from a named, server-side cursor like stream_query.
+    """
+    with transaction.atomic(), connection.chunked_cursor() as cursor:
+        cursor.cursor.itersize = settings.BULK_DOWNLOAD_ITERSIZE
+        cursor.execute(query, args or None)
+
+        yield from parquet_chunks(cursor, partition_by)
+
+
+class CopyCancelled(Exception):
+    pass
+
+
+class ChunkWriter(object):
+    """
+    File-like object that COPY writes to, which collects rows into chunks of
+    BULK_DOWNLOAD_CHUNK_SIZE bytes and puts them on a queue.
+    """
+
+    def __init__(self, chunks, cancelled):
+        self.chunks = chunks
+        self.cancelled = cancelled
+        self.buffer = []
+        self.size = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.size += len(data)
+
+        if self.size >= settings.BULK_DOWNLOAD_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+
+        chunk = b"".join(self.buffer)
+        self.buffer, self.size = [], 0
+
+        # Wait for the response to catch up, giving up if the client has
+        # gone away
+        while True:
+            if self.cancelled.is_set():
+                raise CopyCancelled
+
+            try:
+                self.chunks.put(chunk, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+
+def stream_copy(query, args=None):
+    """
+    Yield the result of a query as CSV, in chunks of bytes serialized by
+    Postgres with COPY (query) TO STDOUT WITH CSV HEADER.
+
+    COPY blocks until the whole result has been written, so it's run in a
+    thread, on that thread's own connection, and its output is handed back
+    through a bounded queue. The queue also keeps COPY from getting more than
+    a few chunks ahead of the client.
+    """
+    chunks = queue.Queue(maxsize=4)
+    cancelled = threading.Event()
+    done = object()
+
+    def copy():
+        try:
+            with connection.cursor() as cursor:
+                writer = ChunkWriter(chunks, cancelled)
+                copy_csv(cursor, query, args, writer)
+                writer.flush()
+
+            result = done
+        except CopyCancelled:
+            return
+        except Exception as e:
+            result = e
+        finally:
+            connection.close()
+
+        while not cancelled.is_set():
+            try:
+                chunks.put(result, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    thread = threading.Thread(target=copy, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            chunk = chunks.get()
+
+            if chunk is done:
+                return
+
+            if isinstance(chunk, Exception):
+                raise chunk
+
+            yield chunk
+    finally:
+        cancelled.set()
+
+
+def stream_csv(query, args=None):
+    """
+    Yield the result of a query as CSV. Postgres serializes the result with
+    COPY, unless we're inside a transaction, e.g., in tests, in which case
+    COPY's connection couldn't see the transaction's changes, and rows are
+    written with csv.writer instead.
+    """
+    if connection.in_atomic_block:
+        writer = csv.writer(Echo())
+        return (writer.writerow(row) for row in stream_query(query, args))
+
+    return stream_copy(query, args)
+
+
+def download_response(request, query, args, filename, export=None, partition_by=None):
+    """
+    Return a bulk download of the result of a query, as CSV or, given
+    format=parquet, as Parquet. If a pre-generated export is named and it
+    matches the request, the client is redirected to it on S3 or, if it's
+    only on disk, it's served from there. The filename, without an
+    extension, is formatted with the time the download was generated.
+    """
+    if request.GET.get("format") == "parquet":
+        format = "parquet"
+    else:
+        format = "csv"
+
+    filename = "{}.{}".format(filename, format)
+
+    if export:
+        start_date, end_date = request.GET.get("from"), request.GET.get("to")
+
+        url = find_uploaded_export(export, start_date, end_date, format=format)
+
+        if url and accepts_export(request, format):
+            return HttpResponseRedirect(url)
+
+        path = find_export(export, start_date, end_date, format=format)
+
+        if path:
+            response = serve_export(request, path, filename, format=format)
+
+            if response:
+                return response
+
+    if format == "parquet":
+        content = stream_parquet(query, args, partition_by)
+    else:
+        content = stream_csv(query, args)
+
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[format][0])
+    response["Content-Disposition"] = "attachment; filename={}".format(
+        filename.format(timezone.now().isoformat())
+    )
 
-    for row in cursor:
-        yield row
+    return response
@@ -0,0 +1,514 @@
+"""
+Pre-generated bulk exports.
+
+`build_bulk_exports` writes the result of each bulk download query to a
+gzip-compressed CSV in BULK_EXPORT_ROOT: one file for the whole dataset, and,
+for transactions, one file per year. It also writes a Parquet file for each
+dataset. When a bulk download request matches one of those files, i.e., it
+has no filters or asks for a whole calendar year, the file is served instead
+of running the query. Files are served with an ETag, Last-Modified and
+support for single byte ranges, so downloads can be resumed.
+
+When BULK_EXPORT_BUCKET is set, `build_bulk_exports` also uploads the files to
+S3 and records them as BulkExports, and matching requests are redirected to
+them there, since production web processes can't see the ETL's disk.
+"""
+import csv
+import gzip
+import io
+import os
+import re
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import chain
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+
+from camp_fin.models import BulkExport
+
+RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+BLOCK_SIZE = 65536
+
+# Parquet types of Postgres types, by OID. Anything else is written as a
+# string.
+PARQUET_TYPES = {
+    16: pa.bool_(),  # boolean
+    20: pa.int64(),  # bigint
+    21: pa.int16(),  # smallint
+    23: pa.int32(),  # integer
+    700: pa.float32(),  # real
+    701: pa.float64(),  # double precision
+    1700: pa.float64(),  # numeric
+    1082: pa.date32(),  # date
+    1114: pa.timestamp("us"),  # timestamp
+    1184: pa.timestamp("us", tz="UTC"),  # timestamp with time zone
+}
+
+EXTENSIONS = {
+    "csv": "csv.gz",
+    "parquet": "parquet",
+}
+
+# Content type and encoding of exports
+CONTENT_TYPES = {
+    "csv": ("text/csv", "gzip"),
+    "parquet": ("application/vnd.apache.parquet", None),
+}
+
+
+TIMESTAMP_FORMAT = """
+    to_char({0}, 'YYYY-MM-DD HH24:MI:SS')
+    || COALESCE(NULLIF(to_char({0}, '.US'), '.000000'), '')
+"""
+
+# SQL formatting values of Postgres types, by OID, as str() formats the values
+# psycopg2 reads them as, which is how csv.writer wrote bulk downloads before
+# they were written by COPY. Other types' text is already the same.
+CSV_FORMATS = {
+    16: "CASE WHEN {0} THEN 'True' WHEN NOT {0} THEN 'False' END",  # boolean
+    # double precision, with the .0 Python writes after whole numbers
+    701: """
+        {0}::text
+        || CASE WHEN {0} = trunc({0}) AND abs({0}) < 1e15 THEN '.0' ELSE '' END
+    """,
+    1114: TIMESTAMP_FORMAT,  # timestamp
+    # timestamp with time zone, in UTC, the time zone of Django's connections
+    1184: TIMESTAMP_FORMAT.format("({0} AT TIME ZONE 'UTC')") + " || '+00:00'",
+}
+
+# csv.writer doesn't quote empty strings, as COPY does, so they're made NULL
+CSV_TEXT = "NULLIF({0}::text, '')"
+
+
+def csv_query(cursor, query, args=None):
+    """
+    Wrap a query so that its columns are text formatted by CSV_FORMATS.
+    """
+    cursor.execute("SELECT * FROM ({}) AS q LIMIT 0".format(query), args or None)
+
+    columns = []
+
+    for column in cursor.description:
+        name = '"{}"'.format(column.name.replace('"', '""'))
+        format = CSV_FORMATS.get(column.type_code, "{0}")
+
+        columns.append(
+            "{} AS {}".format(CSV_TEXT.format(format.format("q." + name)), name)
+        )
+
+    return "SELECT {} FROM ({}) AS q".format(", ".join(columns), query)
+
+
+class CRLFWriter(object):
+    """
+    File-like object that COPY writes to, which passes rows on to another
+    with \r\n line endings, as csv.writer writes them, rather than \n.
+    Newlines within quoted values are left alone.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.quoted = False
+
+    def write(self, data):
+        parts = bytes(data).split(b'"')
+
+        for i, part in enumerate(parts):
+            if i:
+                self.quoted = not self.quoted
+
+            if not self.quoted:
+                parts[i] = part.replace(b"\n", b"\r\n")
+
+        self.file.write(b'"'.join(parts))
+
+
+def copy_csv(cursor, query, args, file):
+    """
+    Write the result of a query to a file as CSV, with COPY, formatted as
+    csv.writer would write it. COPY doesn't take parameters, so they're bound
+    client-side.
+    """
+    query = csv_query(cursor, query, args)
+
+    if args:
+        query = cursor.mogrify(query, args).decode("utf-8")
+
+    cursor.copy_expert(
+        "COPY ({}) TO STDOUT WITH CSV HEADER".format(query), CRLFWriter(file)
+    )
+
+
+def export_path(dataset, year=None, format="csv"):
+    if year:
+        filename = "{}-{}.{}".format(dataset, year, EXTENSIONS[format])
+    else:
+        filename = "{}.{}".format(dataset, EXTENSIONS[format])
+
+    return os.path.join(settings.BULK_EXPORT_ROOT, filename)
+
+
+@contextmanager
+def export_file(path, opener=open):
+    """
+    Open a file to write an export to. The file is written next to its
+    destination, then moved into place, so a half-written file is never
+    served.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    partial_path = path + ".partial"
+
+    with opener(partial_path, "wb") as f:
+        yield f
+
+    os.replace(partial_path, path)
+
+
+def write_export(cursor, path, query, args=None):
+    """
+    Write the result of a query to a gzip-compressed CSV.
+    """
+    with export_file(path, opener=gzip.open) as f:
+        copy_csv(cursor, query, args, f)
+
+
+class StreamSink(object):
+    """
+    File-like object that a ParquetWriter or ZipFile writes to, which holds
+    on to what has been written until it's read. It can't seek, so ZIP
+    entries are written with their sizes after their data.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self.buffer = []
+        self.position = 0
+        self.read_position = 0
+
+    def write(self, data):
+        self.buffer.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def read(self):
+        data = b"".join(self.buffer)
+        self.buffer = []
+        self.read_position = self.position
+        return data
+
+
+def parquet_column(values, type):
+    if type == pa.string():
+        values = [None if value is None else str(value) for value in values]
+    elif type == pa.float64():
+        values = [None if value is None else float(value) for value in values]
+
+    return pa.array(values, type=type)
+
+
+def partition_key(value):
+    if isinstance(value, datetime) and timezone.is_aware(value):
+        value = timezone.localtime(value)
+
+    return getattr(value, "year", None)
+
+
+def parquet_chunks(cursor, partition_by=None):
+    """
+    Yield the rows of an executed query as chunks of a Parquet file. Rows
+    are written in row groups of at most BULK_PARQUET_ROW_GROUP_SIZE rows, so
+    only one row group is held in memory at a time. If a column to partition
+    by is given, rows from different years of that column are never put in
+    the same row group; the query should be ordered by that column.
+    """
+    rows = iter(cursor)
+    first_row = next(rows, None)
+
+    # The description of a named cursor is only available once rows have
+    # been fetched
+    schema = pa.schema(
+        [
+            (column.name, PARQUET_TYPES.get(column.type_code, pa.string()))
+            for column in cursor.description
+        ]
+    )
+
+    if partition_by:
+        partition_index = schema.names.index(partition_by)
+
+    sink = StreamSink()
+    writer = pq.ParquetWriter(sink, schema)
+
+    def write_row_group(group):
+        columns = zip(*group)
+        writer.write_table(
+            pa.Table.from_arrays(
+                [
+                    parquet_column(list(values), field.type)
+                    for values, field in zip(columns, schema)
+                ],
+                schema=schema,
+            )
+        )
+        return sink.read()
+
+    group = []
+    group_key = None
+
+    if first_row is not None:
+        rows = chain([first_row], rows)
+
+    for row in rows:
+        key = partition_key(row[partition_index]) if partition_by else None
+
+        if group and (
+            key != group_key or len(group) >= settings.BULK_PARQUET_ROW_GROUP_SIZE
+        ):
+            yield write_row_group(group)
+            group = []
+
+        group.append(row)
+        group_key = key
+
+    if group:
+        yield write_row_group(group)
+
+    writer.close()
+
+    yield sink.read()
+
+
+def zip_chunks(entries):
+    """
+    Yield a ZIP archive of CSVs as chunks of about BULK_DOWNLOAD_CHUNK_SIZE
+    bytes, given (filename, rows) pairs, where rows yields a header and then
+    each row. Each CSV is compressed as its rows are read, so only a chunk
+    of the archive is held in memory at a time. Entries without rows are
+    left out.
+    """
+    sink = StreamSink()
+
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zf:
+        for filename, rows in entries:
+            rows = iter(rows)
+            header = next(rows)
+            first_row = next(rows, None)
+
+            if first_row is None:
+                continue
+
+            # Entry sizes aren't known up front, so allow for large ones
+            with io.TextIOWrapper(
+                zf.open(filename, "w", force_zip64=True), encoding="utf-8", newline=""
+            ) as entry:
+                writer = csv.writer(entry)
+                writer.writerow(header)
+
+                for row in chain([first_row], rows):
+                    writer.writerow(row)
+
+                    if sink.tell() - sink.read_position >= (
+                        settings.BULK_DOWNLOAD_CHUNK_SIZE
+                    ):
+                        yield sink.read()
+
+    yield sink.read()
+
+
+def export_year(start_date=None, end_date=None, format="csv"):
+    """
+    Return the year of the export matching a bulk download between two dates,
+    None if the export of the whole dataset matches, or False if no export
+    does. Parquet exports aren't split by year, since their row groups
+    already are.
+    """
+    if not start_date and not end_date:
+        return None
+
+    if format != "csv":
+        return False
+
+    year = (start_date or "")[:4]
+
+    if (
+        not year.isdigit()
+        or start_date != "{}-01-01".format(year)
+        or end_date != "{}-12-31".format(year)
+    ):
+        return False
+
+    return int(year)
+
+
+def find_export(dataset, start_date=None, end_date=None, format="csv"):
+    """
+    Return the path of the export matching a bulk download of a dataset
+    between two dates, or None if there isn't one.
+    """
+    year = export_year(start_date, end_date, format)
+
+    if year is False:
+        return None
+
+    path = export_path(dataset, year, format=format)
+
+    if os.path.exists(path):
+        return path
+
+    return None
+
+
+def find_uploaded_export(dataset, start_date=None, end_date=None, format="csv"):
+    """
+    Return the URL of the export uploaded to S3 matching a bulk download of a
+    dataset between two dates, or None if there isn't one.
+    """
+    year = export_year(start_date, end_date, format)
+
+    if year is False:
+        return None
+
+    export = BulkExport.objects.filter(
+        dataset=dataset, year=year, format=format
+    ).first()
+
+    return export.url if export else None
+
+
+def accepts_export(request, format="csv"):
+    """
+    Return whether the client accepts the encoding exports of a format are
+    sent with.
+    """
+    encoding = CONTENT_TYPES[format][1]
+
+    return not encoding or encoding in request.META.get("HTTP_ACCEPT_ENCODING", "")
+
+
+def get_range(request, size, etag, last_modified):
+    """
+    Return the (start, end) offsets of the byte range requested, None if the
+    whole file should be sent, or False if the range can't be satisfied.
+    Only single ranges are supported; anything else gets the whole file.
+    """
+    match = RANGE.fullmatch(request.META.get("HTTP_RANGE", "").strip())
+
+    if not match or not any(match.groups()):
+        return None
+
+    # Only send part of the file if it hasn't changed since the client got
+    # the rest of it
+    if_range = request.META.get("HTTP_IF_RANGE")
+
+    if (
+        if_range
+        and if_range != etag
+        and parse_http_date_safe(if_range) != int(last_modified)
+    ):
+        return None
+
+    first, last = match.groups()
+
+    if not first:
+        # The last N bytes
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+
+    if start >= size or start > end:
+        return False
+
+    return start, end
+
+
+def read_range(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+
+        while length > 0:
+            block = f.read(min(BLOCK_SIZE, length))
+
+            if not block:
+                return
+
+            length -= len(block)
+            yield block
+
+
+def serve_export(request, path, filename, format="csv"):
+    """
+    Return a response sending a pre-generated export, or None if the client
+    doesn't accept the export's encoding. CSVs are sent with gzip content
+    encoding. The filename is formatted with the time the export was built.
+    """
+    content_type, encoding = CONTENT_TYPES[format]
+
+    if not accepts_export(request, format):
+        return None
+
+    stat = os.stat(path)
+    etag = '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_size)
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime)
+    )
+
+    if response is None:
+        byte_range = get_range(request, stat.st_size, etag, stat.st_mtime)
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = "bytes */{}".format(stat.st_size)
+            return response
+
+        start, end = byte_range or (0, stat.st_size - 1)
+        length = end - start + 1
+
+        response = StreamingHttpResponse(
+            read_range(path, start, length), content_type=content_type
+        )
+
+        if byte_range:
+            response.status_code = 206
+            response["Content-Range"] = "bytes {}-{}/{}".format(
+                start, end, stat.st_size
+            )
+
+        response["Content-Length"] = length
+
+        if encoding:
+            response["Content-Encoding"] = encoding
+
+        # Name the file after the time it was built, rather than the time
+        # it was requested
+        built = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+        response["Content-Disposition"] = "attachment; filename={}".format(
+            filename.format(timezone.localtime(built).isoformat())
+        )
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(stat.st_mtime)
+    response["Accept-Ranges"] = "bytes"
+    patch_vary_headers(response, ("Accept-Encoding",))
+
+    return response
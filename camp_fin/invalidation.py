@@ -0,0 +1,260 @@
+"""
+Versioned invalidation for the site-wide page cache.
+
+Every cached page belongs to a few groups: all pages belong to ALL, detail
+pages for candidates, committees and organizations belong to a group for that
+object, and every other page belongs to LISTINGS. The versions of a page's
+groups are part of its cache key, so bumping the version of a group
+invalidates the pages in it without clearing the rest of the cache.
+
+Model changes are translated into groups by `groups_for_instance`, then
+expanded to page groups in bulk when invalidations are flushed. Invalidations
+are batched for the length of a request (see `camp_fin.middleware`), and
+suppressed entirely during bulk updates such as imports, which invalidate
+every page once when they finish.
+"""
+import threading
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.urls import Resolver404, resolve
+
+ALL = "all"
+LISTINGS = "listings"
+
+VERSION_KEY = "cache-version:{}"
+
+# URL names of detail pages, and the group their slug belongs to
+PAGE_GROUPS = {
+    "candidate-detail": "candidate",
+    "committee-detail": "committee",
+    "organization-detail": "organization",
+}
+
+_state = threading.local()
+
+
+def _new_version():
+    return uuid.uuid4().hex[:12]
+
+
+def page_groups(path):
+    """
+    Return the groups of the page at the given path.
+    """
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return [ALL, LISTINGS]
+
+    group = PAGE_GROUPS.get(match.url_name)
+
+    if group and "slug" in match.kwargs:
+        return [ALL, f"{group}:{match.kwargs['slug']}"]
+
+    return [ALL, LISTINGS]
+
+
+def get_versions(groups):
+    """
+    Return the current version of each group. A group without a version,
+    e.g., because its version was culled from the cache, is given a new one,
+    so that it can't match pages cached under an earlier version.
+    """
+    keys = {group: VERSION_KEY.format(group) for group in groups}
+    versions = cache.get_many(keys.values())
+
+    for group, key in keys.items():
+        if key not in versions:
+            cache.add(key, _new_version(), None)
+            versions[key] = cache.get(key) or ""
+
+    return [versions[keys[group]] for group in groups]
+
+
+def page_key_prefix(request, key_prefix=""):
+    """
+    Return the prefix for the cache keys of a page, including the versions of
+    the groups it belongs to.
+    """
+    versions = get_versions(page_groups(request.path_info))
+    return ".".join([key_prefix] + versions)
+
+
+def groups_for_instance(instance):
+    """
+    Return the groups invalidated by a change to a model instance. Groups
+    named after a related object's ID, e.g., "entity-id:1", are expanded to
+    page groups when invalidations are flushed.
+    """
+    from camp_fin import models
+
+    if isinstance(instance, models.Entity):
+        return {f"entity-id:{instance.pk}"}
+
+    if isinstance(instance, models.Candidate):
+        return {f"candidate:{instance.slug}", f"entity-id:{instance.entity_id}"}
+
+    if isinstance(instance, models.PAC):
+        return {f"committee:{instance.slug}", f"entity-id:{instance.entity_id}"}
+
+    if isinstance(instance, models.Organization):
+        return {f"organization:{instance.slug}", f"entity-id:{instance.entity_id}"}
+
+    if isinstance(instance, models.Campaign):
+        return {
+            f"candidate-id:{instance.candidate_id}",
+            f"pac-id:{instance.committee_id}",
+        }
+
+    if isinstance(instance, models.Race):
+        return {f"race-id:{instance.pk}"}
+
+    if isinstance(instance, models.Filing):
+        return {f"entity-id:{instance.entity_id}"}
+
+    if isinstance(
+        instance,
+        (models.Transaction, models.Loan, models.LoanTransaction, models.SpecialEvent),
+    ):
+        return {f"filing-id:{instance.filing_id}"}
+
+    return {ALL}
+
+
+def expand_groups(groups):
+    """
+    Expand groups named after related objects' IDs into the page groups of
+    the candidates, committees and organizations they concern, using a few
+    bulk queries.
+    """
+    from camp_fin import models
+
+    ids = defaultdict(set)
+    expanded = set()
+
+    for group in groups:
+        kind, _, value = group.partition(":")
+
+        if kind.endswith("-id"):
+            if value not in ("", "None"):
+                ids[kind].add(int(value))
+        else:
+            expanded.add(group)
+
+    if ids["race-id"]:
+        for candidate_id, committee_id in models.Campaign.objects.filter(
+            active_race_id__in=ids["race-id"]
+        ).values_list("candidate_id", "committee_id"):
+            ids["candidate-id"].add(candidate_id)
+            ids["pac-id"].add(committee_id)
+
+    if ids["filing-id"]:
+        ids["entity-id"] |= set(
+            models.Filing.objects.filter(id__in=ids["filing-id"]).values_list(
+                "entity_id", flat=True
+            )
+        )
+
+    for group, model, kind in (
+        ("candidate", models.Candidate, "candidate-id"),
+        ("committee", models.PAC, "pac-id"),
+    ):
+        if ids[kind]:
+            expanded |= {
+                f"{group}:{slug}"
+                for slug in model.objects.filter(id__in=ids[kind]).values_list(
+                    "slug", flat=True
+                )
+            }
+
+    if ids["entity-id"]:
+        for group, model in (
+            ("candidate", models.Candidate),
+            ("committee", models.PAC),
+            ("organization", models.Organization),
+        ):
+            expanded |= {
+                f"{group}:{slug}"
+                for slug in model.objects.filter(
+                    entity_id__in=ids["entity-id"]
+                ).values_list("slug", flat=True)
+            }
+
+    return expanded
+
+
+def flush(groups):
+    """
+    Bump the versions of the given groups. Any change to a detail page may be
+    reflected in listings, so LISTINGS is bumped along with any other group,
+    and only ALL is bumped when everything is invalidated.
+    """
+    if not groups:
+        return
+
+    if ALL in groups:
+        groups = {ALL}
+    else:
+        groups = expand_groups(groups) | {LISTINGS}
+
+    cache.set_many(
+        {VERSION_KEY.format(group): _new_version() for group in groups}, None
+    )
+
+
+def invalidate(*groups):
+    """
+    Invalidate the pages in the given groups, or add them to the current
+    batch of invalidations, if there is one.
+    """
+    if getattr(_state, "suppressed", 0):
+        return
+
+    if getattr(_state, "batch", None) is not None:
+        _state.batch.update(groups)
+    else:
+        flush(set(groups))
+
+
+def invalidate_instance(instance):
+    invalidate(*groups_for_instance(instance))
+
+
+@contextmanager
+def batch_invalidation():
+    """
+    Collect invalidations made inside the block, and flush them once when
+    the outermost batch exits.
+    """
+    outermost = getattr(_state, "batch", None) is None
+
+    if outermost:
+        _state.batch = set()
+
+    try:
+        yield
+    finally:
+        if outermost:
+            groups, _state.batch = _state.batch, None
+            flush(groups)
+
+
+@contextmanager
+def bulk_update():
+    """
+    Ignore model changes inside the block, then invalidate every page once
+    when the outermost bulk update exits. Use this around imports and other
+    commands that save many objects.
+    """
+    _state.suppressed = getattr(_state, "suppressed", 0) + 1
+
+    try:
+        yield
+    finally:
+        _state.suppressed -= 1
+
+        if not _state.suppressed:
+            invalidate(ALL)
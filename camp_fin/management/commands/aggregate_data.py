@@ -1,6 +1,243 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 from django.core.management.base import BaseCommand
-from django.db import connections, transaction
-from django.db.utils import ProgrammingError
+from django.db import connection, connections, transaction
+from django.db.models import Max
+
+from camp_fin.aggregates import INTERVALS, TOP_EARNERS_WINDOWS, top_earners_query
+from camp_fin.models import AggregateChange, TopMoney
+
+# Sums of transactions by entity and interval, with placeholders for the
+# interval and for conditions to add to each source of transactions
+SUMMARY_QUERIES = {
+    "contributions": """
+        SELECT
+            SUM(amount) AS amount,
+            entity_id,
+            {interval}
+        FROM (
+            SELECT
+              SUM(t.amount) AS amount,
+              f.entity_id,
+              MAX(date_trunc('{interval}', t.received_date)) AS {interval}
+            FROM camp_fin_transaction AS t
+            JOIN camp_fin_transactiontype AS tt
+              ON t.transaction_type_id = tt.id
+            JOIN camp_fin_filing AS f
+              ON t.filing_id = f.id
+            WHERE tt.contribution = TRUE
+              AND tt.description in (
+                'Monetary Contribution',
+                'Anonymous Contribution'
+              )
+              {where_transaction}
+            GROUP BY f.entity_id, date_trunc('{interval}', t.received_date)
+            UNION
+            SELECT
+              SUM(l.amount) AS amount,
+              f.entity_id,
+              MAX(date_trunc('{interval}', l.received_date)) AS {interval}
+            FROM camp_fin_loan AS l
+            JOIN camp_fin_filing AS f
+              ON l.filing_id = f.id
+            WHERE TRUE
+              {where_loan}
+            GROUP BY f.entity_id, date_trunc('{interval}', l.received_date)
+        ) contributions_and_loans
+            GROUP BY entity_id, {interval}
+    """,
+    "expenditures": """
+          SELECT
+            entity_id,
+            SUM(amount) AS amount,
+            {interval}
+          FROM (
+            SELECT
+              f.entity_id,
+              SUM(e.amount) AS amount,
+              date_trunc('{interval}', e.received_date) AS {interval}
+            FROM camp_fin_transaction AS e
+            JOIN camp_fin_transactiontype AS tt
+              ON e.transaction_type_id = tt.id
+            JOIN camp_fin_filing AS f
+              ON e.filing_id = f.id
+            JOIN camp_fin_filingperiod AS fp
+              ON f.filing_period_id = fp.id
+            WHERE tt.contribution = FALSE
+              AND f.filed_date >= '2010-01-01'
+              {where_transaction}
+            GROUP BY f.entity_id, date_trunc('{interval}', e.received_date)
+
+            UNION
+
+            SELECT
+              f.entity_id,
+              SUM(lt.amount) AS amount,
+              date_trunc('{interval}', lt.transaction_date) AS {interval}
+            FROM camp_fin_loantransaction AS lt
+            JOIN camp_fin_loantransactiontype AS ltt
+              ON lt.transaction_type_id = ltt.id
+            JOIN camp_fin_filing AS f
+              ON lt.filing_id = f.id
+            JOIN camp_fin_filingperiod AS fp
+              ON f.filing_period_id = fp.id
+            WHERE ltt.description = 'Payment'
+              AND f.filed_date >= '2010-01-01'
+              {where_loan}
+            GROUP BY f.entity_id, date_trunc('{interval}', lt.transaction_date)
+          ) AS s
+          GROUP BY entity_id, {interval}
+    """,
+}
+
+# Date columns of the sources of transactions in each summary query
+SUMMARY_DATES = {
+    "contributions": ("t.received_date", "l.received_date"),
+    "expenditures": ("e.received_date", "lt.transaction_date"),
+}
+
+AGGREGATE_TABLES = [
+    "{}_by_{}".format(transaction_type, interval)
+    for interval in INTERVALS
+    for transaction_type in SUMMARY_QUERIES
+]
+
+# Number of ranks of donors or payees kept in camp_fin_topmoney for each partition
+TOP_MONEY_RANKS = 10
+
+# Totals by donor or payee ranked in camp_fin_topmoney, with placeholders for the
+# candidate or PAC of each partition, the election year, the latest date of
+# each donor's transactions, joins and conditions
+TOP_MONEY_QUERY = """
+    INSERT INTO camp_fin_topmoney (
+        scope,
+        scope_id,
+        contribution,
+        rank,
+        amount,
+        latest_date,
+        name_prefix,
+        first_name,
+        middle_name,
+        last_name,
+        suffix,
+        company_name,
+        year,
+        redact,
+        description
+    )
+    SELECT *
+    FROM (
+      SELECT
+        %(scope)s,
+        scope_id,
+        %(contribution)s,
+        DENSE_RANK() OVER (
+          PARTITION BY scope_id, year
+          ORDER BY amount DESC
+        ) AS rank,
+        amount,
+        latest_date,
+        name_prefix,
+        first_name,
+        middle_name,
+        last_name,
+        suffix,
+        company_name,
+        year,
+        redact,
+        description
+      FROM (
+        SELECT
+          {scope_id}::integer AS scope_id,
+          SUM(transaction.amount) AS amount,
+          {latest_date}::timestamp with time zone AS latest_date,
+          transaction.name_prefix,
+          transaction.first_name,
+          transaction.middle_name,
+          transaction.last_name,
+          transaction.suffix,
+          transaction.company_name,
+          {year}::varchar AS year,
+          transaction.redact,
+          ct.description
+        FROM camp_fin_transaction AS transaction
+        JOIN camp_fin_transactiontype AS tt
+          ON transaction.transaction_type_id = tt.id
+        JOIN camp_fin_filing AS f
+          ON transaction.filing_id = f.id
+        {joins}
+        LEFT JOIN camp_fin_contact AS contact
+          ON transaction.contact_id = contact.id
+        LEFT JOIN camp_fin_contacttype AS ct
+          ON contact.contact_type_id = ct.id
+        WHERE tt.contribution = %(contribution)s
+          {where}
+        -- By position, since the scope and year may be constants
+        GROUP BY
+          1,
+          transaction.name_prefix,
+          transaction.first_name,
+          transaction.middle_name,
+          transaction.last_name,
+          transaction.suffix,
+          transaction.company_name,
+          10,
+          transaction.redact,
+          ct.description
+      ) AS totals
+    ) AS ranked
+    WHERE rank <= %(ranks)s
+"""
+
+CAMPAIGN_JOINS = """
+    JOIN camp_fin_campaign AS c
+      ON f.campaign_id = c.id
+    JOIN camp_fin_electionseason AS election_season
+      ON c.election_season_id = election_season.id
+"""
+
+# Partitions of camp_fin_topmoney: "year" ranks everyone's donors or payees by
+# election year, "all" ranks them over all time, and "candidate" and "pac"
+# rank those of each candidate by election year and each PAC over all time
+TOP_MONEY_SCOPES = {
+    "year": {
+        "scope_id": "NULL",
+        "latest_date": "NULL",
+        "year": "election_season.year",
+        "joins": CAMPAIGN_JOINS,
+        "where": "AND election_season.year >= '2010'",
+    },
+    "all": {
+        "scope_id": "NULL",
+        "latest_date": "MAX(transaction.received_date)",
+        "year": "NULL",
+        "joins": "",
+        "where": "AND transaction.received_date >= '2010-01-01'",
+    },
+    "candidate": {
+        "scope_id": "c.candidate_id",
+        "latest_date": "MAX(transaction.received_date)",
+        "year": "election_season.year",
+        "joins": CAMPAIGN_JOINS,
+        "where": """
+            AND c.candidate_id IS NOT NULL
+            AND transaction.received_date >= '2010-01-01'
+        """,
+    },
+    "pac": {
+        "scope_id": "pac.id",
+        "latest_date": "MAX(transaction.received_date)",
+        "year": "NULL",
+        "joins": """
+            JOIN camp_fin_pac AS pac
+              ON f.entity_id = pac.entity_id
+        """,
+        "where": "AND transaction.received_date >= '2010-01-01'",
+    },
+}
 
 
 class Command(BaseCommand):
@@ -13,170 +250,314 @@ class Command(BaseCommand):
             action="store_true",
             help="Drop and recreate materialized views. Helpful when the underlying query changes.",
         )
+        parser.add_argument(
+            "--full",
+            dest="full",
+            action="store_true",
+            help=(
+                "Rebuild the transaction aggregates from scratch, rather than "
+                "only updating the entities and years logged as changed"
+            ),
+        )
+        parser.add_argument(
+            "--workers",
+            dest="workers",
+            type=int,
+            default=4,
+            help="Number of aggregates to refresh at once, each on its own connection",
+        )
 
     def handle(self, *args, **options):
+        full = options["full"]
+
         self.makeLoanBalanceView(options["recreate_views"])
-        self.makeTransactionAggregates(options["recreate_views"])
-        self.stdout.write(self.style.SUCCESS("Aggregates complete!"))
 
-    def makeTransactionAggregates(self, recreate_views):
-        for interval in ["day", "week", "month"]:
-            if recreate_views:
-                self.executeTransaction(
-                    """
-                    DROP MATERIALIZED VIEW IF EXISTS contributions_by_{}
-                """.format(
-                        interval
-                    )
-                )
+        if self.makeAggregateTables(options["recreate_views"]):
+            full = True
 
-                self.executeTransaction(
-                    """
-                    DROP MATERIALIZED VIEW IF EXISTS expenditures_by_{}
-                """.format(
-                        interval
+        # Only consume the changes logged so far, so that changes logged while
+        # the aggregates are updated are left for the next run
+        last_change_id = AggregateChange.objects.aggregate(Max("id"))["id__max"]
+
+        # The leaderboards are empty until they're first built
+        rebuild_top_money = (
+            full or last_change_id is not None or not TopMoney.objects.exists()
+        )
+
+        # Top earners are ranked over windows ending now, so they're refreshed
+        # even when nothing has changed
+        refreshes = [
+            ("current_loan_status", self.refreshLoanBalanceView),
+            ("top_earners", self.refreshTopEarners),
+        ]
+
+        if full or last_change_id is not None:
+            for interval in INTERVALS:
+                for transaction_type in SUMMARY_QUERIES:
+                    if full:
+                        refresh = partial(
+                            self.rebuildAggregateTable, transaction_type, interval
+                        )
+                    else:
+                        refresh = partial(
+                            self.updateAggregateTable,
+                            transaction_type,
+                            interval,
+                            last_change_id,
+                        )
+
+                    refreshes.append(
+                        ("{}_by_{}".format(transaction_type, interval), refresh)
                     )
+        else:
+            self.stdout.write("No changes to aggregate")
+
+        if rebuild_top_money:
+            for name, contribution in (("top_donors", True), ("top_expenses", False)):
+                refreshes.append((name, partial(self.rebuildTopMoney, contribution)))
+
+        self.runRefreshes(refreshes, options["workers"])
+
+        if last_change_id is not None:
+            AggregateChange.objects.filter(id__lte=last_change_id).delete()
+
+        self.stdout.write(self.style.SUCCESS("Aggregates complete!"))
+
+    def runRefreshes(self, refreshes, workers):
+        """
+        Run each refresh in its own transaction. Refreshes are independent,
+        so they're run in parallel on separate connections, unless we're
+        inside a transaction, whose changes other connections couldn't see.
+        """
+        if workers > 1 and not connection.in_atomic_block:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(self.timeRefresh, name, refresh, True)
+                    for name, refresh in refreshes
+                ]
+
+                for future in futures:
+                    future.result()
+        else:
+            for name, refresh in refreshes:
+                self.timeRefresh(name, refresh)
+
+    def timeRefresh(self, name, refresh, close_connection=False):
+        start = time.perf_counter()
+
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute("SET LOCAL timezone TO 'America/Denver'")
+                refresh(cursor)
+        finally:
+            # Threads' connections aren't closed by Django
+            if close_connection:
+                connection.close()
+
+        self.stdout.write(f"Refreshed {name} in {time.perf_counter() - start:.2f}s")
+
+    def makeAggregateTables(self, recreate_views):
+        """
+        Create the contributions_by_* and expenditures_by_* tables that don't
+        exist, replacing the materialized views they used to be. Each has a
+        row for every day, week or month in which an entity had transactions;
+        intervals without transactions are filled in when the tables are read
+        (see camp_fin.aggregates). Returns True if any table was created.
+        """
+        created = False
+
+        with connection.cursor() as cursor:
+            for table in AGGREGATE_TABLES:
+                cursor.execute(
+                    "SELECT relkind FROM pg_class WHERE relname = %s", [table]
                 )
+                row = cursor.fetchone()
 
-            continuous_interval_query = """
-                CREATE MATERIALIZED VIEW {transaction_type}_by_{interval} AS (
-                    WITH {interval}_summaries AS (
-                        {summary_query}
+                if row and (row[0] == "m" or recreate_views):
+                    self.executeTransaction(
+                        "DROP {} {}".format(
+                            "MATERIALIZED VIEW" if row[0] == "m" else "TABLE", table
+                        )
                     )
-                    SELECT
-                        continuous_interval.entity_id,
-                        continuous_interval.{interval},
-                        COALESCE({interval}_summaries.amount, 0) AS amount
-                    FROM (
-                        SELECT DISTINCT
-                            entity_id,
-                            generate_series(
-                                MIN({interval}) OVER (PARTITION BY entity_id),
-                                MAX({interval}) OVER (PARTITION BY entity_id),
-                                '1 {interval}'
-                            ) AS {interval}
-                        FROM {interval}_summaries
-                    ) continuous_interval
-                    LEFT JOIN {interval}_summaries
-                    USING (entity_id, {interval})
-                    ORDER BY entity_id, {interval}
-                )
+                    row = None
+
+                if row is None:
+                    self.createAggregateTable(table)
+                    created = True
+
+        return created
+
+    def createAggregateTable(self, table):
+        interval = table.rsplit("_", 1)[1]
+
+        self.executeTransaction(
             """
+            CREATE TABLE {table} (
+                entity_id INTEGER NOT NULL,
+                {interval} TIMESTAMP WITH TIME ZONE NOT NULL,
+                amount DOUBLE PRECISION NOT NULL,
+                PRIMARY KEY (entity_id, {interval})
+            )
+        """.format(
+                table=table, interval=interval
+            )
+        )
 
-            try:
-                self.executeTransaction(
-                    """
-                    REFRESH MATERIALIZED VIEW contributions_by_{}
-                """.format(
-                        interval
-                    )
-                )
-            except ProgrammingError:
-                summary_query = """
-                    SELECT
-                        SUM(amount) AS amount,
-                        entity_id,
-                        {interval}
-                    FROM (
-                        SELECT
-                          SUM(t.amount) AS amount,
-                          f.entity_id,
-                          MAX(date_trunc('{interval}', t.received_date)) AS {interval}
-                        FROM camp_fin_transaction AS t
-                        JOIN camp_fin_transactiontype AS tt
-                          ON t.transaction_type_id = tt.id
-                        JOIN camp_fin_filing AS f
-                          ON t.filing_id = f.id
-                        WHERE tt.contribution = TRUE
-                          AND tt.description in (
-                            'Monetary Contribution',
-                            'Anonymous Contribution'
-                          )
-                        GROUP BY f.entity_id, date_trunc('{interval}', t.received_date)
-                        UNION
-                        SELECT
-                          SUM(l.amount) AS amount,
-                          f.entity_id,
-                          MAX(date_trunc('{interval}', l.received_date)) AS {interval}
-                        FROM camp_fin_loan AS l
-                        JOIN camp_fin_filing AS f
-                          ON l.filing_id = f.id
-                        GROUP BY f.entity_id, date_trunc('{interval}', l.received_date)
-                    ) contributions_and_loans
-                        GROUP BY entity_id, {interval}
-                """.format(
-                    interval=interval
-                )
+    def summaryQuery(self, transaction_type, interval, where=""):
+        """
+        Return the summary query for a type of transaction and an interval,
+        adding a condition, formatted with the name of the date column, to
+        each source of transactions.
+        """
+        transaction_date, loan_date = SUMMARY_DATES[transaction_type]
 
-                view = continuous_interval_query.format(
-                    transaction_type="contributions",
-                    summary_query=summary_query,
-                    interval=interval,
-                )
+        return SUMMARY_QUERIES[transaction_type].format(
+            interval=interval,
+            where_transaction=where.format(date=transaction_date),
+            where_loan=where.format(date=loan_date),
+        )
 
-                self.executeTransaction(view)
+    def rebuildAggregateTable(self, transaction_type, interval, cursor):
+        table = "{}_by_{}".format(transaction_type, interval)
 
-            try:
-                self.executeTransaction(
-                    """
-                    REFRESH MATERIALIZED VIEW expenditures_by_{}
-                """.format(
-                        interval
-                    )
-                )
-            except ProgrammingError:
-                summary_query = """
-                      SELECT
-                        entity_id,
-                        SUM(amount) AS amount,
-                        {interval}
-                      FROM (
-                        SELECT
-                          filing.entity_id,
-                          SUM(e.amount) AS amount,
-                          date_trunc('{interval}', e.received_date) AS {interval}
-                        FROM camp_fin_transaction AS e
-                        JOIN camp_fin_transactiontype AS tt
-                          ON e.transaction_type_id = tt.id
-                        JOIN camp_fin_filing AS filing
-                          ON e.filing_id = filing.id
-                        JOIN camp_fin_filingperiod AS fp
-                          ON filing.filing_period_id = fp.id
-                        WHERE tt.contribution = FALSE
-                          AND filing.filed_date >= '2010-01-01'
-                        GROUP BY filing.entity_id, date_trunc('{interval}', e.received_date)
-
-                        UNION
-
-                        SELECT
-                          filing.entity_id,
-                          SUM(lt.amount) AS amount,
-                          date_trunc('{interval}', lt.transaction_date) AS {interval}
-                        FROM camp_fin_loantransaction AS lt
-                        JOIN camp_fin_loantransactiontype AS ltt
-                          ON lt.transaction_type_id = ltt.id
-                        JOIN camp_fin_filing AS filing
-                          ON lt.filing_id = filing.id
-                        JOIN camp_fin_filingperiod AS fp
-                          ON filing.filing_period_id = fp.id
-                        WHERE ltt.description = 'Payment'
-                          AND filing.filed_date >= '2010-01-01'
-                        GROUP BY filing.entity_id, date_trunc('{interval}', lt.transaction_date)
-                      ) AS s
-                      GROUP BY entity_id, {interval}
-                """.format(
-                    interval=interval
-                )
+        # Unlike TRUNCATE, DELETE doesn't lock out readers, who see the old
+        # rows until the rebuild is committed
+        cursor.execute("DELETE FROM {}".format(table))
 
-                view = continuous_interval_query.format(
-                    transaction_type="expenditures",
-                    summary_query=summary_query,
-                    interval=interval,
-                )
+        cursor.execute(
+            """
+            INSERT INTO {table} (entity_id, {interval}, amount)
+            SELECT entity_id, {interval}, amount
+            FROM ({summary_query}) AS summaries
+        """.format(
+                table=table,
+                interval=interval,
+                summary_query=self.summaryQuery(transaction_type, interval),
+            )
+        )
+
+    def updateAggregateTable(self, transaction_type, interval, last_change_id, cursor):
+        """
+        Recompute the intervals of a table that overlap the entity years
+        logged in AggregateChange.
+        """
+        table = "{}_by_{}".format(transaction_type, interval)
+
+        cursor.execute(
+            """
+            CREATE TEMPORARY TABLE changed_intervals ON COMMIT DROP AS
+            SELECT DISTINCT
+                entity_id,
+                date_trunc(
+                    '{interval}', make_date(year, 1, 1)::timestamptz
+                ) AS start,
+                make_date(year + 1, 1, 1)::timestamptz AS stop
+            FROM camp_fin_aggregatechange
+            WHERE id <= %s
+        """.format(
+                interval=interval
+            ),
+            [last_change_id],
+        )
+
+        cursor.execute(
+            """
+            DELETE FROM {table} AS aggregate
+            USING changed_intervals AS changed
+            WHERE aggregate.entity_id = changed.entity_id
+              AND aggregate.{interval} >= changed.start
+              AND aggregate.{interval} < changed.stop
+        """.format(
+                table=table, interval=interval
+            )
+        )
+
+        # Restrict the summary to the changed intervals of each entity
+        where = """
+            AND EXISTS (
+              SELECT 1
+              FROM changed_intervals AS changed
+              WHERE changed.entity_id = f.entity_id
+                AND date_trunc('{interval}', {{date}}) >= changed.start
+                AND date_trunc('{interval}', {{date}}) < changed.stop
+            )
+        """.format(
+            interval=interval
+        )
+
+        cursor.execute(
+            """
+            INSERT INTO {table} (entity_id, {interval}, amount)
+            SELECT entity_id, {interval}, amount
+            FROM ({summary_query}) AS summaries
+        """.format(
+                table=table,
+                interval=interval,
+                summary_query=self.summaryQuery(transaction_type, interval, where),
+            )
+        )
+
+        cursor.execute("DROP TABLE changed_intervals")
+
+    def rebuildTopMoney(self, contribution, cursor):
+        """
+        Rank the donors (or payees) of every partition of camp_fin_topmoney. Only the
+        top TOP_MONEY_RANKS ranks of each partition are kept.
+        """
+        cursor.execute(
+            "DELETE FROM camp_fin_topmoney WHERE contribution = %s", [contribution]
+        )
+
+        for scope, parts in TOP_MONEY_SCOPES.items():
+            cursor.execute(
+                TOP_MONEY_QUERY.format(**parts),
+                {
+                    "scope": scope,
+                    "contribution": contribution,
+                    "ranks": TOP_MONEY_RANKS,
+                },
+            )
+
+    def refreshTopEarners(self, cursor):
+        """
+        Snapshot the top earners of each of TOP_EARNERS_WINDOWS.
+        """
+        cursor.execute("DELETE FROM camp_fin_topearner")
 
-                self.executeTransaction(view)
+        for days in TOP_EARNERS_WINDOWS:
+            query, args = top_earners_query(days)
+
+            cursor.execute(
+                """
+                INSERT INTO camp_fin_topearner (
+                    days,
+                    rank,
+                    slug,
+                    name,
+                    new_funds,
+                    current_funds,
+                    committee_type
+                )
+                SELECT
+                    %s,
+                    rank,
+                    slug,
+                    name,
+                    new_funds,
+                    current_funds,
+                    committee_type
+                FROM ({}) AS top_earners
+            """.format(
+                    query
+                ),
+                [days] + args,
+            )
 
     def makeLoanBalanceView(self, recreate_views):
+        """
+        Create current_loan_status, if it doesn't exist, with the unique index
+        needed to refresh it concurrently.
+        """
         if recreate_views:
             self.executeTransaction(
                 """
@@ -184,14 +565,22 @@ class Command(BaseCommand):
                 """
             )
 
-        try:
-            self.executeTransaction(
-                """
-                REFRESH MATERIALIZED VIEW current_loan_status
-            """,
-                raise_exc=True,
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM pg_class WHERE relname = 'current_loan_status'"
             )
-        except ProgrammingError:
+            exists = cursor.fetchone() is not None
+
+            if exists:
+                cursor.execute(
+                    """
+                    SELECT 1 FROM pg_indexes
+                    WHERE indexname = 'current_loan_status_loan_id'
+                """
+                )
+                indexed = cursor.fetchone() is not None
+
+        if not exists:
             self.executeTransaction(
                 """
                 CREATE MATERIALIZED VIEW current_loan_status AS (
@@ -209,6 +598,19 @@ class Command(BaseCommand):
             """
             )
 
+        if not exists or not indexed:
+            self.executeTransaction(
+                """
+                CREATE UNIQUE INDEX current_loan_status_loan_id
+                ON current_loan_status (loan_id)
+            """
+            )
+
+    def refreshLoanBalanceView(self, cursor):
+        # Refreshing concurrently lets readers keep using the view, at the
+        # cost of a slower refresh
+        cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY current_loan_status")
+
     def executeTransaction(self, query, *args, **kwargs):
         with connections["default"].cursor() as cursor:
             with transaction.atomic():
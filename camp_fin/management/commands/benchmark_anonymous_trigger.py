@@ -0,0 +1,176 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+import pytz
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from camp_fin.models import Filing, Transaction, TransactionType
+
+from .loaders import CopyLoader
+from .make_search_index import SEARCH_FIELDS
+
+# The trigger used before anonymous transactions were indexed before being
+# written, kept for comparison
+LEGACY_ANONYMOUS_TRIGGER = """
+    CREATE OR REPLACE FUNCTION pg_temp.legacy_update_anonymous()
+    RETURNS TRIGGER AS $$
+        BEGIN
+            IF (coalesce(trim(concat_ws(' ',
+                                        NEW.company_name,
+                                        NEW.name_prefix,
+                                        NEW.first_name,
+                                        NEW.middle_name,
+                                        NEW.last_name,
+                                        NEW.suffix)), '') = '') THEN
+
+                EXECUTE format('UPDATE camp_fin_transaction SET
+                                  search_name = to_tsvector(%L, %L)
+                                WHERE id = %L', E'english', E'Anonymous', NEW.id);
+
+            END IF;
+            RETURN NEW;
+        END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER transaction_search_update_anonymous ON camp_fin_transaction;
+
+    CREATE TRIGGER add_anonymous_transactions
+    AFTER INSERT OR UPDATE OF {} ON camp_fin_transaction
+    FOR EACH ROW EXECUTE PROCEDURE pg_temp.legacy_update_anonymous();
+""".format(
+    ",".join(SEARCH_FIELDS["transaction"])
+)
+
+
+class Command(BaseCommand):
+    help = """
+        Measure how many contributions per second can be copied into
+        camp_fin_transaction with the legacy trigger indexing anonymous
+        contributions, which updates each one after it's written, and with
+        the current trigger, which indexes them before they're written. Rows
+        are written to the first filing in the database and rolled back.
+        Run make_search_index first.
+
+        Example:
+
+            python manage.py benchmark_anonymous_trigger --rows 100000
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            dest="rows",
+            type=int,
+            default=50000,
+            help="Number of contributions to insert",
+        )
+        parser.add_argument(
+            "--anonymous-share",
+            dest="anonymous_share",
+            type=float,
+            default=0.05,
+            help="Share of contributions without a contributor name",
+        )
+        parser.add_argument(
+            "--repeat",
+            dest="repeat",
+            type=int,
+            default=3,
+            help="Number of times to insert the contributions with each trigger",
+        )
+
+    def handle(self, *args, **options):
+        filing = Filing.objects.order_by("id").first()
+        transaction_type = TransactionType.objects.filter(contribution=True).first()
+
+        if filing is None or transaction_type is None:
+            raise CommandError("Import filings and transaction types first")
+
+        random.seed(0)
+
+        contributions = [
+            self.contribution(i, filing, transaction_type, options["anonymous_share"])
+            for i in range(options["rows"])
+        ]
+        n_anonymous = sum(1 for c in contributions if not c.last_name)
+
+        self.stdout.write(
+            f"Inserting {len(contributions)} contributions, "
+            f"{n_anonymous} of them anonymous"
+        )
+
+        # Take the best of each, alternating triggers so that neither gets
+        # a colder cache
+        before, after = 0, 0
+
+        for _ in range(options["repeat"]):
+            before = max(
+                before, self.time_inserts(contributions, n_anonymous, legacy=True)
+            )
+            after = max(after, self.time_inserts(contributions, n_anonymous))
+
+        self.stdout.write(f"Before: {before:,.0f} rows/sec")
+        self.stdout.write(f"After: {after:,.0f} rows/sec")
+        self.stdout.write(self.style.SUCCESS(f"Speedup: {after / before:.1f}x"))
+
+    def contribution(self, i, filing, transaction_type, anonymous_share):
+        received_date = datetime(2024, 1, 1, tzinfo=pytz.utc) + timedelta(
+            days=random.randint(0, 365)
+        )
+
+        if random.random() < anonymous_share:
+            names = {}
+        else:
+            names = {"first_name": "Contributor", "last_name": str(i)}
+
+        return Transaction(
+            amount=random.choice((10, 25, 50, 100, 250)),
+            received_date=received_date,
+            transaction_type=transaction_type,
+            filing=filing,
+            address="{} Main St".format(i),
+            city="Santa Fe",
+            state="NM",
+            zipcode="87501",
+            **names,
+        )
+
+    def time_inserts(self, contributions, n_anonymous, legacy=False):
+        """
+        Copy contributions into the transaction table the way the importer
+        does, then roll back, returning rows written per second.
+        """
+        with transaction.atomic(), connection.cursor() as cursor:
+            if legacy:
+                cursor.execute(LEGACY_ANONYMOUS_TRIGGER)
+
+            loader = CopyLoader([Transaction])
+
+            for contribution in contributions:
+                contribution.pk = None
+                loader.add(contribution)
+
+            first_id = contributions[0].pk
+
+            start = time.perf_counter()
+            loader.flush()
+            elapsed = time.perf_counter() - start
+
+            cursor.execute(
+                """
+                SELECT COUNT(*)
+                FROM camp_fin_transaction
+                WHERE id >= %s
+                  AND search_name @@ plainto_tsquery('english', 'anonymous')
+            """,
+                [first_id],
+            )
+
+            if cursor.fetchone()[0] != n_anonymous:
+                raise CommandError("Anonymous contributions weren't indexed")
+
+            transaction.set_rollback(True)
+
+        return len(contributions) / elapsed
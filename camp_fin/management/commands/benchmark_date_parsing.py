@@ -0,0 +1,146 @@
+import csv
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+from dateutil.parser import ParserError, parse
+from dateutil.tz import gettz
+from django.core.management.base import BaseCommand
+
+from .utils import parse_date
+
+CONTRIBUTION_FIELDS = [
+    "OrgID",
+    "Committee Name",
+    "Report Name",
+    "Start of Period",
+    "End of Period",
+    "Contribution Type",
+    "Contributor Code",
+    "First Name",
+    "Last Name",
+    "Transaction Amount",
+    "Transaction Date",
+]
+
+
+def legacy_parse_date(date_str):
+    """
+    The parser used before dates were matched against precompiled patterns,
+    kept for comparison.
+    """
+    try:
+        mountain_tz = gettz("America/Denver")
+        return parse(date_str).replace(tzinfo=mountain_tz)
+    except (ParserError, TypeError):
+        return None
+
+
+class Command(BaseCommand):
+    help = """
+        Measure how many rows per second of a contributions file can have
+        their dates parsed, with the legacy dateutil parser and with the
+        current parser. Unless a file is given, a synthetic file is generated.
+
+        Example:
+
+            python manage.py benchmark_date_parsing --rows 200000
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--file",
+            dest="file",
+            help="Absolute path of a CON CSV file to parse",
+        )
+        parser.add_argument(
+            "--rows",
+            dest="rows",
+            type=int,
+            default=100000,
+            help="Number of rows in the synthetic file",
+        )
+        parser.add_argument(
+            "--date-format",
+            dest="date_format",
+            default="%m/%d/%Y",
+            help="strftime format of the dates in the synthetic file",
+        )
+
+    def handle(self, *args, **options):
+        if options["file"]:
+            with open(options["file"]) as f:
+                records = list(csv.DictReader(f))
+        else:
+            with tempfile.NamedTemporaryFile("w+", suffix=".csv") as f:
+                self.write_synthetic_file(f, options["rows"], options["date_format"])
+                f.seek(0)
+                records = list(csv.DictReader(f))
+
+        self.stdout.write(f"Parsing dates in {len(records)} rows")
+
+        parse_date.cache_clear()
+
+        before = self.time_parser(legacy_parse_date, records)
+        after = self.time_parser(parse_date, records)
+
+        self.stdout.write(f"Before: {before:,.0f} rows/sec")
+        self.stdout.write(f"After: {after:,.0f} rows/sec")
+        self.stdout.write(self.style.SUCCESS(f"Speedup: {after / before:.1f}x"))
+
+    def write_synthetic_file(self, f, n_rows, date_format):
+        """
+        Write a contributions file shaped like a CFIS export: many committees
+        reporting on a handful of filing periods, with transactions on any
+        day of the year.
+        """
+        random.seed(0)
+
+        year_start = date(2024, 1, 1)
+        periods = [
+            ("First Biannual", date(2024, 1, 1), date(2024, 4, 1)),
+            ("Second Biannual", date(2024, 4, 2), date(2024, 10, 1)),
+            ("First General", date(2024, 10, 2), date(2024, 11, 1)),
+        ]
+
+        writer = csv.DictWriter(f, fieldnames=CONTRIBUTION_FIELDS)
+        writer.writeheader()
+
+        for i in range(n_rows):
+            report_name, start, end = random.choice(periods)
+            org_id = random.randint(1, 500)
+
+            writer.writerow(
+                {
+                    "OrgID": org_id,
+                    "Committee Name": f"Committee {org_id}",
+                    "Report Name": report_name,
+                    "Start of Period": start.strftime(date_format),
+                    "End of Period": end.strftime(date_format),
+                    "Contribution Type": "Monetary contribution",
+                    "Contributor Code": "Individual",
+                    "First Name": "Contributor",
+                    "Last Name": str(i),
+                    "Transaction Amount": "100.00",
+                    "Transaction Date": (
+                        year_start + timedelta(days=random.randint(0, 365))
+                    ).strftime(date_format),
+                }
+            )
+
+    def time_parser(self, parser, records):
+        """
+        Parse each date the way import_transactions does: the start of the
+        period to filter by quarter, the start and end of the period to group
+        rows by filing, and the transaction date.
+        """
+        start = time.perf_counter()
+
+        for record in records:
+            parser(record["Start of Period"])
+            parser(record["Start of Period"])
+            parser(record["End of Period"])
+            parser(record["Transaction Date"])
+
+        return len(records) / (time.perf_counter() - start)
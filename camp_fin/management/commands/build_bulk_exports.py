@@ -0,0 +1,175 @@
+import os
+import time
+
+import boto3
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from camp_fin.base_views import stream_parquet
+from camp_fin.exports import CONTENT_TYPES, export_file, export_path, write_export
+from camp_fin.models import BulkExport
+from camp_fin.views import (
+    ContributionDownloadViewSet,
+    ExpenditureDownloadViewSet,
+    candidates_query,
+    committees_query,
+    employers_query,
+    employments_query,
+)
+
+
+def transactions_query(viewset):
+    def query(start_date=None, end_date=None):
+        args = [arg for arg in (start_date, end_date) if arg]
+        return (
+            viewset().transaction_query(start_date=start_date, end_date=end_date),
+            args,
+        )
+
+    return query
+
+
+# Dataset name: (function returning the query for a date range and its args,
+# whether to write a CSV for each year, column to partition Parquet row groups
+# by)
+DATASETS = {
+    "contributions": (
+        transactions_query(ContributionDownloadViewSet),
+        True,
+        ContributionDownloadViewSet.partition_by,
+    ),
+    "expenditures": (
+        transactions_query(ExpenditureDownloadViewSet),
+        True,
+        ExpenditureDownloadViewSet.partition_by,
+    ),
+    "candidates": (candidates_query, False, None),
+    "committees": (committees_query, False, None),
+    "employers": (employers_query, False, None),
+    "employments": (employments_query, False, None),
+}
+
+
+class Command(BaseCommand):
+    help = """
+        Write gzip-compressed CSVs and Parquet files of the bulk downloads to
+        BULK_EXPORT_ROOT, to be served by the bulk download endpoints in
+        place of running their queries. Each dataset gets one file in each
+        format, and contributions and expenditures also get a CSV for each
+        year. If BULK_EXPORT_BUCKET is set, each file is also uploaded to
+        the exports/ prefix of that S3 bucket, and recorded in
+        camp_fin_bulkexport for the web process to redirect to. Run after
+        importing data.
+
+        Example:
+
+            python manage.py build_bulk_exports --datasets contributions
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--datasets",
+            dest="datasets",
+            nargs="+",
+            choices=DATASETS.keys(),
+            default=list(DATASETS.keys()),
+            help="Datasets to export (default: all)",
+        )
+        parser.add_argument(
+            "--start-year",
+            dest="start_year",
+            type=int,
+            default=2010,
+            help="First year to write a file for",
+        )
+        parser.add_argument(
+            "--end-year",
+            dest="end_year",
+            type=int,
+            default=timezone.now().year,
+            help="Last year to write a file for",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Writing bulk exports to {settings.BULK_EXPORT_ROOT}")
+
+        self.s3 = boto3.client("s3") if settings.BULK_EXPORT_BUCKET else None
+
+        for dataset in options["datasets"]:
+            get_query, by_year, partition_by = DATASETS[dataset]
+
+            self.export(dataset, *get_query())
+            self.export_parquet(dataset, *get_query(), partition_by=partition_by)
+
+            if by_year:
+                for year in range(options["start_year"], options["end_year"] + 1):
+                    self.export(
+                        dataset,
+                        *get_query(f"{year}-01-01", f"{year}-12-31"),
+                        year=year,
+                    )
+
+        self.stdout.write(self.style.SUCCESS("Bulk exports complete!"))
+
+    def export(self, dataset, query, args, year=None):
+        path = export_path(dataset, year)
+        start = time.perf_counter()
+
+        with connection.cursor() as cursor:
+            write_export(cursor, path, query, args)
+
+        self.stdout.write(f"Wrote {path} in {time.perf_counter() - start:.1f}s")
+
+        self.upload(dataset, path, "csv", year=year)
+
+    def export_parquet(self, dataset, query, args, partition_by=None):
+        path = export_path(dataset, format="parquet")
+        start = time.perf_counter()
+
+        with export_file(path) as f:
+            for chunk in stream_parquet(query, args, partition_by):
+                f.write(chunk)
+
+        self.stdout.write(f"Wrote {path} in {time.perf_counter() - start:.1f}s")
+
+        self.upload(dataset, path, "parquet")
+
+    def upload(self, dataset, path, format, year=None):
+        """
+        Upload an export to BULK_EXPORT_BUCKET, if it's set, and record its
+        URL. The bucket's exports/ prefix must be readable by anyone, like
+        the scraped files the imports download from it.
+        """
+        if self.s3 is None:
+            return
+
+        bucket = settings.BULK_EXPORT_BUCKET
+        key = "exports/{}".format(os.path.basename(path))
+        content_type, encoding = CONTENT_TYPES[format]
+
+        # Browsers undo the gzip content encoding of CSVs, so they're saved
+        # without the .gz
+        extra_args = {
+            "ContentType": content_type,
+            "ContentDisposition": "attachment; filename={}".format(
+                os.path.basename(path).removesuffix(".gz")
+            ),
+        }
+
+        if encoding:
+            extra_args["ContentEncoding"] = encoding
+
+        self.s3.upload_file(path, bucket, key, ExtraArgs=extra_args)
+
+        url = "https://{}.s3.amazonaws.com/{}".format(bucket, key)
+
+        BulkExport.objects.update_or_create(
+            dataset=dataset,
+            year=year,
+            format=format,
+            defaults={"url": url, "built": timezone.now()},
+        )
+
+        self.stdout.write(f"Uploaded {path} to {url}")
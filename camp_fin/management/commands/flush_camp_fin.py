@@ -1,6 +1,7 @@
 import os
 
 from django.conf import settings
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
 from django.db import connection
 
@@ -21,6 +22,9 @@ class Command(BaseCommand):
 
         self.execute_sql(file_path)
 
+        # Clear out the aggregates of the flushed transactions
+        call_command("aggregate_data", full=True)
+
         self.stdout.write(self.style.SUCCESS("Database flushed!"))
 
     def execute_sql(self, file_path):
@@ -8,6 +8,7 @@ from django.utils.text import slugify
 from tqdm import tqdm
 
 from camp_fin import models
+from camp_fin.invalidation import bulk_update
 
 
 class Command(BaseCommand):
@@ -25,6 +26,7 @@ class Command(BaseCommand):
             required=True,
         )
 
+    @bulk_update()
     def handle(self, *args, **options):
         with open(options["file"]) as f:
             reader = csv.DictReader(f)
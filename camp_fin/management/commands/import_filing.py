@@ -3,6 +3,7 @@ import csv
 from tqdm import tqdm
 
 from camp_fin import models
+from camp_fin.invalidation import bulk_update
 
 from .utils import convert_to_float
 
@@ -22,6 +23,7 @@ class Command:
             required=True,
         )
 
+    @bulk_update()
     def handle(self, *args, **options):
         with open(options["file"]) as f:
             reader = csv.DictReader(f)
@@ -0,0 +1,60 @@
+from django.core.management.base import CommandError
+
+from camp_fin.invalidation import bulk_update
+
+from .import_transactions import Command as ImportTransactionsCommand
+
+
+class Command(ImportTransactionsCommand):
+    help = """
+        Import several transaction files from the New Mexico Campaign Finance
+        System in one run. Each file is read once, for all of the quarters
+        requested for it. Filings are totaled and aggregates are rebuilt once,
+        after every file has been imported.
+
+        Example:
+
+            python manage.py import_transaction_files \\
+                --import CON 2024 1,2,3,4 _data/sorted/CON_2024.csv \\
+                --import EXP 2024 1,2,3,4 _data/sorted/EXP_2024.csv
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--import",
+            dest="imports",
+            nargs=4,
+            action="append",
+            metavar=("TYPE", "YEAR", "QUARTERS", "FILE"),
+            required=True,
+            help=(
+                "Transaction type (CON, EXP), year, comma-separated list of "
+                "quarters and absolute path of a CSV file to import. May be "
+                "repeated."
+            ),
+        )
+        self.add_import_arguments(parser)
+
+    @bulk_update()
+    def handle(self, *args, **options):
+        imports = []
+
+        for transaction_type, year, quarters, path in options["imports"]:
+            if transaction_type not in ("EXP", "CON"):
+                raise CommandError("Transaction type must be one of: EXP, CON")
+
+            imports.append(
+                (path, transaction_type, year, {int(q) for q in quarters.split(",")})
+            )
+
+        self._prepare_import(options)
+
+        all_quarters = set()
+
+        for path, transaction_type, year, quarters in imports:
+            self.import_file(
+                path, transaction_type, year, quarters, options["batch_size"]
+            )
+            all_quarters |= quarters
+
+        self.total(all_quarters, imported_only=options["total_imported_only"])
@@ -1,16 +1,19 @@
 import csv
-import math
 import re
 from itertools import groupby
 
 from django.core.management import call_command
 from django.core.management.base import BaseCommand
-from django.db.models import Sum
+from django.db import connection, transaction
 from tqdm import tqdm
 
 from camp_fin import models
+from camp_fin.invalidation import bulk_update
 
-from .utils import parse_date
+from .loaders import CopyLoader
+from .resolvers import ContactResolver, FilingIndex, Resolver
+from .staging import StagingImporter
+from .utils import get_quarter, parse_date
 
 
 def filing_key(record):
@@ -22,11 +25,6 @@ def filing_key(record):
     )
 
 
-def get_quarter(date_str):
-    date = parse_date(date_str)
-    return math.ceil(date.month / 3.0)
-
-
 def get_month_range(quarters):
     quarter_to_month_range = {
         1: (1, 3),
@@ -70,50 +68,105 @@ class Command(BaseCommand):
             default="2023",
             help="Year to import (Default: 2023)",
         )
+        self.add_import_arguments(parser)
+        parser.add_argument(
+            "--file",
+            dest="file",
+            help="Absolute path of CSV file to import",
+            required=True,
+        )
+
+    def add_import_arguments(self, parser):
         parser.add_argument(
             "--batch-size",
             dest="batch_size",
             default=500,
+            type=int,
             help="Number of transaction records to bulk create at once (Default: 500)",
         )
         parser.add_argument(
-            "--file",
-            dest="file",
-            help="Absolute path of CSV file to import",
-            required=True,
+            "--loader",
+            dest="loader",
+            default="bulk",
+            choices=["bulk", "copy", "staging"],
+            help=(
+                "How to save transactions: bulk (multi-row INSERT), copy "
+                "(COPY FROM STDIN) or staging (COPY the file into a staging "
+                "table and import it with set-based SQL) (Default: bulk)"
+            ),
+        )
+        parser.add_argument(
+            "--total-imported-only",
+            dest="total_imported_only",
+            action="store_true",
+            help=(
+                "Only total the filings that had transactions imported, rather "
+                "than every final filing from periods beginning in the quarters "
+                "imported"
+            ),
         )
 
+    @bulk_update()
     def handle(self, *args, **options):
         transaction_type = options["transaction_type"]
+        year = options["year"]
+        quarters = {int(q) for q in options["quarters"].split(",")}
+
+        self._prepare_import(options)
+
+        self.import_file(
+            options["file"], transaction_type, year, quarters, options["batch_size"]
+        )
 
+        self.total(quarters, imported_only=options["total_imported_only"])
+
+    def import_file(self, path, transaction_type, year, quarters, batch_size):
         if transaction_type not in ("EXP", "CON"):
             raise ValueError("Transaction type must be one of: EXP, CON")
 
-        year = options["year"]
-
         self.stdout.write(f"Loading data from {transaction_type}_{year}.csv")
 
-        quarters = {int(q) for q in options["quarters"].split(",")}
-        quarter_string = ", ".join(f"Q{q}" for q in quarters)
+        quarter_string = ", ".join(f"Q{q}" for q in sorted(quarters))
 
-        with open(options["file"]) as f:
+        # Collect the filings imported from this file on their own, so that
+        # changes can be logged for the year of the file
+        previously_imported_filing_ids = self.imported_filing_ids
+        self.imported_filing_ids = set()
+
+        with open(path) as f:
             self.stdout.write(
                 f"Importing transactions from filing periods beginning in {quarter_string}"
             )
 
-            if transaction_type == "CON":
-                self.import_contributions(f, quarters, year, options["batch_size"])
+            if self.loader == "staging":
+                self.import_staged(f, transaction_type, quarters, year)
+
+            elif transaction_type == "CON":
+                self.import_contributions(f, quarters, year, batch_size)
 
             elif transaction_type == "EXP":
-                self.import_expenditures(f, quarters, year, options["batch_size"])
+                self.import_expenditures(f, quarters, year, batch_size)
 
             self.stdout.write(self.style.SUCCESS("Transactions imported!"))
 
+        self.log_changes(self.imported_filing_ids, year)
+        self.imported_filing_ids |= previously_imported_filing_ids
+
+    def total(self, quarters, imported_only=False):
+        """
+        Total the filings from periods beginning in the given quarters, then
+        update the aggregates. If imported_only is True, only total the
+        filings that had transactions imported.
+        """
+        quarter_string = ", ".join(f"Q{q}" for q in sorted(quarters))
+
         self.stdout.write(
             f"Totaling filings from periods beginning in {quarter_string}"
         )
-        self.total_filings(quarters, year)
-        self.stdout.write(self.style.SUCCESS("Filings totaled!"))
+        n_totaled = self.total_filings(
+            quarters, filing_ids=self.imported_filing_ids if imported_only else None
+        )
+        self.stdout.write(self.style.SUCCESS(f"{n_totaled} filings totaled!"))
 
         call_command("aggregate_data")
 
@@ -133,11 +186,62 @@ class Command(BaseCommand):
         )
         return groupby(tqdm(records_in_quarters), key=filing_key)
 
+    def _prepare_import(self, options):
+        self.loader = options["loader"]
+
+        # The staging import resolves lookup tables in SQL
+        if self.loader != "staging":
+            self._load_resolvers()
+
+        self._load_loader(self.loader)
+        self.filing_index = FilingIndex()
+        self.imported_filing_ids = set()
+
+    def _load_resolvers(self):
+        """
+        Read the lookup tables used to build transactions into memory, so that
+        each row can be resolved without a round trip to the database.
+        """
+        self.states = Resolver(models.State, ["postal_code"])
+        self.addresses = Resolver(
+            models.Address, ["street", "city", "state_id", "zipcode"]
+        )
+        self.contact_types = Resolver(models.ContactType, ["description"])
+        self.entity_types = Resolver(models.EntityType, ["description"])
+        self.transaction_types = Resolver(
+            models.TransactionType, ["description", "contribution", "anonymous"]
+        )
+        self.loan_transaction_types = Resolver(
+            models.LoanTransactionType, ["description"]
+        )
+        self.contacts = ContactResolver(self.entity_types)
+
+    def _load_loader(self, loader):
+        if loader == "copy":
+            self.copy_loader = CopyLoader(
+                [
+                    models.Loan,
+                    models.LoanTransaction,
+                    models.SpecialEvent,
+                    models.Transaction,
+                ]
+            )
+            self.loans = {}
+        else:
+            self.copy_loader = None
+
     def _save_batch(self, batch):
         """
         Contributions are represented by several different types of models. Sort
         then group them by class, then save each group of records.
         """
+        if self.copy_loader:
+            for obj in batch:
+                self.copy_loader.add(obj)
+
+            self.copy_loader.flush()
+            return
+
         for cls, cls_records in groupby(
             sorted(batch, key=lambda x: str(type(x))), key=lambda x: type(x)
         ):
@@ -151,41 +255,40 @@ class Command(BaseCommand):
         n_imported = 0
 
         for _, records in self._records_by_filing(reader, quarters):
-            for i, record in enumerate(records):
-                if i == 0:
-                    try:
-                        filing = self._get_filing(record)
-                    except ValueError:
-                        break
-
-                    # The contributions files are organized by the year
-                    # of the transaction date, not the date of the
-                    # filing, so transactions from the same filing can
-                    # appear in multiple contribution files.
-                    #
-                    # We need to make sure we just clear out the
-                    # contributions in a file that were purportedly made
-                    # in a given year.
-                    n_loans_deleted, _ = models.Loan.objects.filter(
-                        filing=filing, received_date__year=year
-                    ).delete()
-                    n_events_deleted, _ = models.SpecialEvent.objects.filter(
-                        filing=filing, event_date__year=year
-                    ).delete()
-                    n_transactions_deleted, _ = (
-                        models.Transaction.objects.filter(
-                            filing=filing, received_date__year=year
-                        )
-                        .exclude(transaction_type__description="Monetary Expenditure")
-                        .delete()
-                    )
+            records = list(records)
 
-                    n_deleted += (
-                        n_loans_deleted + n_events_deleted + n_transactions_deleted
-                    )
+            try:
+                filing = self._get_filing(records[0])
+            except ValueError:
+                continue
+
+            self.imported_filing_ids.add(filing.id)
+
+            # The contributions files are organized by the year
+            # of the transaction date, not the date of the
+            # filing, so transactions from the same filing can
+            # appear in multiple contribution files.
+            #
+            # We need to make sure we just clear out the
+            # contributions in a file that were purportedly made
+            # in a given year.
+            n_loans_deleted, _ = models.Loan.objects.filter(
+                filing=filing, received_date__year=year
+            ).delete()
+            n_events_deleted, _ = models.SpecialEvent.objects.filter(
+                filing=filing, event_date__year=year
+            ).delete()
+            n_transactions_deleted, _ = (
+                models.Transaction.objects.filter(
+                    filing=filing, received_date__year=year
+                )
+                .exclude(transaction_type__description="Monetary Expenditure")
+                .delete()
+            )
 
-                contributor = self.make_contributor(record)
+            n_deleted += n_loans_deleted + n_events_deleted + n_transactions_deleted
 
+            for record, contributor in zip(records, self.make_contributors(records)):
                 if (
                     record["Contribution Type"] in {"Loans Received", "Special Event"}
                     or "Contribution" in record["Contribution Type"]
@@ -228,6 +331,8 @@ class Command(BaseCommand):
                     except ValueError:
                         break
 
+                    self.imported_filing_ids.add(filing.id)
+
                     n_transactions, _ = models.Transaction.objects.filter(
                         filing=filing,
                         transaction_type__description="Monetary Expenditure",
@@ -254,81 +359,120 @@ class Command(BaseCommand):
             )
         )
 
-    def make_contributor(self, record):
-        state, _ = models.State.objects.get_or_create(
-            postal_code=record["Contributor State"]
-        )
+    def import_staged(self, f, transaction_type, quarters, year):
+        """
+        Import a file through a staging table, in a single transaction.
+        """
+        importer = StagingImporter(self, year)
 
-        address, _ = models.Address.objects.get_or_create(
-            street=(
-                f"{record['Contributor Address Line 1']}"
-                f"{' ' + record['Contributor Address Line 2'] if record['Contributor Address Line 2'] else ''}"
-            ),
-            city=record["Contributor City"],
-            state=state,
-            zipcode=record["Contributor Zip Code"],
-        )
+        with transaction.atomic():
+            if transaction_type == "CON":
+                filing_ids, n_deleted, n_imported = importer.import_contributions(
+                    f, quarters
+                )
+            else:
+                filing_ids, n_deleted, n_imported = importer.import_expenditures(
+                    f, quarters
+                )
 
-        contact_type, _ = models.ContactType.objects.get_or_create(
-            description=record["Contributor Code"]
+        self.imported_filing_ids |= filing_ids
+
+        self.stdout.write(
+            self.style.NOTICE(
+                f"Deleted {n_deleted} records, created {n_imported} records"
+            )
         )
 
-        full_name = re.sub(
-            r"\s{2,}",
-            " ",
-            " ".join(
-                [
-                    record["Prefix"],
-                    record["First Name"],
-                    record["Middle Name"],
-                    record["Last Name"],
-                    record["Suffix"],
-                ]
-            ),
-        ).strip()
+    def make_contributor(self, record):
+        return self.make_contributors([record])[0]
+
+    def make_contributors(self, records):
+        """
+        Return a Contact for each record, creating any missing states,
+        addresses, contact types and contacts in bulk.
+        """
+        self.states.resolve((record["Contributor State"],) for record in records)
+        self.contact_types.resolve((record["Contributor Code"],) for record in records)
+
+        address_keys = [
+            (
+                self._street(record),
+                record["Contributor City"],
+                self.states.get(record["Contributor State"]),
+                record["Contributor Zip Code"],
+            )
+            for record in records
+        ]
+        self.addresses.resolve(address_keys)
 
-        if record["Contributor Code"] not in ("Individual", "Candidate"):
-            contact_kwargs = {
-                "company_name": full_name,
-            }
+        contact_specs = []
 
-        else:
-            contact_kwargs = {
-                "prefix": record["Prefix"],
-                "first_name": record["First Name"],
-                "middle_name": record["Middle Name"],
-                "last_name": record["Last Name"],
-                "suffix": record["Suffix"],
-                "occupation": record["Contributor Occupation"],
-                "company_name": record["Contributor Employer"] or "",
-                "full_name": full_name,
-            }
+        for record, address_key in zip(records, address_keys):
+            full_name = re.sub(
+                r"\s{2,}",
+                " ",
+                " ".join(
+                    [
+                        record["Prefix"],
+                        record["First Name"],
+                        record["Middle Name"],
+                        record["Last Name"],
+                        record["Suffix"],
+                    ]
+                ),
+            ).strip()
 
-        try:
-            contact = models.Contact.objects.get(
-                **contact_kwargs,
-                status_id=0,
-                address=address,
-                contact_type=contact_type,
-            )
-        except models.Contact.DoesNotExist:
-            entity_type, _ = models.EntityType.objects.get_or_create(
-                description=record["Contributor Code"][:24]
-            )
+            if record["Contributor Code"] not in ("Individual", "Candidate"):
+                contact_kwargs = {
+                    "company_name": full_name,
+                }
 
-            entity = models.Entity.objects.create(
-                entity_type=entity_type,
+            else:
+                contact_kwargs = {
+                    "prefix": record["Prefix"],
+                    "first_name": record["First Name"],
+                    "middle_name": record["Middle Name"],
+                    "last_name": record["Last Name"],
+                    "suffix": record["Suffix"],
+                    "occupation": record["Contributor Occupation"],
+                    "company_name": record["Contributor Employer"] or "",
+                    "full_name": full_name,
+                }
+
+            contact_specs.append(
+                (
+                    contact_kwargs,
+                    self.addresses.get(*address_key),
+                    self.contact_types.get(record["Contributor Code"]),
+                    record["Contributor Code"][:24],
+                )
             )
 
-            contact = models.Contact.objects.create(
-                **contact_kwargs,
-                status_id=0,
-                address=address,
-                contact_type=contact_type,
-                entity=entity,
-            )
+        return self.contacts.resolve(contact_specs)
 
-        return contact
+    def _street(self, record):
+        return (
+            f"{record['Contributor Address Line 1']}"
+            f"{' ' + record['Contributor Address Line 2'] if record['Contributor Address Line 2'] else ''}"
+        )
+
+    def _get_or_create_loan(self, **kwargs):
+        """
+        When saving with COPY, loans are written alongside the rest of the
+        batch, so look for duplicates among the loans seen during this import
+        instead of in the database. (Existing loans in the filing were already
+        deleted before the import.)
+        """
+        if not self.copy_loader:
+            loan, _ = models.Loan.objects.get_or_create(**kwargs)
+            return loan
+
+        key = tuple(sorted(kwargs.items()))
+
+        if key not in self.loans:
+            self.loans[key] = self.copy_loader.add(models.Loan(**kwargs))
+
+        return self.loans[key]
 
     def _get_filing(self, record):
         start_date = parse_date(record["Start of Period"])
@@ -339,60 +483,58 @@ class Command(BaseCommand):
         state_id = record["OrgID"]
 
         try:
-            pac = models.PAC.objects.get(entity__user_id=state_id)
+            pac = self.filing_index.get_pac(state_id)
         except models.PAC.DoesNotExist:
             try:
-                pac = models.PAC.objects.get(name=record["Committee Name"])
+                pac = self.filing_index.get_pac_by_name(record["Committee Name"])
             except models.PAC.DoesNotExist:
                 msg = f"PAC with name {record['Committee Name']} does not exist."
                 self.stderr.write(msg)
                 raise ValueError(msg)
             else:
-                pac.entity.user_id = state_id
-                pac.entity.save()
+                self.filing_index.set_user_id(pac, state_id)
 
-        try:
-            # candidate entity
-            entity = (
-                models.Entity.objects.filter(candidate__campaign__committee=pac)
-                .distinct()
-                .get()
-            )
-        except models.Entity.DoesNotExist:
-            # committee entity
-            entity = pac.entity
+        # candidate entity, if the PAC is a candidate committee, otherwise the
+        # committee entity
+        entity = self.filing_index.get_entity(pac)
+
+        # the same person can have multiple canidate committees, so we
+        # need to disambiguate which one this filing is for
+        committee = pac if entity.entity_type.description == "Candidate" else None
 
         # We want to associate the transactions with the final filing
         # for a reporting period
-        filings = models.Filing.objects.filter(
-            filing_period__description=record["Report Name"],
-            filing_period__initial_date__year=start_date.year,
-            filing_period__end_date__year=end_date.year,
-            final=True,
-            entity=entity,
+        filings = self.filing_index.get_filings(
+            entity,
+            record["Report Name"],
+            start_date.year,
+            end_date.year,
+            committee=committee,
         )
 
-        # the same person can have multiple canidate committees, so we
-        # need to disambiguate which one this filing is for
-        if entity.entity_type.description == "Candidate":
-            filings = filings.filter(campaign__committee=pac)
-
-        try:
-            filing = filings.get()
-        except models.Filing.DoesNotExist:
+        if not filings:
             raise ValueError
-        except models.Filing.MultipleObjectsReturned:
-            filing = filings.order_by("filed_date").last()
-            filing_meta = filings.values(
-                "campaign__committee__name",
-                "entity",
-                "filing_period__description",
-                "filed_date",
-                "filing_period__initial_date",
-                "filing_period__end_date",
-            )
+
+        filing = max(filings, key=lambda filing: filing.filed_date)
+
+        if len(filings) > 1:
+            filing_meta = [
+                {
+                    "campaign__committee__name": (
+                        duplicate.campaign.committee.name
+                        if duplicate.campaign and duplicate.campaign.committee
+                        else None
+                    ),
+                    "entity": duplicate.entity_id,
+                    "filing_period__description": duplicate.filing_period.description,
+                    "filed_date": duplicate.filed_date,
+                    "filing_period__initial_date": duplicate.filing_period.initial_date,
+                    "filing_period__end_date": duplicate.filing_period.end_date,
+                }
+                for duplicate in filings
+            ]
             msg = (
-                f"{filings.count()} filings found for PAC {pac} from record "
+                f"{len(filings)} filings found for PAC {pac} from record "
                 f"{record}:\n{filing_meta}\n\nUsing most recent filing matching query..."
             )
             self.stderr.write(msg)
@@ -402,21 +544,16 @@ class Command(BaseCommand):
     def make_contribution(self, record, contributor, filing):
         if contributor:
             address_kwargs = dict(
-                address=(
-                    f"{record['Contributor Address Line 1']}"
-                    f"{' ' + record['Contributor Address Line 2'] if record['Contributor Address Line 2'] else ''}"
-                ),
+                address=self._street(record),
                 city=record["Contributor City"],
                 state=record["Contributor State"],
                 zipcode=record["Contributor Zip Code"],
             )
 
             if record["Contribution Type"] == "Loans Received":
-                transaction_type, _ = models.LoanTransactionType.objects.get_or_create(
-                    description="Payment"
-                )
+                transaction_type_id = self.loan_transaction_types.get("Payment")
 
-                loan, _ = models.Loan.objects.get_or_create(
+                loan = self._get_or_create_loan(
                     amount=record["Transaction Amount"],
                     received_date=parse_date(record["Transaction Date"]),
                     check_number=record["Check Number"],
@@ -433,7 +570,7 @@ class Command(BaseCommand):
                     transaction_status_id=0,
                     loan=loan,
                     filing=filing,
-                    transaction_type=transaction_type,
+                    transaction_type_id=transaction_type_id,
                 )
 
             elif record["Contribution Type"] == "Special Event":
@@ -462,10 +599,10 @@ class Command(BaseCommand):
                 else:
                     description = "Monetary Contribution"
 
-                transaction_type, _ = models.TransactionType.objects.get_or_create(
-                    description=description,
-                    contribution=True,
-                    anonymous="anonymous" in record["Contribution Type"].lower(),
+                transaction_type_id = self.transaction_types.get(
+                    description,
+                    True,
+                    "anonymous" in record["Contribution Type"].lower(),
                 )
 
                 contribution = models.Transaction(
@@ -481,7 +618,7 @@ class Command(BaseCommand):
                     last_name=contributor.last_name,
                     suffix=contributor.suffix,
                     filing=filing,
-                    transaction_type=transaction_type,
+                    transaction_type_id=transaction_type_id,
                     company_name=contributor.company_name or "",
                     occupation=contributor.occupation,
                     **address_kwargs,
@@ -498,10 +635,8 @@ class Command(BaseCommand):
                 zipcode=record["Payee Zip Code"],
             )
 
-            transaction_type, _ = models.TransactionType.objects.get_or_create(
-                description="Monetary Expenditure",
-                contribution=False,
-                anonymous=False,
+            transaction_type_id = self.transaction_types.get(
+                "Monetary Expenditure", False, False
             )
 
             payee_full_name = re.sub(
@@ -530,28 +665,115 @@ class Command(BaseCommand):
                 suffix=record["Payee Suffix"],
                 company_name=payee_full_name,
                 filing=filing,
-                transaction_type=transaction_type,
+                transaction_type_id=transaction_type_id,
                 **address_kwargs,
             )
 
         return contribution
 
-    def total_filings(self, quarters, year):
-        start, end = get_month_range(quarters)
+    def log_changes(self, filing_ids, year):
+        """
+        Log the entity years changed by importing transactions into the given
+        filings, for aggregate_data to update. Transactions from the year of
+        the file were deleted, and transactions were imported into any year.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO camp_fin_aggregatechange (entity_id, year, date_added)
+                SELECT DISTINCT f.entity_id, changes.year, NOW()
+                FROM camp_fin_filing AS f
+                JOIN (
+                  SELECT id AS filing_id, %(year)s AS year
+                  FROM camp_fin_filing
+                  WHERE id = ANY(%(filing_ids)s)
+                  UNION
+                  SELECT
+                    filing_id,
+                    DATE_PART('year', received_date AT TIME ZONE 'America/Denver')
+                  FROM camp_fin_transaction
+                  WHERE filing_id = ANY(%(filing_ids)s)
+                  UNION
+                  SELECT
+                    filing_id,
+                    DATE_PART('year', received_date AT TIME ZONE 'America/Denver')
+                  FROM camp_fin_loan
+                  WHERE filing_id = ANY(%(filing_ids)s)
+                ) AS changes
+                  ON f.id = changes.filing_id
+                WHERE changes.year IS NOT NULL
+            """,
+                {"year": int(year), "filing_ids": list(filing_ids)},
+            )
 
-        for filing in tqdm(
-            models.Filing.objects.filter(
-                final=True,
-                filing_period__initial_date__month__gte=start,
-                filing_period__initial_date__month__lte=end,
-            ).iterator()
-        ):
-            contributions = filing.contributions().aggregate(total=Sum("amount"))
-            expenditures = filing.expenditures().aggregate(total=Sum("amount"))
-            loans = filing.loans().aggregate(total=Sum("amount"))
+    def total_filings(self, quarters, filing_ids=None):
+        """
+        Sum the contributions, expenditures and loans of each final filing from
+        periods beginning in the given quarters, and save the totals in a
+        single UPDATE. If filing_ids is given, only total those filings.
+        Returns the number of filings totaled.
+        """
+        start, end = get_month_range(quarters)
 
-            filing.total_contributions = contributions["total"] or 0
-            filing.total_expenditures = expenditures["total"] or 0
-            filing.total_loans = loans["total"] or 0
+        filing_filter = ""
+        params = [start, end]
+
+        if filing_ids is not None:
+            filing_filter = "AND f.id = ANY(%s)"
+            params.append(list(filing_ids))
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                WITH filings AS (
+                  SELECT f.id
+                  FROM camp_fin_filing AS f
+                  JOIN camp_fin_filingperiod AS fp
+                    ON f.filing_period_id = fp.id
+                  WHERE f.final = TRUE
+                    AND EXTRACT(month FROM fp.initial_date) BETWEEN %s AND %s
+                    {filing_filter}
+                ),
+                transaction_totals AS (
+                  SELECT
+                    t.filing_id,
+                    SUM(CASE WHEN tt.contribution THEN t.amount END) AS contributions,
+                    SUM(
+                      CASE WHEN tt.description = 'Monetary Expenditure'
+                        THEN t.amount
+                      END
+                    ) AS expenditures
+                  FROM camp_fin_transaction AS t
+                  JOIN camp_fin_transactiontype AS tt
+                    ON t.transaction_type_id = tt.id
+                  WHERE t.filing_id IN (SELECT id FROM filings)
+                  GROUP BY t.filing_id
+                ),
+                loan_totals AS (
+                  SELECT
+                    lt.filing_id,
+                    SUM(lt.amount) AS loans
+                  FROM camp_fin_loantransaction AS lt
+                  JOIN camp_fin_loantransactiontype AS ltt
+                    ON lt.transaction_type_id = ltt.id
+                  WHERE ltt.description = 'Payment'
+                    AND lt.filing_id IN (SELECT id FROM filings)
+                  GROUP BY lt.filing_id
+                )
+                UPDATE camp_fin_filing AS filing SET
+                  total_contributions = COALESCE(transaction_totals.contributions, 0),
+                  total_expenditures = COALESCE(transaction_totals.expenditures, 0),
+                  total_loans = COALESCE(loan_totals.loans, 0)
+                FROM filings
+                LEFT JOIN transaction_totals
+                  ON filings.id = transaction_totals.filing_id
+                LEFT JOIN loan_totals
+                  ON filings.id = loan_totals.filing_id
+                WHERE filing.id = filings.id
+            """.format(
+                    filing_filter=filing_filter
+                ),
+                params,
+            )
 
-            filing.save()
+            return cursor.rowcount
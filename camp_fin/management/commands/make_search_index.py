@@ -3,149 +3,280 @@ import os
 from django.core.management.base import BaseCommand
 from django.db import connection, transaction
 
+# Columns of each table that its search vector is made from
+SEARCH_FIELDS = {
+    "candidate": ["full_name"],
+    "pac": ["name"],
+    "transaction": [
+        "company_name",
+        "name_prefix",
+        "first_name",
+        "middle_name",
+        "last_name",
+        "suffix",
+        "address",
+        "city",
+        "state",
+        "zipcode",
+    ],
+    "treasurer": ["prefix", "first_name", "middle_name", "last_name", "suffix"],
+    "lobbyist": ["first_name", "middle_name", "last_name", "suffix"],
+    "organization": ["name"],
+    "lobbyisttransaction": ["name", "beneficiary", "expenditure_purpose"],
+}
+
+# Vector of transactions without a name, as update_anonymous() in
+# sql/anonymous_trigger.sql indexes them
+ANONYMOUS_VECTOR = """
+    CASE WHEN COALESCE(TRIM(concat_ws(' ',
+      company_name, name_prefix, first_name, middle_name, last_name, suffix
+    )), '') = ''
+    THEN to_tsvector('english', 'Anonymous')
+    ELSE {}
+    END
+"""
+
+# Number of rows to fill in the search vectors of per transaction
+BATCH_SIZE = 50000
+
 
 class Command(BaseCommand):
-    help = "Create search index for New Mexico Campaign Finance data"
+    help = """
+        Create the search vector, the trigger keeping it up to date and its
+        index on each table searched by /api/search/. Each is only created if
+        it's missing, and only rows without a search vector are filled in, so
+        after the first run, this only catches up with rows added while the
+        trigger was missing.
+
+        Example:
+
+            python manage.py make_search_index --tables candidate pac
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--tables",
+            dest="tables",
+            nargs="+",
+            choices=SEARCH_FIELDS.keys(),
+            default=list(SEARCH_FIELDS.keys()),
+            help="Tables to index (default: all)",
+        )
 
     def handle(self, *args, **options):
+        for table in options["tables"]:
+            self.makeIndex(table, SEARCH_FIELDS[table])
 
-        self.drop_vector = """
-            ALTER TABLE camp_fin_{}
-            DROP COLUMN IF EXISTS search_name
-        """
+            if table == "transaction":
+                self.makeAnonymousTrigger(SEARCH_FIELDS[table])
 
-        self.add_vector = """
-            ALTER TABLE camp_fin_{}
-            ADD COLUMN search_name tsvector
-        """
+        self.stdout.write(self.style.SUCCESS("Worked"))
 
-        self.populate_vector = """
-            UPDATE camp_fin_{0} SET
-              search_name = to_tsvector('english', {1})
-        """
+    def makeIndex(self, table, index_fields):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT 1
+                FROM information_schema.columns
+                WHERE table_name = %s
+                  AND column_name = 'search_name'
+            """,
+                ["camp_fin_{}".format(table)],
+            )
 
-        self.add_index = """
-            CREATE INDEX ON camp_fin_{}
-            USING gin(search_name)
-        """
+            if not cursor.fetchone():
+                # Without a default, adding the column doesn't rewrite the
+                # table
+                cursor.execute(
+                    """
+                    ALTER TABLE camp_fin_{}
+                    ADD COLUMN search_name tsvector
+                """.format(
+                        table
+                    )
+                )
 
-        self.create_trigger = """
-            CREATE TRIGGER {0}_search_update
-            BEFORE INSERT OR UPDATE OF {1} ON camp_fin_{0}
-            FOR EACH ROW EXECUTE PROCEDURE
-            tsvector_update_trigger(search_name,
-                                    'pg_catalog.english', {1})
-        """
+                self.stdout.write("Added search_name to camp_fin_{}".format(table))
 
-        self.makeCandidateIndex()
-        self.makePACIndex()
-        self.makeTransactionIndex()
-        self.makeTreasurerIndex()
-        self.makeLobbyistIndex()
-        self.makeOrganizationIndex()
-        self.makeLobbyistTransactionIndex()
+            trigger_args = self.triggerArgs(
+                cursor, table, "{}_search_update".format(table)
+            )
 
-        self.stdout.write(self.style.SUCCESS("Worked"))
+            # If the trigger indexed other columns, every vector is stale
+            stale = trigger_args is not None
+
+            if trigger_args == ["search_name", "pg_catalog.english"] + index_fields:
+                stale = False
+            else:
+                cursor.execute(
+                    """
+                    DROP TRIGGER IF EXISTS {0}_search_update
+                    ON camp_fin_{0}
+                """.format(
+                        table
+                    )
+                )
 
-    def makeCandidateIndex(self):
-        index_fields = ["full_name"]
+                cursor.execute(
+                    """
+                    CREATE TRIGGER {0}_search_update
+                    BEFORE INSERT OR UPDATE OF {1} ON camp_fin_{0}
+                    FOR EACH ROW EXECUTE PROCEDURE
+                    tsvector_update_trigger(search_name,
+                                            'pg_catalog.english', {1})
+                """.format(
+                        table, ",".join(index_fields)
+                    )
+                )
 
-        vector = "concat_ws(' ', {})".format(", ".join(index_fields))
+                self.stdout.write("Created {}_search_update".format(table))
 
-        with transaction.atomic():
-            cursor = connection.cursor()
-            cursor.execute(self.drop_vector.format("candidate"))
-            cursor.execute(self.add_vector.format("candidate"))
-            cursor.execute(self.populate_vector.format("candidate", vector))
-            cursor.execute(self.add_index.format("candidate"))
+        self.populateVector(table, index_fields, every_row=stale)
+        self.makeVectorIndex(table)
 
-            cursor.execute(
-                """
-                DROP TRIGGER IF EXISTS candidate_search_update
-                ON camp_fin_candidate
+    def triggerArgs(self, cursor, table, trigger_name):
+        """
+        Arguments of a trigger on a table, i.e., for search triggers, the
+        vector column, configuration and columns indexed, or None if there
+        is no such trigger.
+        """
+        cursor.execute(
             """
-            )
+            SELECT encode(tgargs, 'escape')
+            FROM pg_trigger
+            WHERE tgrelid = %s::regclass
+              AND tgname = %s
+        """,
+            ["camp_fin_{}".format(table), trigger_name],
+        )
 
-            cursor.execute(
-                self.create_trigger.format("candidate", ",".join(index_fields))
-            )
+        row = cursor.fetchone()
 
-    def makeTreasurerIndex(self):
-        index_fields = ["prefix", "first_name", "middle_name", "last_name", "suffix"]
+        if row is None:
+            return None
 
-        vector = "concat_ws(' ', {})".format(", ".join(index_fields))
+        # Arguments are NUL-terminated
+        return row[0].split("\\000")[:-1]
 
-        with transaction.atomic():
-            cursor = connection.cursor()
-            cursor.execute(self.drop_vector.format("treasurer"))
-            cursor.execute(self.add_vector.format("treasurer"))
-            cursor.execute(self.populate_vector.format("treasurer", vector))
-            cursor.execute(self.add_index.format("treasurer"))
+    def populateVector(self, table, index_fields, every_row=False):
+        """
+        Fill in the search vectors of rows that don't have one, or of every
+        row, a batch of IDs at a time, so that no transaction holds on to its
+        rows for long. Rows inserted or updated while the trigger exists
+        already have one.
+        """
+        missing = "" if every_row else "AND search_name IS NULL"
 
+        with connection.cursor() as cursor:
             cursor.execute(
                 """
-                DROP TRIGGER IF EXISTS treasurer_search_update
-                ON camp_fin_treasurer
-            """
+                SELECT MIN(id), MAX(id)
+                FROM camp_fin_{}
+                WHERE TRUE
+                  {}
+            """.format(
+                    table, missing
+                )
             )
 
-            cursor.execute(
-                self.create_trigger.format("treasurer", ",".join(index_fields))
-            )
+            first_id, last_id = cursor.fetchone()
 
-    def makePACIndex(self):
+            if first_id is None:
+                return
 
-        with transaction.atomic():
-            cursor = connection.cursor()
-            cursor.execute(self.drop_vector.format("pac"))
-            cursor.execute(self.add_vector.format("pac"))
-            cursor.execute(self.populate_vector.format("pac", "COALESCE(name, '')"))
-            cursor.execute(self.add_index.format("pac"))
+            vector = "to_tsvector('english', concat_ws(' ', {}))".format(
+                ", ".join(index_fields)
+            )
 
+            if table == "transaction":
+                vector = ANONYMOUS_VECTOR.format(vector)
+
+            for start in range(first_id, last_id + 1, BATCH_SIZE):
+                with transaction.atomic():
+                    cursor.execute(
+                        """
+                        UPDATE camp_fin_{0} SET
+                          search_name = {1}
+                        WHERE id >= %s
+                          AND id < %s
+                          {2}
+                    """.format(
+                            table, vector, missing
+                        ),
+                        [start, start + BATCH_SIZE],
+                    )
+
+            self.stdout.write(
+                "Populated search_name of camp_fin_{} from ID {} to {}".format(
+                    table, first_id, last_id
+                )
+            )
+
+    def makeVectorIndex(self, table):
+        """
+        Create the index of a table's search vectors if it doesn't have a
+        valid one. Indexes are built concurrently, so the table can still be
+        written to, unless this runs in a transaction, where they can't be.
+        """
+        with connection.cursor() as cursor:
             cursor.execute(
                 """
-                DROP TRIGGER IF EXISTS pac_search_update
-                ON camp_fin_pac
-            """
+                SELECT index_class.relname, idx.indisvalid
+                FROM pg_index AS idx
+                JOIN pg_class AS index_class
+                  ON idx.indexrelid = index_class.oid
+                JOIN pg_attribute AS attribute
+                  ON attribute.attrelid = idx.indrelid
+                  AND attribute.attnum = ANY(idx.indkey)
+                WHERE idx.indrelid = %s::regclass
+                  AND attribute.attname = 'search_name'
+            """,
+                ["camp_fin_{}".format(table)],
             )
 
-            cursor.execute(self.create_trigger.format("pac", "name"))
-
-    def makeTransactionIndex(self):
+            indexes = cursor.fetchall()
 
-        index_fields = [
-            "company_name",
-            "name_prefix",
-            "first_name",
-            "middle_name",
-            "last_name",
-            "suffix",
-            "address",
-            "city",
-            "state",
-            "zipcode",
-        ]
+            if any(valid for _, valid in indexes):
+                return
 
-        vector = "concat_ws(' ', {})".format(", ".join(index_fields))
+            concurrently = "" if connection.in_atomic_block else "CONCURRENTLY"
 
-        with transaction.atomic():
-            cursor = connection.cursor()
-            cursor.execute(self.drop_vector.format("transaction"))
-            cursor.execute(self.add_vector.format("transaction"))
-            cursor.execute(self.populate_vector.format("transaction", vector))
-            cursor.execute(self.add_index.format("transaction"))
+            # A concurrent build that failed leaves an invalid index behind
+            for index_name, _ in indexes:
+                cursor.execute("DROP INDEX {} {}".format(concurrently, index_name))
 
             cursor.execute(
                 """
-                DROP TRIGGER IF EXISTS transaction_search_update
-                ON camp_fin_transaction
-            """
+                CREATE INDEX {1} camp_fin_{0}_search_name_idx
+                ON camp_fin_{0}
+                USING gin(search_name)
+            """.format(
+                    table, concurrently
+                )
             )
 
+            self.stdout.write("Indexed search_name of camp_fin_{}".format(table))
+
+    def makeAnonymousTrigger(self, index_fields):
+        """
+        Index transactions without a name as anonymous. The trigger runs
+        before the row is written, so each row is only written once, and
+        after transaction_search_update, since triggers on the same event
+        fire in order of name.
+        """
+        with transaction.atomic(), connection.cursor() as cursor:
             cursor.execute(
-                self.create_trigger.format("transaction", ",".join(index_fields))
+                """
+                SELECT 1
+                FROM pg_trigger
+                WHERE tgrelid = 'camp_fin_transaction'::regclass
+                  AND tgname = 'transaction_search_update_anonymous'
+            """
             )
 
+            if cursor.fetchone():
+                return
+
             this_dir = os.path.abspath(os.path.dirname(__file__))
             file_path = os.path.join(this_dir, "sql", "anonymous_trigger.sql")
 
@@ -154,6 +285,8 @@ class Command(BaseCommand):
 
             cursor.execute(anonymous_trigger)
 
+            # Replaces the trigger that updated anonymous rows after they
+            # were written
             cursor.execute(
                 """
                 DROP TRIGGER IF EXISTS add_anonymous_transactions
@@ -163,81 +296,12 @@ class Command(BaseCommand):
 
             cursor.execute(
                 """
-                CREATE TRIGGER add_anonymous_transactions
-                AFTER INSERT OR UPDATE OF {0} ON camp_fin_transaction
+                CREATE TRIGGER transaction_search_update_anonymous
+                BEFORE INSERT OR UPDATE OF {0} ON camp_fin_transaction
                 FOR EACH ROW EXECUTE PROCEDURE update_anonymous()
             """.format(
                     ",".join(index_fields)
                 )
             )
 
-    def makeLobbyistIndex(self):
-        index_fields = ["first_name", "middle_name", "last_name", "suffix"]
-
-        vector = "concat_ws(' ', {})".format(", ".join(index_fields))
-
-        with transaction.atomic():
-            cursor = connection.cursor()
-            cursor.execute(self.drop_vector.format("lobbyist"))
-            cursor.execute(self.add_vector.format("lobbyist"))
-            cursor.execute(self.populate_vector.format("lobbyist", vector))
-            cursor.execute(self.add_index.format("lobbyist"))
-
-            cursor.execute(
-                """
-                DROP TRIGGER IF EXISTS lobbyist_search_update
-                ON camp_fin_lobbyist
-            """
-            )
-
-            cursor.execute(
-                self.create_trigger.format("lobbyist", ",".join(index_fields))
-            )
-
-    def makeLobbyistTransactionIndex(self):
-        index_fields = [
-            "name",
-            "beneficiary",
-            "expenditure_purpose",
-        ]
-
-        vector = "concat_ws(' ', {})".format(", ".join(index_fields))
-
-        with transaction.atomic():
-            cursor = connection.cursor()
-            cursor.execute(self.drop_vector.format("lobbyisttransaction"))
-            cursor.execute(self.add_vector.format("lobbyisttransaction"))
-            cursor.execute(self.populate_vector.format("lobbyisttransaction", vector))
-            cursor.execute(self.add_index.format("lobbyisttransaction"))
-
-            cursor.execute(
-                """
-                DROP TRIGGER IF EXISTS lobbyisttransaction_search_update
-                ON camp_fin_lobbyisttransaction
-            """
-            )
-
-            cursor.execute(
-                self.create_trigger.format(
-                    "lobbyisttransaction", ",".join(index_fields)
-                )
-            )
-
-    def makeOrganizationIndex(self):
-        with transaction.atomic():
-            cursor = connection.cursor()
-            cursor.execute(self.drop_vector.format("organization"))
-            cursor.execute(self.add_vector.format("organization"))
-            cursor.execute(
-                self.populate_vector.format("organization", "COALESCE(name, '')")
-            )
-            cursor.execute(self.add_index.format("organization"))
-
-            cursor.execute(
-                """
-                DROP TRIGGER IF EXISTS organization_search_update
-                ON camp_fin_organization
-            """
-            )
-
-            cursor.execute(self.create_trigger.format("organization", "name"))
+            self.stdout.write("Created transaction_search_update_anonymous")
@@ -0,0 +1,260 @@
+from collections import defaultdict
+
+from camp_fin import models
+
+
+class Resolver(object):
+    """
+    Map the natural key of a lookup table row to its primary key. The table is
+    read into memory once, and rows that don't exist yet are created in bulk,
+    so resolving a key during an import is a dictionary lookup rather than a
+    get_or_create round trip.
+    """
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = tuple(fields)
+        self.ids = {}
+
+        # Where there are duplicate keys, prefer the oldest row, which is
+        # what get_or_create would have settled on
+        for pk, *key in model.objects.order_by("-id").values_list("id", *self.fields):
+            self.ids[tuple(key)] = pk
+
+    def resolve(self, keys):
+        """
+        Make sure there is a row for each key in `keys`, creating any missing
+        rows with a single insert.
+        """
+        missing = {tuple(key) for key in keys} - self.ids.keys()
+
+        if missing:
+            created = self.model.objects.bulk_create(
+                self.model(**dict(zip(self.fields, key))) for key in missing
+            )
+
+            for obj in created:
+                key = tuple(getattr(obj, field) for field in self.fields)
+                self.ids[key] = obj.id
+
+    def get(self, *key):
+        """
+        Return the ID of the row with the given natural key, creating it if it
+        does not exist.
+        """
+        if key not in self.ids:
+            self.resolve([key])
+
+        return self.ids[key]
+
+
+class ContactResolver(object):
+    """
+    Match contributors to existing Contacts, creating new Contacts (and the
+    Entities they belong to) in bulk. Contacts are read from the database one
+    batch of addresses at a time, and every Contact seen during the import is
+    kept in memory, so repeat contributors only cost a dictionary lookup.
+    """
+
+    INDIVIDUAL_FIELDS = (
+        "prefix",
+        "first_name",
+        "middle_name",
+        "last_name",
+        "suffix",
+        "occupation",
+        "company_name",
+        "full_name",
+    )
+
+    ORGANIZATION_FIELDS = ("company_name",)
+
+    def __init__(self, entity_types):
+        self.entity_types = entity_types
+        self.contacts = {}
+        self.loaded_addresses = set()
+
+    def _key(self, contact_kwargs, address_id, contact_type_id):
+        return (tuple(sorted(contact_kwargs.items())), address_id, contact_type_id)
+
+    def _load(self, address_ids):
+        """
+        Read Contacts at the given addresses into memory. Contacts are indexed
+        by both the individual and organization lookup fields, since we don't
+        know ahead of time which will be used to find them.
+        """
+        address_ids = set(address_ids) - self.loaded_addresses
+
+        if not address_ids:
+            return
+
+        contacts = models.Contact.objects.filter(
+            status_id=0, address_id__in=address_ids
+        ).order_by("id")
+
+        for contact in contacts:
+            for fields in (self.INDIVIDUAL_FIELDS, self.ORGANIZATION_FIELDS):
+                key = self._key(
+                    {field: getattr(contact, field) for field in fields},
+                    contact.address_id,
+                    contact.contact_type_id,
+                )
+                self.contacts.setdefault(key, contact)
+
+        self.loaded_addresses |= address_ids
+
+    def resolve(self, specs):
+        """
+        Given a list of (contact_kwargs, address_id, contact_type_id,
+        entity_type) tuples, return a list of matching Contacts, creating the
+        ones that don't exist yet.
+        """
+        self._load(address_id for _, address_id, _, _ in specs)
+
+        missing = {}
+
+        for spec in specs:
+            key = self._key(*spec[:3])
+
+            if key not in self.contacts:
+                missing.setdefault(key, spec)
+
+        if missing:
+            self.entity_types.resolve((spec[3],) for spec in missing.values())
+
+            entities = models.Entity.objects.bulk_create(
+                models.Entity(entity_type_id=self.entity_types.get(spec[3]))
+                for spec in missing.values()
+            )
+
+            contacts = models.Contact.objects.bulk_create(
+                models.Contact(
+                    **contact_kwargs,
+                    status_id=0,
+                    address_id=address_id,
+                    contact_type_id=contact_type_id,
+                    entity=entity,
+                )
+                for (contact_kwargs, address_id, contact_type_id, _), entity in zip(
+                    missing.values(), entities
+                )
+            )
+
+            self.contacts.update(zip(missing.keys(), contacts))
+
+        return [self.contacts[self._key(*spec[:3])] for spec in specs]
+
+
+class FilingIndex(object):
+    """
+    Find the PAC, Entity and final Filing that a group of transactions belongs
+    to without querying the database for each group. PACs and candidate
+    Entities are read into memory up front, and final Filings are read one
+    year (of the start of their filing period) at a time.
+    """
+
+    def __init__(self):
+        self.pacs_by_user_id = defaultdict(list)
+        self.pacs_by_name = defaultdict(list)
+
+        for pac in models.PAC.objects.select_related("entity__entity_type").order_by(
+            "id"
+        ):
+            self.pacs_by_user_id[pac.entity.user_id].append(pac)
+            self.pacs_by_name[pac.name].append(pac)
+
+        self.candidate_entities = defaultdict(dict)
+
+        campaigns = models.Campaign.objects.filter(
+            committee__isnull=False, candidate__isnull=False
+        ).values_list("committee_id", "candidate__entity_id")
+
+        entities = models.Entity.objects.select_related("entity_type").in_bulk(
+            {entity_id for _, entity_id in campaigns}
+        )
+
+        for committee_id, entity_id in campaigns:
+            self.candidate_entities[committee_id][entity_id] = entities[entity_id]
+
+        self.filings = defaultdict(list)
+        self.loaded_years = set()
+
+    def _get_one(self, model, objects):
+        if not objects:
+            raise model.DoesNotExist
+
+        if len(objects) > 1:
+            raise model.MultipleObjectsReturned
+
+        return objects[0]
+
+    def _load_filings(self, start_year):
+        if start_year in self.loaded_years:
+            return
+
+        filings = models.Filing.objects.filter(
+            final=True, filing_period__initial_date__year=start_year
+        ).select_related("filing_period", "campaign__committee")
+
+        for filing in filings:
+            key = (
+                filing.entity_id,
+                filing.filing_period.description,
+                filing.filing_period.initial_date.year,
+                filing.filing_period.end_date.year,
+            )
+            self.filings[key].append(filing)
+
+        self.loaded_years.add(start_year)
+
+    def get_pac(self, user_id):
+        """
+        Return the PAC whose Entity has the given state ID, raising
+        DoesNotExist or MultipleObjectsReturned like PAC.objects.get.
+        """
+        return self._get_one(models.PAC, self.pacs_by_user_id[int(user_id)])
+
+    def get_pac_by_name(self, name):
+        return self._get_one(models.PAC, self.pacs_by_name[name])
+
+    def set_user_id(self, pac, user_id):
+        """
+        Save the state ID of a PAC that was found by name, so transactions
+        from its later filings are matched by ID.
+        """
+        self.pacs_by_user_id[pac.entity.user_id].remove(pac)
+
+        pac.entity.user_id = int(user_id)
+        pac.entity.save()
+
+        self.pacs_by_user_id[pac.entity.user_id].append(pac)
+
+    def get_entity(self, pac):
+        """
+        Return the candidate Entity for a PAC that is a candidate committee,
+        or the PAC's own Entity otherwise.
+        """
+        entities = list(self.candidate_entities[pac.id].values())
+
+        if not entities:
+            return pac.entity
+
+        return self._get_one(models.Entity, entities)
+
+    def get_filings(self, entity, report_name, start_year, end_year, committee=None):
+        """
+        Return the final Filings by an Entity for the named filing period. If
+        a committee is given, only return Filings for its campaign.
+        """
+        self._load_filings(start_year)
+
+        filings = self.filings[(entity.id, report_name, start_year, end_year)]
+
+        if committee is not None:
+            filings = [
+                filing
+                for filing in filings
+                if filing.campaign and filing.campaign.committee_id == committee.id
+            ]
+
+        return filings
@@ -1,6 +1,4 @@
 CREATE OR REPLACE FUNCTION update_anonymous() RETURNS TRIGGER AS $update_anonymous$
-    DECLARE
-        myrec VARCHAR;
     BEGIN
 
         IF (TG_OP = 'UPDATE' OR TG_OP = 'INSERT') THEN
@@ -12,9 +10,7 @@ CREATE OR REPLACE FUNCTION update_anonymous() RETURNS TRIGGER AS $update_anonymo
                                         NEW.last_name,
                                         NEW.suffix)), '') = '') THEN
 
-                EXECUTE format('UPDATE camp_fin_transaction SET
-                                  search_name = to_tsvector(%L, %L)
-                                WHERE id = %L', E'english', E'Anonymous', NEW.id);
+                NEW.search_name := to_tsvector('english', 'Anonymous');
 
             END IF;
             RETURN NEW;
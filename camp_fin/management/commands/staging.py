@@ -0,0 +1,1010 @@
+import csv
+from io import StringIO
+
+from django.db import connection
+from django.utils import timezone
+
+from camp_fin import models
+
+from .utils import get_quarter, parse_date
+
+FILING_COLUMNS = (
+    "OrgID",
+    "Committee Name",
+    "Report Name",
+    "Start of Period",
+    "End of Period",
+)
+
+
+def full_name_sql(*columns):
+    """
+    SQL expression for a full name built from its parts, matching the names
+    built by import_transactions: parts joined with spaces, runs of
+    whitespace collapsed, and leading and trailing whitespace removed.
+    """
+    return r"""
+        regexp_replace(
+          regexp_replace(concat_ws(' ', {columns}), '\s{{2,}}', ' ', 'g'),
+          '^\s+|\s+$', '', 'g'
+        )
+    """.format(
+        columns=", ".join(columns)
+    )
+
+
+def street_sql(line_1, line_2):
+    return "{0} || CASE WHEN {1} <> '' THEN ' ' || {1} ELSE '' END".format(
+        line_1, line_2
+    )
+
+
+class StagingImporter(object):
+    """
+    Import a CFIS transaction file with set-based SQL. The raw CSV is copied
+    into a temporary staging table, then deletes, contact matching and inserts
+    each run as a single statement over every staged row, rather than once per
+    row through the ORM. Staging tables are private to the import's
+    connection, so imports can run at the same time.
+
+    Only the distinct filings and transaction dates in the file are handled in
+    Python, so that filings are matched and dates are parsed exactly as they
+    are by the ORM import. Callers should run the import in a transaction.
+    """
+
+    def __init__(self, command, year):
+        self.command = command
+        self.year = int(year)
+        self.now = timezone.now()
+        self.staging_tables = []
+
+    def _copy(self, cursor, table, columns, rows):
+        buffer = StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+
+        cursor.copy_expert(
+            "COPY {table} ({columns}) FROM STDIN WITH CSV".format(
+                table=table, columns=", ".join(columns)
+            ),
+            buffer,
+        )
+
+    def _create_staging_table(self, cursor, table, definition):
+        cursor.execute(f"DROP TABLE IF EXISTS pg_temp.{table}")
+        cursor.execute(f"CREATE TEMPORARY TABLE {table} {definition}")
+        self.staging_tables.append(table)
+
+    def drop_staging_tables(self, cursor):
+        for table in reversed(self.staging_tables):
+            cursor.execute(f"DROP TABLE IF EXISTS pg_temp.{table}")
+
+        self.staging_tables = []
+
+    def stage_file(self, cursor, f):
+        """
+        Copy the raw CSV into staging_record, with a text column per column
+        in the file. Empty values are staged as empty strings, as
+        csv.DictReader would read them, rather than as NULL.
+        """
+        header = next(csv.reader(f))
+        columns = ", ".join(connection.ops.quote_name(column) for column in header)
+
+        self._create_staging_table(
+            cursor,
+            "staging_record",
+            "(id serial, {})".format(
+                ", ".join(
+                    f"{connection.ops.quote_name(column)} text" for column in header
+                )
+            ),
+        )
+
+        cursor.copy_expert(
+            f"""
+            COPY staging_record ({columns})
+            FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL ({columns}))
+            """,
+            f,
+        )
+
+    def stage_filings(self, cursor, quarters):
+        """
+        Match each distinct filing in staging_record from a period beginning
+        in the given quarters to its final Filing, and save the matches in
+        staging_filing. Records from filings that can't be matched are
+        skipped. Returns the IDs of the matched Filings.
+        """
+        columns = ", ".join(connection.ops.quote_name(c) for c in FILING_COLUMNS)
+
+        cursor.execute(f"SELECT DISTINCT {columns} FROM staging_record")
+
+        matches = []
+
+        for row in cursor.fetchall():
+            record = dict(zip(FILING_COLUMNS, row))
+
+            if get_quarter(record["Start of Period"]) not in quarters:
+                continue
+
+            try:
+                filing = self.command._get_filing(record)
+            except ValueError:
+                continue
+
+            matches.append(row + (filing.id,))
+
+        self._create_staging_table(
+            cursor,
+            "staging_filing",
+            """(
+              org_id text,
+              committee_name text,
+              report_name text,
+              start_of_period text,
+              end_of_period text,
+              filing_id integer
+            )""",
+        )
+
+        self._copy(
+            cursor,
+            "staging_filing",
+            [
+                "org_id",
+                "committee_name",
+                "report_name",
+                "start_of_period",
+                "end_of_period",
+                "filing_id",
+            ],
+            matches,
+        )
+
+        return {match[-1] for match in matches}
+
+    def stage_dates(self, cursor, date_column):
+        """
+        Parse each distinct date in a column of staging_record, and save the
+        parsed dates in staging_date.
+        """
+        cursor.execute(
+            "SELECT DISTINCT {} FROM staging_record".format(
+                connection.ops.quote_name(date_column)
+            )
+        )
+
+        dates = []
+
+        for (date_str,) in cursor.fetchall():
+            parsed = parse_date(date_str)
+
+            if parsed:
+                dates.append((date_str, parsed.isoformat(), parsed.date().isoformat()))
+            else:
+                dates.append((date_str, None, None))
+
+        self._create_staging_table(
+            cursor,
+            "staging_date",
+            "(date_string text, parsed timestamp with time zone, day date)",
+        )
+
+        self._copy(cursor, "staging_date", ["date_string", "parsed", "day"], dates)
+
+    def _staged_records(self, date_column):
+        """
+        FROM clause joining staged records to their filings and dates.
+        """
+        return """
+            staging_record AS r
+            JOIN staging_filing AS f
+              ON r."OrgID" = f.org_id
+              AND r."Committee Name" = f.committee_name
+              AND r."Report Name" = f.report_name
+              AND r."Start of Period" = f.start_of_period
+              AND r."End of Period" = f.end_of_period
+            LEFT JOIN staging_date AS d
+              ON r.{date_column} = d.date_string
+        """.format(
+            date_column=connection.ops.quote_name(date_column)
+        )
+
+    def resolve(
+        self,
+        cursor,
+        model,
+        fields,
+        staging_columns,
+        id_column,
+        defaults=None,
+        where="TRUE",
+    ):
+        """
+        Set id_column of the rows in staging_transaction matching the where
+        clause to the ID of the row of model with the same natural key,
+        creating rows that don't exist yet. Where there are duplicates, the
+        oldest row wins, as it does in Resolver.
+        """
+        table = model._meta.db_table
+        defaults = defaults or {}
+
+        fields_sql = ", ".join(fields)
+        staging_sql = ", ".join(staging_columns)
+        join = " AND ".join(
+            f"s.{column} = t.{field}" for field, column in zip(fields, staging_columns)
+        )
+
+        match = f"""
+            UPDATE staging_transaction AS s SET {id_column} = t.id
+            FROM (
+              SELECT MIN(id) AS id, {fields_sql}
+              FROM {table}
+              WHERE ({fields_sql}) IN (
+                SELECT {staging_sql}
+                FROM staging_transaction
+                WHERE {id_column} IS NULL
+                  AND {where}
+              )
+              GROUP BY {fields_sql}
+            ) AS t
+            WHERE s.{id_column} IS NULL
+              AND {join}
+        """
+
+        cursor.execute(match)
+
+        insert_fields = ", ".join(list(fields) + list(defaults))
+        default_values = "".join(", %s" for _ in defaults)
+
+        cursor.execute(
+            f"""
+            INSERT INTO {table} ({insert_fields})
+            SELECT DISTINCT {staging_sql}{default_values}
+            FROM staging_transaction
+            WHERE {id_column} IS NULL
+              AND {where}
+        """,
+            list(defaults.values()),
+        )
+
+        if cursor.rowcount:
+            cursor.execute(match)
+
+    def delete_contributions(self, cursor):
+        """
+        Delete the loans, special events and contributions made in the year
+        being imported from each matched filing. Returns the number of rows
+        deleted, counting the transactions of deleted loans, as the ORM does.
+        """
+        datetime_bounds = connection.ops.year_lookup_bounds_for_datetime_field(
+            self.year
+        )
+        date_bounds = connection.ops.year_lookup_bounds_for_date_field(self.year)
+
+        n_deleted = 0
+
+        cursor.execute(
+            """
+            DELETE FROM camp_fin_loantransaction
+            WHERE loan_id IN (
+              SELECT id
+              FROM camp_fin_loan
+              WHERE filing_id IN (SELECT filing_id FROM staging_filing)
+                AND received_date BETWEEN %s AND %s
+            )
+        """,
+            datetime_bounds,
+        )
+        n_deleted += cursor.rowcount
+
+        cursor.execute(
+            """
+            DELETE FROM camp_fin_loan
+            WHERE filing_id IN (SELECT filing_id FROM staging_filing)
+              AND received_date BETWEEN %s AND %s
+        """,
+            datetime_bounds,
+        )
+        n_deleted += cursor.rowcount
+
+        cursor.execute(
+            """
+            DELETE FROM camp_fin_specialevent
+            WHERE filing_id IN (SELECT filing_id FROM staging_filing)
+              AND event_date BETWEEN %s AND %s
+        """,
+            date_bounds,
+        )
+        n_deleted += cursor.rowcount
+
+        cursor.execute(
+            """
+            DELETE FROM camp_fin_transaction
+            WHERE filing_id IN (SELECT filing_id FROM staging_filing)
+              AND received_date BETWEEN %s AND %s
+              AND transaction_type_id NOT IN (
+                SELECT id
+                FROM camp_fin_transactiontype
+                WHERE description = 'Monetary Expenditure'
+              )
+        """,
+            datetime_bounds,
+        )
+        n_deleted += cursor.rowcount
+
+        return n_deleted
+
+    def delete_expenditures(self, cursor):
+        """
+        Delete the expenditures made in the year being imported from each
+        matched filing. Returns the number of rows deleted.
+        """
+        cursor.execute(
+            """
+            DELETE FROM camp_fin_transaction
+            WHERE filing_id IN (SELECT filing_id FROM staging_filing)
+              AND received_date BETWEEN %s AND %s
+              AND transaction_type_id IN (
+                SELECT id
+                FROM camp_fin_transactiontype
+                WHERE description = 'Monetary Expenditure'
+              )
+        """,
+            connection.ops.year_lookup_bounds_for_datetime_field(self.year),
+        )
+
+        return cursor.rowcount
+
+    def import_contributions(self, f, quarters):
+        """
+        Import a contributions (CON) file. Returns the number of records
+        deleted and created.
+        """
+        with connection.cursor() as cursor:
+            self.stage_file(cursor, f)
+            filing_ids = self.stage_filings(cursor, quarters)
+            self.stage_dates(cursor, "Transaction Date")
+
+            n_deleted = self.delete_contributions(cursor)
+
+            self._create_staging_table(
+                cursor,
+                "staging_transaction",
+                """AS
+                SELECT
+                  r.id,
+                  f.filing_id,
+                  r."Contribution Type" AS contribution_type,
+                  r."Contributor Code" AS contributor_code,
+                  LEFT(r."Contributor Code", 24) AS entity_type,
+                  r."Contributor Code" IN ('Individual', 'Candidate') AS individual,
+                  r."Prefix" AS prefix,
+                  r."First Name" AS first_name,
+                  r."Middle Name" AS middle_name,
+                  r."Last Name" AS last_name,
+                  r."Suffix" AS suffix,
+                  {full_name} AS full_name,
+                  r."Contributor Occupation" AS occupation,
+                  r."Contributor Employer" AS employer,
+                  {street} AS street,
+                  r."Contributor City" AS city,
+                  r."Contributor State" AS state,
+                  r."Contributor Zip Code" AS zipcode,
+                  r."Transaction Amount" AS amount,
+                  r."Check Number" AS check_number,
+                  LEFT(r."Description", 74) AS description,
+                  d.parsed AS received_date,
+                  d.day AS received_day,
+                  CASE
+                    WHEN STRPOS(LOWER(r."Contribution Type"), 'in-kind') > 0
+                      THEN 'In-Kind Contribution'
+                    WHEN STRPOS(LOWER(r."Contribution Type"), 'return') > 0
+                      THEN 'Return Contribution'
+                    WHEN STRPOS(LOWER(r."Contribution Type"), 'anonymous') > 0
+                      THEN 'Anonymous Contribution'
+                    ELSE 'Monetary Contribution'
+                  END AS transaction_type,
+                  TRUE AS contribution,
+                  STRPOS(LOWER(r."Contribution Type"), 'anonymous') > 0 AS anonymous,
+                  NULL::integer AS state_id,
+                  NULL::integer AS contact_type_id,
+                  NULL::integer AS address_id,
+                  NULL::integer AS contact_id,
+                  NULL::integer AS transaction_type_id
+                FROM {records}
+                """.format(
+                    full_name=full_name_sql(
+                        'r."Prefix"',
+                        'r."First Name"',
+                        'r."Middle Name"',
+                        'r."Last Name"',
+                        'r."Suffix"',
+                    ),
+                    street=street_sql(
+                        'r."Contributor Address Line 1"',
+                        'r."Contributor Address Line 2"',
+                    ),
+                    records=self._staged_records("Transaction Date"),
+                ),
+            )
+
+            self.resolve(cursor, models.State, ["postal_code"], ["state"], "state_id")
+            self.resolve(
+                cursor,
+                models.ContactType,
+                ["description"],
+                ["contributor_code"],
+                "contact_type_id",
+            )
+            self.resolve(
+                cursor,
+                models.Address,
+                ["street", "city", "state_id", "zipcode"],
+                ["street", "city", "state_id", "zipcode"],
+                "address_id",
+                defaults={"date_added": self.now},
+            )
+            self.resolve_contacts(cursor)
+
+            for (contribution_type,) in self._unknown_contribution_types(cursor):
+                self.command.stderr.write(
+                    f"Could not determine contribution type from record: {contribution_type}"
+                )
+
+            for (date_str,) in self._undated_loans(cursor):
+                self.command.stderr.write(
+                    f"Could not parse date of loan, skipping record: {date_str}"
+                )
+
+            n_imported = self.insert_loans(cursor)
+            n_imported += self.insert_special_events(cursor)
+            n_imported += self.insert_contributions(cursor)
+
+            self.drop_staging_tables(cursor)
+
+        return filing_ids, n_deleted, n_imported
+
+    def resolve_contacts(self, cursor):
+        """
+        Match each staged contribution to a Contact, creating Contacts (and an
+        Entity for each) that don't exist yet. As in ContactResolver,
+        individuals are matched on their name, occupation and employer, and
+        organizations on their name alone.
+        """
+        match = """
+            UPDATE staging_transaction AS s SET contact_id = c.id
+            FROM (
+              SELECT
+                s.id AS staged_id,
+                MIN(c.id) AS id
+              FROM staging_transaction AS s
+              JOIN camp_fin_contact AS c
+                ON c.address_id = s.address_id
+                AND c.contact_type_id = s.contact_type_id
+                AND c.status_id = 0
+              WHERE s.contact_id IS NULL
+                AND (
+                  (
+                    s.individual
+                    AND c.prefix = s.prefix
+                    AND c.first_name = s.first_name
+                    AND c.middle_name = s.middle_name
+                    AND c.last_name = s.last_name
+                    AND c.suffix = s.suffix
+                    AND c.occupation = s.occupation
+                    AND c.company_name = s.employer
+                    AND c.full_name = s.full_name
+                  )
+                  OR (NOT s.individual AND c.company_name = s.full_name)
+                )
+              GROUP BY s.id
+            ) AS c
+            WHERE s.id = c.staged_id
+        """
+
+        cursor.execute(match)
+
+        self._create_staging_table(
+            cursor,
+            "staging_contact",
+            """AS
+            SELECT DISTINCT
+              individual,
+              CASE WHEN individual THEN prefix END AS prefix,
+              CASE WHEN individual THEN first_name END AS first_name,
+              CASE WHEN individual THEN middle_name END AS middle_name,
+              CASE WHEN individual THEN last_name END AS last_name,
+              CASE WHEN individual THEN suffix END AS suffix,
+              CASE WHEN individual THEN occupation END AS occupation,
+              CASE WHEN individual THEN employer END AS employer,
+              full_name,
+              address_id,
+              contact_type_id,
+              entity_type,
+              NULL::integer AS entity_type_id,
+              NULL::integer AS entity_id
+            FROM staging_transaction
+            WHERE contact_id IS NULL
+            """,
+        )
+
+        cursor.execute(
+            """
+            INSERT INTO camp_fin_entitytype (description)
+            SELECT DISTINCT entity_type
+            FROM staging_contact
+            WHERE entity_type NOT IN (SELECT description FROM camp_fin_entitytype)
+        """
+        )
+
+        cursor.execute(
+            """
+            UPDATE staging_contact AS s SET
+              entity_type_id = et.id,
+              entity_id = nextval(pg_get_serial_sequence('camp_fin_entity', 'id'))
+            FROM (
+              SELECT MIN(id) AS id, description
+              FROM camp_fin_entitytype
+              GROUP BY description
+            ) AS et
+            WHERE s.entity_type = et.description
+        """
+        )
+
+        cursor.execute(
+            """
+            INSERT INTO camp_fin_entity (id, entity_type_id)
+            SELECT entity_id, entity_type_id
+            FROM staging_contact
+        """
+        )
+
+        cursor.execute(
+            """
+            INSERT INTO camp_fin_contact (
+              prefix,
+              first_name,
+              middle_name,
+              last_name,
+              suffix,
+              occupation,
+              company_name,
+              full_name,
+              status_id,
+              address_id,
+              contact_type_id,
+              entity_id,
+              date_added
+            )
+            SELECT
+              prefix,
+              first_name,
+              middle_name,
+              last_name,
+              suffix,
+              occupation,
+              CASE WHEN individual THEN employer ELSE full_name END,
+              CASE WHEN individual THEN full_name END,
+              0,
+              address_id,
+              contact_type_id,
+              entity_id,
+              %s
+            FROM staging_contact
+            ORDER BY entity_id
+        """,
+            [self.now],
+        )
+
+        if cursor.rowcount:
+            cursor.execute(match)
+
+    def _unknown_contribution_types(self, cursor):
+        cursor.execute(
+            """
+            SELECT contribution_type
+            FROM staging_transaction
+            WHERE contribution_type NOT IN ('Loans Received', 'Special Event')
+              AND STRPOS(contribution_type, 'Contribution') = 0
+            ORDER BY id
+        """
+        )
+
+        return cursor.fetchall()
+
+    def _undated_loans(self, cursor):
+        cursor.execute(
+            """
+            SELECT r."Transaction Date"
+            FROM staging_transaction AS s
+            JOIN staging_record AS r
+              ON s.id = r.id
+            WHERE s.contribution_type = 'Loans Received'
+              AND s.received_date IS NULL
+            ORDER BY s.id
+        """
+        )
+
+        return cursor.fetchall()
+
+    def insert_loans(self, cursor):
+        """
+        Create a Loan for each distinct loan received, reusing a matching Loan
+        if there is one, and a LoanTransaction paying it for each staged row.
+        Loans must have a date, so rows whose date couldn't be parsed are
+        skipped (see _undated_loans). Returns the number of LoanTransactions
+        created.
+        """
+        self._create_staging_table(
+            cursor,
+            "staging_loan",
+            """AS
+            SELECT DISTINCT
+              s.amount::double precision AS amount,
+              s.received_date,
+              s.check_number,
+              s.contact_id,
+              COALESCE(c.company_name, '') AS company_name,
+              s.filing_id,
+              s.street,
+              s.city,
+              s.state,
+              s.zipcode,
+              NULL::integer AS loan_id
+            FROM staging_transaction AS s
+            JOIN camp_fin_contact AS c
+              ON s.contact_id = c.id
+            WHERE s.contribution_type = 'Loans Received'
+              AND s.received_date IS NOT NULL
+            """,
+        )
+
+        loan_columns = """
+            amount,
+            received_date,
+            check_number,
+            contact_id,
+            company_name,
+            filing_id,
+            address,
+            city,
+            state,
+            zipcode
+        """
+
+        match = f"""
+            UPDATE staging_loan AS s SET loan_id = l.id
+            FROM (
+              SELECT MIN(id) AS id, {loan_columns}
+              FROM camp_fin_loan
+              WHERE status_id = 0
+                AND filing_id IN (SELECT filing_id FROM staging_loan)
+              GROUP BY {loan_columns}
+            ) AS l
+            WHERE s.amount = l.amount
+              AND s.received_date = l.received_date
+              AND s.check_number = l.check_number
+              AND s.contact_id = l.contact_id
+              AND s.company_name = l.company_name
+              AND s.filing_id = l.filing_id
+              AND s.street = l.address
+              AND s.city = l.city
+              AND s.state = l.state
+              AND s.zipcode = l.zipcode
+        """
+
+        cursor.execute(match)
+
+        cursor.execute(
+            f"""
+            INSERT INTO camp_fin_loan ({loan_columns}, status_id, date_added)
+            SELECT
+              amount,
+              received_date,
+              check_number,
+              contact_id,
+              company_name,
+              filing_id,
+              street,
+              city,
+              state,
+              zipcode,
+              0,
+              %s
+            FROM staging_loan
+            WHERE loan_id IS NULL
+        """,
+            [self.now],
+        )
+
+        if cursor.rowcount:
+            cursor.execute(match)
+
+        cursor.execute(
+            """
+            INSERT INTO camp_fin_loantransactiontype (description)
+            SELECT 'Payment'
+            WHERE NOT EXISTS (
+              SELECT 1 FROM camp_fin_loantransactiontype WHERE description = 'Payment'
+            )
+        """
+        )
+
+        cursor.execute(
+            """
+            INSERT INTO camp_fin_loantransaction (
+              amount,
+              transaction_date,
+              transaction_status_id,
+              loan_id,
+              filing_id,
+              transaction_type_id,
+              date_added
+            )
+            SELECT
+              s.amount::double precision,
+              s.received_date,
+              0,
+              l.loan_id,
+              s.filing_id,
+              (
+                SELECT MIN(id)
+                FROM camp_fin_loantransactiontype
+                WHERE description = 'Payment'
+              ),
+              %s
+            FROM staging_transaction AS s
+            JOIN camp_fin_contact AS c
+              ON s.contact_id = c.id
+            JOIN staging_loan AS l
+              ON s.amount::double precision = l.amount
+              AND s.received_date = l.received_date
+              AND s.check_number = l.check_number
+              AND s.contact_id = l.contact_id
+              AND COALESCE(c.company_name, '') = l.company_name
+              AND s.filing_id = l.filing_id
+              AND s.street = l.street
+              AND s.city = l.city
+              AND s.state = l.state
+              AND s.zipcode = l.zipcode
+            WHERE s.contribution_type = 'Loans Received'
+            ORDER BY s.id
+        """,
+            [self.now],
+        )
+
+        return cursor.rowcount
+
+    def insert_special_events(self, cursor):
+        """
+        Create a SpecialEvent for each staged special event. Returns the
+        number of SpecialEvents created.
+        """
+        cursor.execute(
+            """
+            INSERT INTO camp_fin_specialevent (
+              anonymous_contributions,
+              event_date,
+              admission_price,
+              attendance,
+              total_admissions,
+              total_expenditures,
+              transaction_status_id,
+              sponsors,
+              filing_id,
+              address,
+              city,
+              zipcode,
+              date_added
+            )
+            SELECT
+              s.amount::double precision,
+              s.received_day,
+              0,
+              0,
+              0,
+              0,
+              0,
+              COALESCE(NULLIF(c.company_name, ''), 'Not specified'),
+              s.filing_id,
+              s.street,
+              s.city,
+              s.zipcode,
+              %s
+            FROM staging_transaction AS s
+            JOIN camp_fin_contact AS c
+              ON s.contact_id = c.id
+            WHERE s.contribution_type = 'Special Event'
+            ORDER BY s.id
+        """,
+            [self.now],
+        )
+
+        return cursor.rowcount
+
+    def insert_contributions(self, cursor):
+        """
+        Create a Transaction for each staged contribution. Returns the number
+        of Transactions created.
+        """
+        self.resolve(
+            cursor,
+            models.TransactionType,
+            ["description", "contribution", "anonymous"],
+            ["transaction_type", "contribution", "anonymous"],
+            "transaction_type_id",
+            where="STRPOS(contribution_type, 'Contribution') > 0",
+        )
+
+        cursor.execute(
+            """
+            INSERT INTO camp_fin_transaction (
+              amount,
+              received_date,
+              check_number,
+              description,
+              contact_id,
+              full_name,
+              name_prefix,
+              first_name,
+              middle_name,
+              last_name,
+              suffix,
+              filing_id,
+              transaction_type_id,
+              company_name,
+              occupation,
+              address,
+              city,
+              state,
+              zipcode,
+              date_added,
+              redact
+            )
+            SELECT
+              s.amount::double precision,
+              s.received_date,
+              s.check_number,
+              s.description,
+              s.contact_id,
+              c.full_name,
+              c.prefix,
+              c.first_name,
+              c.middle_name,
+              c.last_name,
+              c.suffix,
+              s.filing_id,
+              s.transaction_type_id,
+              COALESCE(c.company_name, ''),
+              c.occupation,
+              s.street,
+              s.city,
+              s.state,
+              s.zipcode,
+              %s,
+              FALSE
+            FROM staging_transaction AS s
+            JOIN camp_fin_contact AS c
+              ON s.contact_id = c.id
+            WHERE STRPOS(s.contribution_type, 'Contribution') > 0
+            ORDER BY s.id
+        """,
+            [self.now],
+        )
+
+        return cursor.rowcount
+
+    def import_expenditures(self, f, quarters):
+        """
+        Import an expenditures (EXP) file. Returns the number of records
+        deleted and created.
+        """
+        with connection.cursor() as cursor:
+            self.stage_file(cursor, f)
+            filing_ids = self.stage_filings(cursor, quarters)
+            self.stage_dates(cursor, "Expenditure Date")
+
+            n_deleted = self.delete_expenditures(cursor)
+
+            self._create_staging_table(
+                cursor,
+                "staging_transaction",
+                """AS
+                SELECT
+                  r.id,
+                  f.filing_id,
+                  r."Expenditure Amount" AS amount,
+                  d.parsed AS received_date,
+                  LEFT(
+                    COALESCE(NULLIF(r."Description", ''), r."Expenditure Type"),
+                    74
+                  ) AS description,
+                  {full_name} AS full_name,
+                  r."Payee Prefix" AS prefix,
+                  r."Payee First Name" AS first_name,
+                  r."Payee Middle Name" AS middle_name,
+                  r."Payee Last Name" AS last_name,
+                  r."Payee Suffix" AS suffix,
+                  {street} AS street,
+                  r."Payee City" AS city,
+                  r."Payee State" AS state,
+                  r."Payee Zip Code" AS zipcode,
+                  'Monetary Expenditure'::text AS transaction_type,
+                  FALSE AS contribution,
+                  FALSE AS anonymous,
+                  NULL::integer AS transaction_type_id
+                FROM {records}
+                """.format(
+                    full_name=full_name_sql(
+                        'r."Payee Prefix"',
+                        'r."Payee First Name"',
+                        'r."Payee Middle Name"',
+                        'r."Payee Last Name"',
+                        'r."Payee Suffix"',
+                    ),
+                    street=street_sql('r."Payee Address 1"', 'r."Payee Address 2"'),
+                    records=self._staged_records("Expenditure Date"),
+                ),
+            )
+
+            self.resolve(
+                cursor,
+                models.TransactionType,
+                ["description", "contribution", "anonymous"],
+                ["transaction_type", "contribution", "anonymous"],
+                "transaction_type_id",
+            )
+
+            cursor.execute(
+                """
+                INSERT INTO camp_fin_transaction (
+                  amount,
+                  received_date,
+                  description,
+                  full_name,
+                  name_prefix,
+                  first_name,
+                  middle_name,
+                  last_name,
+                  suffix,
+                  company_name,
+                  filing_id,
+                  transaction_type_id,
+                  address,
+                  city,
+                  state,
+                  zipcode,
+                  date_added,
+                  redact
+                )
+                SELECT
+                  amount::double precision,
+                  received_date,
+                  description,
+                  full_name,
+                  prefix,
+                  first_name,
+                  middle_name,
+                  last_name,
+                  suffix,
+                  full_name,
+                  filing_id,
+                  transaction_type_id,
+                  street,
+                  city,
+                  state,
+                  zipcode,
+                  %s,
+                  FALSE
+                FROM staging_transaction
+                ORDER BY id
+            """,
+                [self.now],
+            )
+
+            n_imported = cursor.rowcount
+
+            self.drop_staging_tables(cursor)
+
+        return filing_ids, n_deleted, n_imported
@@ -0,0 +1,329 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max
+
+from camp_fin.models import SearchDocument, SearchDocumentChange
+
+# Candidates and PACs whose transactions changed, whose totals need updating
+CHANGED_ENTITY_IDS = """
+    SELECT filing.entity_id
+    FROM search_changes AS changes
+    JOIN camp_fin_transaction AS t
+      ON changes.object_id = t.id
+    JOIN camp_fin_filing AS filing
+      ON t.filing_id = filing.id
+    WHERE changes.kind = 'transaction'
+"""
+
+# Query selecting the search documents of each kind, with a placeholder for
+# a condition on `o`, the row each document is made from, and a query
+# selecting the IDs of the rows whose documents changed
+SEARCH_DOCUMENTS = {
+    "candidate": (
+        """
+        SELECT
+          'candidate',
+          o.id,
+          o.full_name,
+          'Candidate',
+          o.slug,
+          (
+            SELECT SUM(amount)
+            FROM contributions_by_month
+            WHERE entity_id = o.entity_id
+          ),
+          NULL::timestamp with time zone,
+          setweight(to_tsvector('english', COALESCE(o.full_name, '')), 'A')
+        FROM camp_fin_candidate AS o
+        WHERE EXISTS (
+            SELECT 1
+            FROM camp_fin_campaign AS campaign
+            WHERE campaign.candidate_id = o.id
+              AND campaign.date_added >= '2010-01-01'
+          )
+          {where}
+        """,
+        """
+        SELECT object_id FROM search_changes WHERE kind = 'candidate'
+        UNION
+        SELECT id FROM camp_fin_candidate
+        WHERE entity_id IN ({})
+        """.format(
+            CHANGED_ENTITY_IDS
+        ),
+    ),
+    "pac": (
+        """
+        SELECT
+          'pac',
+          o.id,
+          o.name,
+          'PAC',
+          o.slug,
+          (
+            SELECT SUM(amount)
+            FROM contributions_by_month
+            WHERE entity_id = o.entity_id
+          ),
+          NULL::timestamp with time zone,
+          setweight(to_tsvector('english', COALESCE(o.name, '')), 'A')
+        FROM camp_fin_pac AS o
+        WHERE EXISTS (
+            SELECT 1
+            FROM camp_fin_filing AS filing
+            WHERE filing.entity_id = o.entity_id
+              AND filing.date_added >= '2010-01-01'
+          )
+          {where}
+        """,
+        """
+        SELECT object_id FROM search_changes WHERE kind = 'pac'
+        UNION
+        SELECT id FROM camp_fin_pac
+        WHERE entity_id IN ({})
+        """.format(
+            CHANGED_ENTITY_IDS
+        ),
+    ),
+    "contribution": (
+        """
+        SELECT DISTINCT ON (o.id)
+          'contribution',
+          o.id,
+          COALESCE(o.full_name, o.company_name),
+          CASE WHEN pac.name IS NULL OR TRIM(pac.name) = ''
+            THEN candidate.full_name
+            ELSE pac.name
+          END,
+          NULL::varchar,
+          o.amount,
+          o.received_date,
+          setweight(to_tsvector('english', concat_ws(' ',
+            o.company_name, o.name_prefix, o.first_name, o.middle_name,
+            o.last_name, o.suffix
+          )), 'A') ||
+          setweight(to_tsvector('english', concat_ws(' ',
+            o.address, o.city, o.state, o.zipcode
+          )), 'C')
+        FROM camp_fin_transaction AS o
+        JOIN camp_fin_transactiontype AS tt
+          ON o.transaction_type_id = tt.id
+        JOIN camp_fin_filing AS filing
+          ON o.filing_id = filing.id
+        LEFT JOIN camp_fin_pac AS pac
+          ON filing.entity_id = pac.entity_id
+        LEFT JOIN camp_fin_candidate AS candidate
+          ON filing.entity_id = candidate.entity_id
+        WHERE tt.contribution = TRUE
+          AND (o.redact = FALSE OR o.redact IS NULL)
+          AND o.received_date >= '2010-01-01'
+          {where}
+        ORDER BY o.id
+        """,
+        "SELECT object_id FROM search_changes WHERE kind = 'transaction'",
+    ),
+    "expenditure": (
+        """
+        SELECT DISTINCT ON (o.id)
+          'expenditure',
+          o.id,
+          COALESCE(o.full_name, o.company_name),
+          CASE WHEN pac.name IS NULL OR TRIM(pac.name) = ''
+            THEN candidate.full_name
+            ELSE pac.name
+          END,
+          NULL::varchar,
+          o.amount,
+          o.received_date,
+          setweight(to_tsvector('english', concat_ws(' ',
+            o.company_name, o.name_prefix, o.first_name, o.middle_name,
+            o.last_name, o.suffix
+          )), 'A') ||
+          setweight(to_tsvector('english', concat_ws(' ',
+            o.address, o.city, o.state, o.zipcode
+          )), 'C')
+        FROM camp_fin_transaction AS o
+        JOIN camp_fin_transactiontype AS tt
+          ON o.transaction_type_id = tt.id
+        JOIN camp_fin_filing AS filing
+          ON o.filing_id = filing.id
+        LEFT JOIN camp_fin_pac AS pac
+          ON filing.entity_id = pac.entity_id
+        LEFT JOIN camp_fin_candidate AS candidate
+          ON filing.entity_id = candidate.entity_id
+        WHERE tt.contribution = FALSE
+          AND o.received_date >= '2010-01-01'
+          {where}
+        ORDER BY o.id
+        """,
+        "SELECT object_id FROM search_changes WHERE kind = 'transaction'",
+    ),
+    "lobbyist": (
+        """
+        SELECT
+          'lobbyist',
+          o.id,
+          concat_ws(' ', o.prefix, o.first_name, o.middle_name, o.last_name,
+                         o.suffix),
+          'Lobbyist',
+          o.slug,
+          NULL::double precision,
+          NULL::timestamp with time zone,
+          setweight(to_tsvector('english', concat_ws(' ',
+            o.first_name, o.middle_name, o.last_name, o.suffix
+          )), 'A')
+        FROM camp_fin_lobbyist AS o
+        WHERE TRUE
+          {where}
+        """,
+        "SELECT object_id FROM search_changes WHERE kind = 'lobbyist'",
+    ),
+    "organization": (
+        """
+        SELECT
+          'organization',
+          o.id,
+          o.name,
+          CASE WHEN
+            address.street IS NULL OR TRIM(address.street) = ''
+          THEN
+            ''
+          ELSE
+            address.street || ' ' ||
+            address.city || ', ' ||
+            state.postal_code || ' ' ||
+            address.zipcode
+          END,
+          o.slug,
+          NULL::double precision,
+          NULL::timestamp with time zone,
+          setweight(to_tsvector('english', COALESCE(o.name, '')), 'A')
+        FROM camp_fin_organization AS o
+        LEFT JOIN camp_fin_address AS address
+          ON o.permanent_address_id = address.id
+        LEFT JOIN camp_fin_state AS state
+          ON address.state_id = state.id
+        WHERE TRUE
+          {where}
+        """,
+        "SELECT object_id FROM search_changes WHERE kind = 'organization'",
+    ),
+    "lobbyisttransaction": (
+        """
+        SELECT DISTINCT ON (o.id)
+          'lobbyisttransaction',
+          o.id,
+          o.name,
+          concat_ws(' ', lobbyist.prefix, lobbyist.first_name,
+                         lobbyist.middle_name, lobbyist.last_name,
+                         lobbyist.suffix),
+          lobbyist.slug,
+          o.amount,
+          o.received_date,
+          setweight(to_tsvector('english', COALESCE(o.name, '')), 'A') ||
+          setweight(to_tsvector('english', COALESCE(o.beneficiary, '')), 'B') ||
+          setweight(
+            to_tsvector('english', COALESCE(o.expenditure_purpose, '')), 'C'
+          )
+        FROM camp_fin_lobbyisttransaction AS o
+        JOIN camp_fin_lobbyistreport AS report
+          ON o.lobbyist_report_id = report.id
+        JOIN camp_fin_lobbyist AS lobbyist
+          ON report.entity_id = lobbyist.entity_id
+        WHERE TRUE
+          {where}
+        ORDER BY o.id
+        """,
+        "SELECT object_id FROM search_changes WHERE kind = 'lobbyisttransaction'",
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = """
+        Update the search documents used by global search. By default, only
+        the documents of rows logged as changed are updated; run with --full
+        to rebuild every document.
+
+        Example:
+
+            python manage.py update_search_documents --full
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            dest="full",
+            action="store_true",
+            help="Rebuild every search document, rather than only changed ones",
+        )
+
+    def handle(self, *args, **options):
+        # Only consume the changes logged so far, so that changes logged while
+        # the documents are updated are left for the next run
+        last_change_id = SearchDocumentChange.objects.aggregate(Max("id"))["id__max"]
+
+        # Documents are built from scratch the first time
+        full = options["full"] or not SearchDocument.objects.exists()
+
+        if not full and last_change_id is None:
+            self.stdout.write("No changes to search documents")
+            return
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            if full:
+                cursor.execute("DELETE FROM camp_fin_searchdocument")
+
+                for kind, (query, _) in SEARCH_DOCUMENTS.items():
+                    self.insertDocuments(cursor, query.format(where=""))
+            else:
+                cursor.execute(
+                    """
+                    CREATE TEMPORARY TABLE search_changes ON COMMIT DROP AS
+                    SELECT DISTINCT kind, object_id
+                    FROM camp_fin_searchdocumentchange
+                    WHERE id <= %s
+                """,
+                    [last_change_id],
+                )
+
+                for kind, (query, changed_ids) in SEARCH_DOCUMENTS.items():
+                    cursor.execute(
+                        """
+                        DELETE FROM camp_fin_searchdocument
+                        WHERE kind = %s
+                          AND object_id IN ({})
+                    """.format(
+                            changed_ids
+                        ),
+                        [kind],
+                    )
+
+                    self.insertDocuments(
+                        cursor,
+                        query.format(where="AND o.id IN ({})".format(changed_ids)),
+                    )
+
+            if last_change_id is not None:
+                SearchDocumentChange.objects.filter(id__lte=last_change_id).delete()
+
+        self.stdout.write(self.style.SUCCESS("Search documents updated!"))
+
+    def insertDocuments(self, cursor, query):
+        cursor.execute(
+            """
+            INSERT INTO camp_fin_searchdocument (
+                kind,
+                object_id,
+                name,
+                description,
+                slug,
+                amount,
+                date,
+                search_vector
+            )
+            {}
+        """.format(
+                query
+            )
+        )
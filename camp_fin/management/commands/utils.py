@@ -1,8 +1,24 @@
+import math
 import re
+from datetime import datetime
+from functools import lru_cache
 
 from dateutil.parser import ParserError, parse
 from dateutil.tz import gettz
 
+MOUNTAIN_TZ = gettz("America/Denver")
+
+# Date formats found in CFIS exports, e.g., 1/31/2024, 01/31/2024 12:00:00 AM,
+# 2024-01-31 and 2024-01-31T00:00:00.000. Anything else is left to dateutil.
+US_DATE = re.compile(
+    r"(\d{1,2})/(\d{1,2})/(\d{4})"
+    r"(?:\s+(\d{1,2}):(\d{2})(?::(\d{2}))?(?:\s*([AaPp][Mm]))?)?"
+)
+ISO_DATE = re.compile(
+    r"(\d{4})-(\d{1,2})-(\d{1,2})"
+    r"(?:[T\s](\d{1,2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6}))?)?)?"
+)
+
 
 def convert_to_float(value):
     value = re.sub("[^0-9.]", "", value)
@@ -12,9 +28,85 @@ def convert_to_float(value):
         return float(value)
 
 
+def _to_hour(hour, meridian):
+    hour = int(hour)
+
+    if meridian:
+        if hour > 12:
+            raise ValueError(f"Invalid 12-hour time: {hour} {meridian}")
+
+        if meridian.lower() == "am":
+            hour = hour % 12
+        else:
+            hour = hour % 12 + 12
+
+    return hour
+
+
+def _parse_known_format(date_str):
+    """
+    Parse one of the date formats used by CFIS with a precompiled pattern.
+    Returns None if the string is in some other format, and raises ValueError
+    if it is in a known format but isn't a valid date.
+    """
+    date_str = date_str.strip()
+
+    match = US_DATE.fullmatch(date_str)
+
+    if match:
+        month, day, year, hour, minute, second, meridian = match.groups()
+
+        return datetime(
+            int(year),
+            int(month),
+            int(day),
+            _to_hour(hour or 0, meridian),
+            int(minute or 0),
+            int(second or 0),
+            tzinfo=MOUNTAIN_TZ,
+        )
+
+    match = ISO_DATE.fullmatch(date_str)
+
+    if match:
+        year, month, day, hour, minute, second, fraction = match.groups()
+
+        return datetime(
+            int(year),
+            int(month),
+            int(day),
+            int(hour or 0),
+            int(minute or 0),
+            int(second or 0),
+            int((fraction or "0").ljust(6, "0")),
+            tzinfo=MOUNTAIN_TZ,
+        )
+
+    return None
+
+
+@lru_cache(maxsize=16384)
 def parse_date(date_str):
+    """
+    Parse a date string from a CFIS export as a datetime in Mountain time.
+    Returns None if the string can't be parsed. Results are memoized, since
+    the same few dates (e.g., the start and end of a filing period) appear on
+    many rows of an export.
+    """
     try:
-        mountain_tz = gettz("America/Denver")
-        return parse(date_str).replace(tzinfo=mountain_tz)
+        parsed = _parse_known_format(date_str)
+    except (AttributeError, ValueError):
+        parsed = None
+
+    if parsed:
+        return parsed
+
+    try:
+        return parse(date_str).replace(tzinfo=MOUNTAIN_TZ)
     except (ParserError, TypeError):
         return None
+
+
+def get_quarter(date_str):
+    date = parse_date(date_str)
+    return math.ceil(date.month / 3.0)
@@ -0,0 +1,75 @@
+import threading
+from contextlib import contextmanager
+
+from django.middleware import cache as cache_middleware
+
+from camp_fin.invalidation import batch_invalidation, page_key_prefix
+
+_state = threading.local()
+
+
+class VersionedCacheMixin(object):
+    """
+    Include the versions of a page's cache groups in its cache key, so that
+    pages can be invalidated by group (see camp_fin.invalidation).
+
+    Django's cache middleware reads the key prefix from self.key_prefix, so
+    the prefix for the current request is kept in a thread local while the
+    middleware runs.
+    """
+
+    @property
+    def key_prefix(self):
+        return getattr(_state, "key_prefix", None) or self.base_key_prefix
+
+    @key_prefix.setter
+    def key_prefix(self, value):
+        self.base_key_prefix = value
+
+    @contextmanager
+    def request_key_prefix(self, request):
+        if not hasattr(request, "_cache_key_prefix"):
+            request._cache_key_prefix = page_key_prefix(request, self.base_key_prefix)
+
+        _state.key_prefix = request._cache_key_prefix
+
+        try:
+            yield
+        finally:
+            _state.key_prefix = None
+
+
+class UpdateCacheMiddleware(
+    VersionedCacheMixin, cache_middleware.UpdateCacheMiddleware
+):
+    def process_response(self, request, response):
+        if not self._should_update_cache(request, response):
+            return super().process_response(request, response)
+
+        with self.request_key_prefix(request):
+            return super().process_response(request, response)
+
+
+class FetchFromCacheMiddleware(
+    VersionedCacheMixin, cache_middleware.FetchFromCacheMiddleware
+):
+    def process_request(self, request):
+        if request.method not in ("GET", "HEAD"):
+            return super().process_request(request)
+
+        with self.request_key_prefix(request):
+            return super().process_request(request)
+
+
+class CacheInvalidationMiddleware(object):
+    """
+    Flush the cache invalidations made while handling a request once, after
+    the response has been built.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with batch_invalidation():
+            return self.get_response(request)
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:17
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("camp_fin", "0093_auto_20250121_0716"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AggregateChange",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("entity_id", models.IntegerField()),
+                ("year", models.IntegerField()),
+                ("date_added", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
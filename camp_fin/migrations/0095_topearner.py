@@ -0,0 +1,40 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("camp_fin", "0094_aggregatechange"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TopEarner",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("days", models.IntegerField()),
+                ("rank", models.IntegerField()),
+                ("slug", models.CharField(max_length=500, null=True)),
+                ("name", models.CharField(max_length=500, null=True)),
+                ("new_funds", models.FloatField()),
+                ("current_funds", models.FloatField(null=True)),
+                ("committee_type", models.CharField(max_length=9)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="topearner",
+            index=models.Index(
+                fields=["days", "rank"], name="camp_fin_to_days_401ec2_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,132 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:36
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+# Columns of each table that search documents are made from
+SEARCH_DOCUMENT_COLUMNS = {
+    "candidate": ["full_name", "slug", "entity_id"],
+    "pac": ["name", "slug", "entity_id"],
+    "transaction": [
+        "company_name",
+        "name_prefix",
+        "first_name",
+        "middle_name",
+        "last_name",
+        "suffix",
+        "full_name",
+        "address",
+        "city",
+        "state",
+        "zipcode",
+        "amount",
+        "received_date",
+        "redact",
+        "transaction_type_id",
+        "filing_id",
+    ],
+    "lobbyist": ["prefix", "first_name", "middle_name", "last_name", "suffix", "slug"],
+    "organization": ["name", "slug", "permanent_address_id"],
+    "lobbyisttransaction": [
+        "name",
+        "beneficiary",
+        "expenditure_purpose",
+        "amount",
+        "received_date",
+        "lobbyist_report_id",
+    ],
+}
+
+LOG_CHANGE_FUNCTION = """
+    CREATE OR REPLACE FUNCTION log_search_document_change() RETURNS TRIGGER AS $$
+        BEGIN
+            IF (TG_OP = 'DELETE') THEN
+                INSERT INTO camp_fin_searchdocumentchange (kind, object_id)
+                VALUES (TG_ARGV[0], OLD.id);
+            ELSE
+                INSERT INTO camp_fin_searchdocumentchange (kind, object_id)
+                VALUES (TG_ARGV[0], NEW.id);
+            END IF;
+            RETURN NULL;
+        END;
+    $$ LANGUAGE plpgsql;
+"""
+
+CREATE_TRIGGER = """
+    CREATE TRIGGER {0}_search_document_change
+    AFTER INSERT OR DELETE OR UPDATE OF {1} ON camp_fin_{0}
+    FOR EACH ROW EXECUTE PROCEDURE log_search_document_change('{0}')
+"""
+
+DROP_TRIGGER = """
+    DROP TRIGGER IF EXISTS {0}_search_document_change ON camp_fin_{0}
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("camp_fin", "0095_topearner"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SearchDocument",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("kind", models.CharField(max_length=20)),
+                ("object_id", models.IntegerField()),
+                ("name", models.CharField(max_length=500, null=True)),
+                ("description", models.TextField(null=True)),
+                ("slug", models.CharField(max_length=500, null=True)),
+                ("amount", models.FloatField(null=True)),
+                ("date", models.DateTimeField(null=True)),
+                ("search_vector", django.contrib.postgres.search.SearchVectorField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name="SearchDocumentChange",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("kind", models.CharField(max_length=20)),
+                ("object_id", models.IntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="searchdocument",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="camp_fin_se_search__cb8340_gin"
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="searchdocument",
+            unique_together={("kind", "object_id")},
+        ),
+        migrations.RunSQL(
+            LOG_CHANGE_FUNCTION,
+            "DROP FUNCTION IF EXISTS log_search_document_change()",
+        ),
+    ] + [
+        migrations.RunSQL(
+            CREATE_TRIGGER.format(table, ", ".join(columns)),
+            DROP_TRIGGER.format(table),
+        )
+        for table, columns in SEARCH_DOCUMENT_COLUMNS.items()
+    ]
@@ -0,0 +1,46 @@
+from django.db import migrations
+
+# Trigram index serving the LIKE matches of typeahead suggestions. pg_trgm is
+# a contrib extension, which not every Postgres installation ships; without
+# it, suggestions still work, by scanning the table.
+CREATE_INDEX = """
+    CREATE INDEX CONCURRENTLY camp_fin_searchdocument_name_trgm
+    ON camp_fin_searchdocument
+    USING gin (btrim(lower(regexp_replace(name, '\\s+', ' ', 'g'))) gin_trgm_ops)
+"""
+
+
+def create_trigram_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+
+        if not cursor.fetchone():
+            return
+
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+        cursor.execute(
+            "SELECT 1 FROM pg_indexes WHERE indexname = 'camp_fin_searchdocument_name_trgm'"
+        )
+
+        if not cursor.fetchone():
+            cursor.execute(CREATE_INDEX)
+
+
+def drop_trigram_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP INDEX IF EXISTS camp_fin_searchdocument_name_trgm")
+
+
+class Migration(migrations.Migration):
+
+    # Indexes can only be created concurrently outside of a transaction
+    atomic = False
+
+    dependencies = [
+        ("camp_fin", "0096_searchdocument"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
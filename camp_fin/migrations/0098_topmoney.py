@@ -0,0 +1,51 @@
+# Generated by Django 3.2.25 on 2026-10-18 05:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("camp_fin", "0097_searchdocument_name_trigram_index"),
+    ]
+
+    operations = [
+        # Built by aggregate_data before it had a model
+        migrations.RunSQL("DROP TABLE IF EXISTS top_money", migrations.RunSQL.noop),
+        migrations.CreateModel(
+            name="TopMoney",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("scope", models.CharField(max_length=9)),
+                ("scope_id", models.IntegerField(null=True)),
+                ("contribution", models.BooleanField()),
+                ("rank", models.IntegerField()),
+                ("amount", models.FloatField()),
+                ("latest_date", models.DateTimeField(null=True)),
+                ("name_prefix", models.CharField(max_length=25, null=True)),
+                ("first_name", models.CharField(max_length=255, null=True)),
+                ("middle_name", models.CharField(max_length=255, null=True)),
+                ("last_name", models.CharField(max_length=255, null=True)),
+                ("suffix", models.CharField(max_length=15, null=True)),
+                ("company_name", models.CharField(max_length=255, null=True)),
+                ("year", models.CharField(max_length=5, null=True)),
+                ("redact", models.BooleanField(null=True)),
+                ("description", models.CharField(max_length=255, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="topmoney",
+            index=models.Index(
+                fields=["contribution", "scope", "scope_id"],
+                name="camp_fin_to_contrib_c89e53_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-18 05:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("camp_fin", "0098_topmoney"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BulkExport",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("dataset", models.CharField(max_length=20)),
+                ("year", models.IntegerField(null=True)),
+                ("format", models.CharField(max_length=10)),
+                ("url", models.URLField(max_length=255)),
+                ("built", models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="bulkexport",
+            index=models.Index(
+                fields=["dataset", "format", "year"],
+                name="camp_fin_bu_dataset_79e82d_idx",
+            ),
+        ),
+    ]
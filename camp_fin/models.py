@@ -1,9 +1,16 @@
 from collections import namedtuple
 
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import connection, models
 from django.utils import timezone
 from django.utils.translation import gettext as _
 
+from camp_fin.aggregates import (
+    aggregate_series_by_entity,
+    aggregate_total,
+    aggregate_totals,
+)
 from camp_fin.decorators import check_date_params
 from camp_fin.templatetags.helpers import format_money
 
@@ -173,24 +180,10 @@ class Campaign(models.Model):
 
         entity_id = self.candidate.entity.id
 
-        sum_contributions = """
-            SELECT COALESCE(SUM(amount), 0)
-            FROM contributions_by_month
-            WHERE entity_id = %s
-        """
-
         if since:
-            sum_contributions += """
-                AND month >= '{year}-01-01'::date
-            """.format(
-                year=since
-            )
+            since = "{year}-01-01".format(year=since)
 
-        cursor = connection.cursor()
-        cursor.execute(sum_contributions, [entity_id])
-        amount = cursor.fetchone()[0]
-
-        return amount
+        return aggregate_total(entity_id, "contributions", since=since)
 
     @check_date_params
     def expenditures(self, since=None):
@@ -202,24 +195,10 @@ class Campaign(models.Model):
         """
         entity_id = self.candidate.entity.id
 
-        sum_expenditures = """
-            SELECT COALESCE(SUM(amount), 0)
-            FROM expenditures_by_month
-            WHERE entity_id = %s
-        """
-
         if since:
-            sum_expenditures += """
-                AND month >= '{year}-01-01'::date
-            """.format(
-                year=since
-            )
-
-        cursor = connection.cursor()
-        cursor.execute(sum_expenditures, [entity_id])
-        amount = cursor.fetchone()[0]
+            since = "{year}-01-01".format(year=since)
 
-        return amount
+        return aggregate_total(entity_id, "expenditures", since=since)
 
     def share_of_funds(self, total=None):
         """
@@ -250,6 +229,14 @@ class Campaign(models.Model):
         """
         filings = self.filing_set.order_by("-date_closed")
 
+        return self.cash_on_hand_from_filings(filings)
+
+    @staticmethod
+    def cash_on_hand_from_filings(filings):
+        """
+        Cash on hand as of the latest of a campaign's filings, given them in
+        reverse order of date closed.
+        """
         on_hand = 0
 
         if filings:
@@ -380,39 +367,76 @@ class Race(models.Model):
         """
         return self.campaign_set.all()
 
+    def funds_raised_by_campaign(self, campaigns):
+        """
+        Return a dict of the funds raised by each campaign during this race's
+        funding period, keyed by campaign ID, in one query.
+        """
+        since = None
+
+        if self.funding_period:
+            since = "{year}-01-01".format(year=self.funding_period)
+
+        totals = aggregate_totals(
+            [camp.candidate.entity_id for camp in campaigns if camp.candidate],
+            "contributions",
+            since=since,
+        )
+
+        return {
+            camp.id: totals[camp.candidate.entity_id] if camp.candidate else 0
+            for camp in campaigns
+        }
+
+    def cash_on_hand_by_campaign(self, campaigns):
+        """
+        Return a dict of the cash each campaign has on hand, keyed by campaign
+        ID, in one query.
+        """
+        filings = {camp.id: [] for camp in campaigns}
+
+        for filing in (
+            Filing.objects.filter(campaign__in=campaigns)
+            .select_related("filing_period__filing_period_type")
+            .order_by("-date_closed")
+        ):
+            filings[filing.campaign_id].append(filing)
+
+        return {
+            camp_id: Campaign.cash_on_hand_from_filings(camp_filings)
+            for camp_id, camp_filings in filings.items()
+        }
+
+    def sort_by_funds_raised(self, campaigns):
+        """
+        Sort campaigns in reverse order of how much money they've raised.
+        """
+        campaigns = list(campaigns)
+        funds_raised = self.funds_raised_by_campaign(campaigns)
+
+        return sorted(campaigns, key=lambda camp: funds_raised[camp.id], reverse=True)
+
     @property
     def sorted_campaigns(self):
         """
         Return all campaigns involved in this race, in reverse order of how much
         money they've raised.
         """
-        return sorted(
-            [camp for camp in self.campaigns],
-            key=lambda camp: camp.funds_raised(since=self.funding_period),
-            reverse=True,
-        )
+        return self.sort_by_funds_raised(self.campaigns.select_related("candidate"))
 
     @property
     def active_campaigns(self):
         """
         Campaigns that are still active in this race.
         """
-        return sorted(
-            [camp for camp in self.campaigns if camp.get_status() == "active"],
-            key=lambda camp: camp.funds_raised(since=self.funding_period),
-            reverse=True,
-        )
+        return [camp for camp in self.sorted_campaigns if camp.get_status() == "active"]
 
     @property
     def sorted_dropouts(self):
         """
         Campaigns that have dropped out of this race, sorted by funds raised.
         """
-        return sorted(
-            [camp for camp in self.campaigns if camp.get_status() != "active"],
-            key=lambda camp: camp.funds_raised(since=self.funding_period),
-            reverse=True,
-        )
+        return [camp for camp in self.sorted_campaigns if camp.get_status() != "active"]
 
     @property
     def num_candidates(self):
@@ -455,8 +479,9 @@ class Race(models.Model):
         Get the sum of contributions from campaigns in this race.
         """
         return sum(
-            campaign.funds_raised(since=self.funding_period)
-            for campaign in self.campaigns
+            self.funds_raised_by_campaign(
+                self.campaigns.select_related("candidate")
+            ).values()
         )
 
     @property
@@ -942,9 +967,31 @@ class Entity(models.Model):
         Generate a dict of filing trends for use in contribution/expenditure charts
         for this Entity.
         """
+        return Entity.batch_trends([self.id], since=since)[self.id]
+
+    @classmethod
+    @check_date_params
+    def batch_trends(cls, entity_ids, since="2010"):
+        """
+        Generate the trends of several Entities, as returned by `trends`, in a
+        dict keyed by entity ID. Takes three queries however many Entities
+        there are.
+        """
+        if since:
+            since = "{year}-01-01".format(year=since)
+
+        trends = {
+            entity_id: {"balance_trend": [], "debt_trend": []}
+            for entity_id in entity_ids
+        }
+
+        if not entity_ids:
+            return trends
+
         # Balances and debts
         summed_filings = """
             SELECT
+              f.entity_id,
               SUM(COALESCE(f.total_unpaid_debts, 0)) AS total_unpaid_debts,
               SUM(f.closing_balance) AS closing_balance,
               fp.end_date,
@@ -952,78 +999,65 @@ class Entity(models.Model):
             FROM camp_fin_filing AS f
             JOIN camp_fin_filingperiod AS fp
               ON f.filing_period_id = fp.id
-            WHERE f.entity_id = %s
+            WHERE f.entity_id IN %(entity_ids)s
               AND fp.exclude_from_cascading = FALSE
               AND fp.regular_filing_period_id IS NULL
-              AND f.filed_date >= '{year}-01-01'
-            GROUP BY fp.end_date
-            ORDER BY fp.end_date
-        """.format(
-            year=since
-        )
-
-        cursor = connection.cursor()
-
-        cursor.execute(summed_filings, [self.id])
-
-        balance_trend, debt_trend = [], []
+              AND (
+                %(since)s::timestamp with time zone IS NULL
+                OR f.filed_date >= %(since)s::timestamp with time zone
+              )
+            GROUP BY f.entity_id, fp.end_date
+            ORDER BY f.entity_id, fp.end_date
+        """
 
-        for total_unpaid_debts, closing_balance, end_date, description in cursor:
-            period_end = {
-                "description": description,
-                "year": end_date.year,
-                "month": end_date.month,
-                "day": end_date.day,
-            }
-            balance_trend.append(
-                {
-                    "amount": closing_balance,
-                    **period_end,
-                }
-            )
-            debt_trend.append(
-                {
-                    "amount": total_unpaid_debts * -1,
-                    **period_end,
-                }
+        with connection.cursor() as cursor:
+            cursor.execute(
+                summed_filings, {"entity_ids": tuple(entity_ids), "since": since}
             )
 
-        output_trends = {"balance_trend": balance_trend, "debt_trend": debt_trend}
+            for (
+                entity_id,
+                total_unpaid_debts,
+                closing_balance,
+                end_date,
+                description,
+            ) in cursor:
+                period_end = {
+                    "description": description,
+                    "year": end_date.year,
+                    "month": end_date.month,
+                    "day": end_date.day,
+                }
+                trends[entity_id]["balance_trend"].append(
+                    {
+                        "amount": closing_balance,
+                        **period_end,
+                    }
+                )
+                trends[entity_id]["debt_trend"].append(
+                    {
+                        "amount": total_unpaid_debts * -1,
+                        **period_end,
+                    }
+                )
 
         # Donations and expenditures
-        monthly_query = """
-            SELECT
-              DATE_PART('year', {table}.month) AS year,
-              DATE_PART('month', {table}.month) AS month,
-              {table}.amount AS amount
-            FROM {table}_by_month AS {table}
-            WHERE {table}.entity_id = %s
-              AND {table}.month >= '{year}-01-01'::date
-            ORDER BY year, month
-        """
-
-        contributions_query = monthly_query.format(table="contributions", year=since)
-
-        cursor.execute(contributions_query, [self.id])
-
-        donation_trend = [
-            {"amount": amount, "year": year, "month": month}
-            for year, month, amount in cursor
-        ]
-
-        expenditures_query = monthly_query.format(table="expenditures", year=since)
-
-        cursor.execute(expenditures_query, [self.id])
-
-        expend_trend = [
-            {"amount": amount * -1, "year": year, "month": month}
-            for year, month, amount in cursor
-        ]
+        donations = aggregate_series_by_entity(entity_ids, "contributions", since=since)
+        expenditures = aggregate_series_by_entity(
+            entity_ids, "expenditures", since=since
+        )
 
-        output_trends["donation_trend"] = donation_trend
-        output_trends["expend_trend"] = expend_trend
+        for entity_id, entity_trends in trends.items():
+            entity_trends["donation_trend"] = [
+                {"amount": amount, "year": start.year, "month": start.month}
+                for start, amount in donations[entity_id]
+            ]
+            entity_trends["expend_trend"] = [
+                {"amount": amount * -1, "year": start.year, "month": start.month}
+                for start, amount in expenditures[entity_id]
+            ]
 
-        return output_trends
+        return trends
 
 
 class EntityType(models.Model):
@@ -1645,6 +1679,118 @@ class LobbyistBundlingDisclosureContributor(models.Model):
     )
 
 
+class AggregateChange(models.Model):
+    """
+    A year of an entity's transactions that changed since the
+    contributions_by_* and expenditures_by_* aggregates were last updated.
+    Logged by import_transactions, and consumed by aggregate_data, which
+    only recomputes the aggregates for changed entities and years.
+    """
+
+    entity_id = models.IntegerField()
+    year = models.IntegerField()
+    date_added = models.DateTimeField(default=timezone.now)
+
+
+class TopEarner(models.Model):
+    """
+    A candidate or PAC ranked by the contributions they received in the last
+    `days` days, or since 2010 if `days` is 0. Snapshots of the standard
+    windows are refreshed by aggregate_data.
+    """
+
+    days = models.IntegerField()
+    rank = models.IntegerField()
+    slug = models.CharField(max_length=500, null=True)
+    name = models.CharField(max_length=500, null=True)
+    new_funds = models.FloatField()
+    current_funds = models.FloatField(null=True)
+    committee_type = models.CharField(max_length=9)
+
+    class Meta:
+        indexes = [models.Index(fields=["days", "rank"])]
+
+
+class TopMoney(models.Model):
+    """
+    A donor or payee ranked by the total of their transactions with everyone
+    in an election year or over all time, or with a candidate by election
+    year or a PAC over all time, depending on `scope`. Rebuilt by
+    aggregate_data, and read by the top donors and top expenses endpoints.
+    """
+
+    scope = models.CharField(max_length=9)
+    # ID of the candidate or PAC the donors or payees are ranked for
+    scope_id = models.IntegerField(null=True)
+    contribution = models.BooleanField()
+    rank = models.IntegerField()
+    amount = models.FloatField()
+    latest_date = models.DateTimeField(null=True)
+    name_prefix = models.CharField(max_length=25, null=True)
+    first_name = models.CharField(max_length=255, null=True)
+    middle_name = models.CharField(max_length=255, null=True)
+    last_name = models.CharField(max_length=255, null=True)
+    suffix = models.CharField(max_length=15, null=True)
+    company_name = models.CharField(max_length=255, null=True)
+    year = models.CharField(max_length=5, null=True)
+    redact = models.BooleanField(null=True)
+    description = models.CharField(max_length=255, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["contribution", "scope", "scope_id"])]
+
+
+class SearchDocument(models.Model):
+    """
+    A searchable candidate, PAC, contribution, expenditure, lobbyist,
+    organization or lobbyist transaction, denormalized for global search.
+    Maintained by update_search_documents.
+    """
+
+    kind = models.CharField(max_length=20)
+    object_id = models.IntegerField()
+    name = models.CharField(max_length=500, null=True)
+    description = models.TextField(null=True)
+    slug = models.CharField(max_length=500, null=True)
+    # Total dollars raised, or the amount of a transaction, used to rank
+    # documents that match equally well
+    amount = models.FloatField(null=True)
+    date = models.DateTimeField(null=True)
+    search_vector = SearchVectorField()
+
+    class Meta:
+        unique_together = ("kind", "object_id")
+        indexes = [GinIndex(fields=["search_vector"])]
+
+
+class SearchDocumentChange(models.Model):
+    """
+    A row of a table that search documents are made from, logged by a
+    trigger when it's inserted, updated or deleted, and consumed by
+    update_search_documents.
+    """
+
+    kind = models.CharField(max_length=20)
+    object_id = models.IntegerField()
+
+
+class BulkExport(models.Model):
+    """
+    A bulk export that build_bulk_exports has uploaded to S3. Bulk download
+    requests matching it are redirected to its URL.
+    """
+
+    dataset = models.CharField(max_length=20)
+    # Year of a CSV of a year's transactions, or null for the whole dataset
+    year = models.IntegerField(null=True)
+    format = models.CharField(max_length=10)
+    url = models.URLField(max_length=255)
+    built = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=["dataset", "format", "year"])]
+
+
 ##################################################################
 # Below here are normalized tables that we may or may not end up #
 # getting. Just stubbing them out in case we do                  #
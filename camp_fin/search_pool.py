@@ -0,0 +1,108 @@
+"""
+Searching several tables at once.
+
+Each web process runs the tables of /api/search/ on a single pool of
+SEARCH_WORKERS threads, shared by its requests. Each thread keeps its database
+connection between searches, and replaces it once it's older than
+CONN_MAX_AGE, as Django does for request threads, so a process holds at most
+SEARCH_WORKERS + 1 connections. With WEB_CONCURRENCY gunicorn workers, keep
+WEB_CONCURRENCY * (SEARCH_WORKERS + 1) under the database's max_connections;
+set DJANGO_SEARCH_WORKERS to 1 to search tables one at a time on the request's
+connection.
+
+A table is given SEARCH_TABLE_TIMEOUT milliseconds in all, over every
+statement searching it runs, rather than each statement getting as long.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+
+_lock = threading.Lock()
+_executor = None
+
+# Connections of the pool's threads, which close_search_connections closes
+# from other threads
+_connections = set()
+
+
+class SearchTimeout(Exception):
+    """
+    A search ran out of time between statements.
+    """
+
+
+def search_in_parallel(search, tables):
+    """
+    Return the result of calling search on each table, running them on the
+    pool's threads.
+    """
+    global _executor
+
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.SEARCH_WORKERS, thread_name_prefix="search"
+            )
+
+    futures = [_executor.submit(_search_in_thread, search, table) for table in tables]
+
+    return [future.result() for future in futures]
+
+
+def _search_in_thread(search, table):
+    # Replace a connection that's broken or older than CONN_MAX_AGE, as Django
+    # does at the start of each request
+    connection.close_if_unusable_or_obsolete()
+
+    wrapper = connections[DEFAULT_DB_ALIAS]
+
+    if wrapper not in _connections:
+        wrapper.inc_thread_sharing()
+
+        with _lock:
+            _connections.add(wrapper)
+
+    return search(table)
+
+
+def close_search_connections():
+    """
+    Close the connections kept by the pool's threads, which reconnect on
+    their next search.
+    """
+    with _lock:
+        for wrapper in _connections:
+            wrapper.close()
+
+
+@contextmanager
+def search_deadline(timeout):
+    """
+    Cancel the statements run inside the block once they've taken timeout
+    milliseconds together, by lowering statement_timeout before each to the
+    time left. Use inside a transaction.
+    """
+    deadline = time.monotonic() + timeout / 1000
+
+    def execute(execute, sql, params, many, context):
+        remaining = int((deadline - time.monotonic()) * 1000)
+
+        if remaining <= 0:
+            raise SearchTimeout
+
+        context["cursor"].cursor.execute(
+            "SET LOCAL statement_timeout = %s", [remaining]
+        )
+
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(execute):
+        yield
+
+    # Inside a savepoint, SET LOCAL would outlast the block
+    with connection.cursor() as cursor:
+        cursor.execute("SET LOCAL statement_timeout TO DEFAULT")
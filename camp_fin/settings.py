@@ -90,7 +90,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
-    "django.middleware.cache.UpdateCacheMiddleware",
+    "camp_fin.middleware.UpdateCacheMiddleware",
+    "camp_fin.middleware.CacheInvalidationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -99,7 +100,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "django.middleware.cache.FetchFromCacheMiddleware",
+    "camp_fin.middleware.FetchFromCacheMiddleware",
 ]
 
 ROOT_URLCONF = "camp_fin.urls"
@@ -214,6 +215,40 @@ DATABASES["default"] = dj_database_url.parse(
     ssl_require=True if os.getenv("POSTGRES_REQUIRE_SSL") else False,
 )
 
+# Number of rows to fetch from the database at a time when streaming bulk
+# downloads
+BULK_DOWNLOAD_ITERSIZE = int(os.getenv("DJANGO_BULK_DOWNLOAD_ITERSIZE", 2000))
+
+# Number of bytes of CSV written by Postgres to send at a time when streaming
+# bulk downloads with COPY
+BULK_DOWNLOAD_CHUNK_SIZE = int(os.getenv("DJANGO_BULK_DOWNLOAD_CHUNK_SIZE", 65536))
+
+# Maximum number of rows in a row group of a Parquet bulk download
+BULK_PARQUET_ROW_GROUP_SIZE = int(
+    os.getenv("DJANGO_BULK_PARQUET_ROW_GROUP_SIZE", 100000)
+)
+
+# Directory of the pre-generated bulk exports written by build_bulk_exports
+BULK_EXPORT_ROOT = os.getenv(
+    "DJANGO_BULK_EXPORT_ROOT", os.path.join(BASE_DIR, "_data", "exports")
+)
+
+# S3 bucket that build_bulk_exports uploads exports to, if any, for the web
+# process to redirect bulk downloads to
+BULK_EXPORT_BUCKET = os.getenv("AWS_STORAGE_BUCKET_NAME")
+
+# Number of search results to count exactly, per table. Larger counts are
+# estimated by the query planner.
+SEARCH_EXACT_COUNT_LIMIT = int(os.getenv("DJANGO_SEARCH_EXACT_COUNT_LIMIT", 10000))
+
+# Number of tables to search at once, each on its own connection, and how
+# long to search each table before giving up on it, in milliseconds. Each web
+# process keeps up to SEARCH_WORKERS connections for search (see
+# camp_fin.search_pool), so keep WEB_CONCURRENCY * (SEARCH_WORKERS + 1) under
+# the database's max_connections.
+SEARCH_WORKERS = int(os.getenv("DJANGO_SEARCH_WORKERS", 7))
+SEARCH_TABLE_TIMEOUT = int(os.getenv("DJANGO_SEARCH_TABLE_TIMEOUT", 10000))
+
 # Caching
 
 cache_backend = os.getenv(
@@ -226,6 +261,14 @@ CACHES = {
     }
 }
 
+# How long to cache top earners for windows without a snapshot
+TOP_EARNERS_CACHE_SECONDS = int(os.getenv("DJANGO_TOP_EARNERS_CACHE_SECONDS", 3600))
+
+# Number of typeahead terms to keep suggestions for in each process, and for
+# how long
+SUGGEST_CACHE_SIZE = int(os.getenv("DJANGO_SUGGEST_CACHE_SIZE", 1024))
+SUGGEST_CACHE_SECONDS = int(os.getenv("DJANGO_SUGGEST_CACHE_SECONDS", 300))
+
 # Logging
 
 LOGGING = {
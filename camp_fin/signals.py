@@ -1,11 +1,40 @@
-from django.core.management import call_command
-from django.db.models.signals import post_delete, post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 
+from camp_fin.invalidation import ALL, invalidate, invalidate_instance
+
 
 @receiver([post_save, post_delete])
-def clear_cache_on_update(sender, **kwargs):
+def invalidate_cache_on_update(sender, instance, **kwargs):
+    """
+    Invalidate the cached pages affected by saving or deleting a campaign
+    finance model.
+    """
+    if sender._meta.app_label == "camp_fin":
+        invalidate_instance(instance)
+
+
+@receiver(post_delete)
+def invalidate_cache_on_content_delete(sender, instance, **kwargs):
     """
-    Clear the cache after any model has been saved or deleted.
+    Invalidate every cached page when page content is deleted, since any
+    page may render it. Saving content clears the cache (see pages.models).
     """
-    call_command("clear_cache")
+    if sender._meta.app_label == "pages":
+        invalidate(ALL)
+
+
+@receiver(m2m_changed)
+def invalidate_cache_on_m2m_update(sender, instance, action, **kwargs):
+    """
+    Invalidate the cached pages affected by changing a many-to-many
+    relationship, e.g., the candidates related to a story, or the chunks of
+    page content.
+    """
+    if not action.startswith("post_"):
+        return
+
+    if instance._meta.app_label == "camp_fin":
+        invalidate_instance(instance)
+    elif instance._meta.app_label == "pages":
+        invalidate(ALL)
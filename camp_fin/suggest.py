@@ -0,0 +1,120 @@
+"""
+Typeahead suggestions.
+
+Suggestions are the names of candidates, PACs, donors, lobbyists and
+organizations in the search documents that contain every word typed, in any
+order, so partial names like "mich luj" match. Names are normalized by
+lowercasing them and collapsing whitespace, and the words are matched with
+LIKE on the normalized name, which the trigram index added by migration 0097
+serves when the pg_trgm extension is available; without it, the same query
+scans the table. Words shorter than MIN_WORD_LENGTH have no trigram for the
+index to look up, so they're ignored. Donors are suggested once per
+normalized name, with the total of their contributions; candidates, PACs,
+lobbyists and organizations are suggested once each, even if their names
+are the same.
+
+Results for the most recently typed terms are kept in an in-process LRU
+cache for SUGGEST_CACHE_SECONDS, since each keystroke of a popular name asks
+for the same prefixes.
+"""
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+
+# Kinds of search document to suggest, and the kind to report them as
+SUGGEST_KINDS = {
+    "candidate": "candidate",
+    "pac": "pac",
+    "contribution": "donor",
+    "lobbyist": "lobbyist",
+    "organization": "organization",
+}
+
+# Expression of the trigram index that normalized names are matched against
+NORMALIZED_NAME = "btrim(lower(regexp_replace(name, '\\s+', ' ', 'g')))"
+
+# Fewest characters of a word to match, since a trigram index can't serve
+# shorter ones, and most words to match
+MIN_WORD_LENGTH = 3
+MAX_WORDS = 5
+
+
+def normalize_term(term):
+    words = [word for word in term.lower().split() if len(word) >= MIN_WORD_LENGTH]
+
+    return " ".join(words[:MAX_WORDS])
+
+
+def like_pattern(word):
+    for character in ("\\", "%", "_"):
+        word = word.replace(character, "\\" + character)
+
+    return "%{}%".format(word)
+
+
+def suggestions(term, limit=10):
+    """
+    Return up to `limit` (kind, name, slug, amount) tuples of names
+    containing every word of `term`. Names that start with the first word
+    come first, then names with the most money behind them.
+    """
+    term = normalize_term(term)
+
+    if not term:
+        return ()
+
+    # Expire cached suggestions by asking for a new entry every
+    # SUGGEST_CACHE_SECONDS
+    period = int(time.time() // max(settings.SUGGEST_CACHE_SECONDS, 1))
+
+    return cached_suggestions(term, limit, period)
+
+
+@lru_cache(maxsize=settings.SUGGEST_CACHE_SIZE)
+def cached_suggestions(term, limit, period):
+    words = term.split()
+
+    query = """
+        SELECT kind, name, slug, amount
+        FROM (
+          SELECT
+            kind,
+            MAX(name) AS name,
+            MAX(slug) AS slug,
+            SUM(amount) AS amount
+          FROM camp_fin_searchdocument
+          WHERE kind IN %s
+            {}
+          GROUP BY
+            kind,
+            CASE
+              WHEN kind = 'contribution' THEN {name}
+              ELSE object_id::text
+            END
+        ) AS matches
+        ORDER BY
+          {name} LIKE %s DESC,
+          amount DESC NULLS LAST,
+          length(name),
+          name
+        LIMIT %s
+    """.format(
+        " ".join("AND {} LIKE %s".format(NORMALIZED_NAME) for _ in words),
+        name=NORMALIZED_NAME,
+    )
+
+    args = (
+        [tuple(SUGGEST_KINDS)]
+        + [like_pattern(word) for word in words]
+        + [like_pattern(words[0])[1:], limit]
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(query, args)
+
+        return tuple(
+            (SUGGEST_KINDS[kind], name, slug, amount)
+            for kind, name, slug, amount in cursor
+        )
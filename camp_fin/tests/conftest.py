@@ -386,4 +386,4 @@ class DatabaseTestCase(TransactionTestCase, FakeTestData):
     def setUp(cls):
         cls.races()
         cls.lobbyists()
-        call_command("aggregate_data")
+        call_command("aggregate_data", full=True)
@@ -1,4 +1,54 @@
+import csv
+import datetime
+import gzip
+import io
+import os
+import tempfile
+import time
+import zipfile
+from io import StringIO
+from itertools import chain
+from unittest import mock
+
+import pyarrow.parquet as pq
+import pytz
+from django.conf import settings
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from psycopg2.errors import QueryCanceled
+
+from camp_fin.aggregates import TOP_EARNERS_WINDOWS, aggregate_series, top_earners_query
+from camp_fin.base_views import stream_csv, top_earners
+from camp_fin.management.commands.aggregate_data import AGGREGATE_TABLES
+from camp_fin.management.commands.utils import MOUNTAIN_TZ, parse_date
+from camp_fin.models import (
+    PAC,
+    Address,
+    AggregateChange,
+    BulkExport,
+    Campaign,
+    Candidate,
+    Contact,
+    Entity,
+    EntityType,
+    Filing,
+    FilingPeriod,
+    SearchDocumentChange,
+    TopMoney,
+    Transaction,
+)
+from camp_fin.search_pool import (
+    SearchTimeout,
+    close_search_connections,
+    search_deadline,
+)
+from camp_fin.suggest import cached_suggestions
 from camp_fin.tests.conftest import DatabaseTestCase
+from camp_fin.views import RaceDetail
 
 
 class TestRace(DatabaseTestCase):
@@ -19,6 +69,92 @@ class TestRace(DatabaseTestCase):
     def test_race_sorted_campaigns(self):
         self.assertEqual(self.race.sorted_campaigns, self.campaigns)
 
+    def cascade_filing_period(self):
+        FilingPeriod.objects.filter(id=self.filing_period.id).update(
+            exclude_from_cascading=False
+        )
+        self.filing_period.refresh_from_db()
+
+    def expected_trend(self, balance, donations, expenditures):
+        # Transactions are summed by month in local time
+        now = timezone.localtime(self.first_contribution.received_date)
+        end_date = self.filing_period.end_date
+
+        period_end = {
+            "description": [None],
+            "year": end_date.year,
+            "month": end_date.month,
+            "day": end_date.day,
+        }
+        month = {"year": now.year, "month": now.month}
+
+        return {
+            "balance_trend": [{"amount": balance, **period_end}],
+            "debt_trend": [{"amount": 0, **period_end}],
+            "donation_trend": [{"amount": donations, **month}],
+            "expend_trend": [{"amount": -expenditures, **month}],
+        }
+
+    def test_batch_trends(self):
+        self.cascade_filing_period()
+
+        entity_ids = [camp.candidate.entity_id for camp in self.campaigns]
+
+        with CaptureQueriesContext(connection) as queries:
+            trends = Entity.batch_trends(entity_ids, since=self.last_year)
+
+        self.assertEqual(len(queries), 3)
+
+        # The second entity's filing, contribution and expenditure from two
+        # years ago are before `since`. The first entity's loan counts as a
+        # contribution.
+        self.assertEqual(
+            trends,
+            {
+                self.first_entity.id: self.expected_trend(80, 200 + 33, 20),
+                self.second_entity.id: self.expected_trend(80, 100, 20),
+                self.third_entity.id: self.expected_trend(0, 0, 0),
+            },
+        )
+
+    def test_race_detail_trends(self):
+        self.cascade_filing_period()
+
+        request = RequestFactory().get("/")
+        response = RaceDetail.as_view()(request, pk=self.race.id)
+        context = response.context_data
+
+        self.assertEqual(context["active_campaigns"], self.campaigns)
+        self.assertEqual(
+            context["active_trends"],
+            [
+                self.expected_trend(80, 200 + 33, 20),
+                self.expected_trend(80, 100, 20),
+                self.expected_trend(0, 0, 0),
+            ],
+        )
+
+        # Charts are scaled to 110% of the largest donations and expenditures
+        self.assertAlmostEqual(context["max"], 233 * 1.1)
+        self.assertAlmostEqual(context["min"], -20 * 1.1)
+
+        self.assertEqual(context["largest_contribution"], 233)
+        self.assertEqual(
+            [camp.funds_share for camp in context["active_campaigns"]],
+            [100, 43, 0],
+        )
+
+    def test_race_detail_queries(self):
+        # Funds and trends are fetched for all campaigns at once, so the number
+        # of queries doesn't depend on how many campaigns are in the race
+        request = RequestFactory().get("/")
+
+        with self.assertNumQueries(21):
+            response = RaceDetail.as_view()(request, pk=self.race.id)
+            response.render()
+
+        self.assertContains(response, "width:43%")
+
     def test_campaigns_by_party(self):
         parties = self.race.campaigns_by_party
 
@@ -76,3 +212,1228 @@ class TestCampaign(DatabaseTestCase):
         self.assertEqual(self.first_campaign.share_of_funds(total=total), 70)
         self.assertEqual(self.second_campaign.share_of_funds(total=total), 30)
         self.assertEqual(self.third_campaign.share_of_funds(total=total), 0)
+
+
+class TestAggregateData(DatabaseTestCase):
+    def test_aggregates_refreshed_in_parallel(self):
+        stdout = StringIO()
+        call_command("aggregate_data", full=True, workers=3, stdout=stdout)
+
+        for name in ["current_loan_status"] + AGGREGATE_TABLES:
+            self.assertIn(f"Refreshed {name} in", stdout.getvalue())
+
+        # Refreshing concurrently requires a unique index
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT indexdef FROM pg_indexes
+                WHERE tablename = 'current_loan_status'
+            """
+            )
+            self.assertIn("UNIQUE", cursor.fetchone()[0])
+
+        self.assertEqual(
+            self.first_campaign.funds_raised(),
+            sum(c.amount for c in self.contributions[0]),
+        )
+
+    def test_top_money(self):
+        # The test transactions have no donor names, so each candidate has a
+        # single top donor in the election year
+        for campaign, contributions in zip(self.campaigns, self.contributions):
+            response = self.client.get(
+                reverse("top-donors-detail", args=[campaign.candidate.id])
+            )
+            self.assertEqual(response.status_code, 200)
+
+            amount = sum(c.amount for c in contributions if isinstance(c, Transaction))
+            self.assertEqual(
+                [
+                    (row["rank"], float(row["amount"]), row["year"])
+                    for row in response.json()
+                ],
+                [("1", amount, self.year)],
+            )
+
+        response = self.client.get(reverse("top-expenses-list"), {"entity_type": "pac"})
+        self.assertEqual(
+            [(row["rank"], float(row["amount"])) for row in response.json()],
+            [("1", sum(e.amount for e in chain(*self.expenditures)))],
+        )
+
+    def test_top_money_before_aggregating(self):
+        TopMoney.objects.all().delete()
+
+        response = self.client.get(reverse("top-donors-list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+
+        # Empty leaderboards are built even if nothing changed
+        call_command("aggregate_data", stdout=StringIO())
+        self.assertTrue(TopMoney.objects.filter(contribution=True).exists())
+
+
+class TestTopEarners(DatabaseTestCase):
+    def live_top_earners(self, days):
+        query, args = top_earners_query(days)
+
+        with connection.cursor() as cursor:
+            cursor.execute(query, args)
+            return [(row[0], row[1], row[3]) for row in cursor]
+
+    def test_snapshots_match_live_query(self):
+        for days in TOP_EARNERS_WINDOWS:
+            self.assertEqual(
+                [(e.rank, e.slug, e.new_funds) for e in top_earners(days)],
+                self.live_top_earners(days),
+            )
+
+        response = self.client.get(reverse("top-earners"), {"interval": 365})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [e.slug for e in response.context["object_list"]],
+            [slug for _, slug, _ in self.live_top_earners(365)],
+        )
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_other_windows_are_cached(self):
+        earners = [(e.rank, e.slug, e.new_funds) for e in top_earners(7)]
+        self.assertEqual(earners, self.live_top_earners(7))
+
+        Transaction.objects.all().delete()
+
+        self.assertEqual(
+            [(e.rank, e.slug, e.new_funds) for e in top_earners(7)], earners
+        )
+
+
+class TestSearch(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+
+        call_command("make_search_index", stdout=StringIO())
+
+        for candidate in Candidate.objects.all():
+            candidate.full_name = str(candidate)
+            candidate.save()
+
+    def tearDown(self):
+        # Connections left open would keep the test database from being
+        # dropped
+        close_search_connections()
+        super().tearDown()
+
+    def search(self, **params):
+        response = self.client.get(
+            "/api/search/", {"term": "candidate", "table_name": "candidate", **params}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()["candidate"]
+
+    def test_search_is_paginated_in_sql(self):
+        candidates = sorted(Candidate.objects.all(), key=lambda c: c.full_name)
+
+        results = self.search(
+            **{
+                "length": 2,
+                "start": 1,
+                "order[0][column]": 0,
+                "columns[0][data]": "full_name",
+                "order[0][dir]": "asc",
+            }
+        )
+
+        self.assertEqual(
+            [row["full_name"] for row in results["objects"]],
+            [c.full_name for c in candidates[1:3]],
+        )
+        self.assertEqual(results["meta"]["recordsTotal"], len(candidates))
+        self.assertFalse(results["meta"]["approximate_count"])
+
+    @override_settings(SEARCH_EXACT_COUNT_LIMIT=2)
+    def test_large_counts_are_estimated(self):
+        results = self.search()
+
+        self.assertTrue(results["meta"]["approximate_count"])
+        self.assertGreater(results["meta"]["recordsTotal"], 2)
+
+    @override_settings(SEARCH_TABLE_TIMEOUT=500)
+    def test_tables_that_time_out_are_skipped(self):
+        # Hold a lock on the lobbyist table, so that searching it times out
+        other = connections.create_connection("default")
+
+        try:
+            with other.cursor() as cursor:
+                cursor.execute("BEGIN")
+                cursor.execute("LOCK TABLE camp_fin_lobbyist IN ACCESS EXCLUSIVE MODE")
+
+                response = self.client.get(
+                    "/api/search/",
+                    {"term": "candidate", "table_name": ["candidate", "lobbyist"]},
+                )
+        finally:
+            other.close()
+
+        results = response.json()
+
+        self.assertTrue(results["lobbyist"]["meta"]["timed_out"])
+        self.assertEqual(results["lobbyist"]["objects"], [])
+
+        self.assertFalse(results["candidate"]["meta"]["timed_out"])
+        self.assertEqual(
+            len(results["candidate"]["objects"]), Candidate.objects.count()
+        )
+
+    def test_search_deadline_covers_every_query(self):
+        with self.assertRaises(OperationalError) as e, transaction.atomic():
+            with search_deadline(300), connection.cursor() as cursor:
+                # Each query is quicker than the deadline, but not both
+                cursor.execute("SELECT pg_sleep(0.2)")
+                cursor.execute("SELECT pg_sleep(0.2)")
+
+        self.assertIsInstance(e.exception.__cause__, QueryCanceled)
+
+        # Once the deadline has passed, no more queries are run
+        with self.assertRaises(SearchTimeout), transaction.atomic():
+            with search_deadline(1), connection.cursor() as cursor:
+                time.sleep(0.01)
+                cursor.execute("SELECT 1")
+
+    def test_search_connections_are_reused(self):
+        def other_connections():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT pid
+                    FROM pg_stat_activity
+                    WHERE datname = current_database()
+                      AND backend_type = 'client backend'
+                      AND pid != pg_backend_pid()
+                """
+                )
+                return {row[0] for row in cursor}
+
+        self.client.get("/api/search/", {"term": "candidate"})
+        search_connections = other_connections()
+
+        self.client.get("/api/search/", {"term": "candidate"})
+
+        self.assertEqual(other_connections(), search_connections)
+        self.assertLessEqual(len(search_connections), settings.SEARCH_WORKERS)
+
+    @override_settings(BULK_DOWNLOAD_CHUNK_SIZE=1, BULK_DOWNLOAD_ITERSIZE=1)
+    def test_csv_export_is_streamed(self):
+        response = self.client.get(
+            "/api/search/",
+            {"term": "candidate", "table_name": ["candidate", "pac"], "format": "csv"},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn(
+            "attachment; filename=candidate-", response["Content-Disposition"]
+        )
+
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+
+        # Tables without matches are left out
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zf:
+            self.assertEqual(zf.namelist(), ["candidate.csv"])
+
+            rows = list(csv.DictReader(io.TextIOWrapper(zf.open("candidate.csv"))))
+
+        self.assertEqual(
+            sorted(row["full_name"] for row in rows),
+            sorted(c.full_name for c in Candidate.objects.all()),
+        )
+
+    def test_search_index_only_fills_in_missing_vectors(self):
+        # The schema is already in place, so only missing vectors are filled
+        # in
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER candidate_search_update ON camp_fin_candidate")
+            cursor.execute(
+                "UPDATE camp_fin_candidate SET search_name = NULL WHERE id = %s",
+                [self.first_candidate.id],
+            )
+
+        output = StringIO()
+        call_command("make_search_index", tables=["candidate"], stdout=output)
+
+        self.assertIn("Created candidate_search_update", output.getvalue())
+        self.assertIn(
+            "Populated search_name of camp_fin_candidate from ID {0} to {0}".format(
+                self.first_candidate.id
+            ),
+            output.getvalue(),
+        )
+        self.assertNotIn("Indexed", output.getvalue())
+        self.assertEqual(len(self.search()["objects"]), Candidate.objects.count())
+
+        output = StringIO()
+        call_command("make_search_index", stdout=output)
+
+        self.assertEqual(output.getvalue().strip(), "Worked")
+
+    def test_anonymous_transactions_indexed_before_write(self):
+        anonymous = Transaction.objects.create(
+            amount=10.0,
+            received_date=self.first_contribution.received_date,
+            transaction_type=self.first_contribution.transaction_type,
+            filing=self.first_contribution.filing,
+            address="123 Main St",
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT tgname
+                FROM pg_trigger
+                WHERE tgrelid = 'camp_fin_transaction'::regclass
+                  AND tgname LIKE '%%anonymous%%'
+            """
+            )
+            self.assertEqual(
+                [row[0] for row in cursor], ["transaction_search_update_anonymous"]
+            )
+
+            cursor.execute(
+                "SELECT search_name::text FROM camp_fin_transaction WHERE id = %s",
+                [anonymous.id],
+            )
+            self.assertEqual(cursor.fetchone()[0], "'anonym':1")
+
+            # Transactions without a vector are filled in the same way
+            cursor.execute(
+                "UPDATE camp_fin_transaction SET search_name = NULL WHERE id = %s",
+                [anonymous.id],
+            )
+
+        call_command("make_search_index", tables=["transaction"], stdout=StringIO())
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT search_name::text FROM camp_fin_transaction WHERE id = %s",
+                [anonymous.id],
+            )
+            self.assertEqual(cursor.fetchone()[0], "'anonym':1")
+
+
+class TestSearchDocuments(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+
+        for candidate in Candidate.objects.all():
+            candidate.full_name = str(candidate)
+            candidate.save()
+
+        call_command("update_search_documents", stdout=StringIO())
+
+    def search(self, term, **params):
+        response = self.client.get("/api/global-search/", {"term": term, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()["objects"]
+
+    def test_search_documents_ranked_by_amount(self):
+        results = self.search("candidate", kind="candidate")
+
+        self.assertEqual(len(results), Candidate.objects.count())
+
+        # Candidates whose names match equally well are ordered by the
+        # contributions they've received
+        self.assertEqual(results[0]["name"], str(self.first_candidate))
+        self.assertEqual(
+            results[0]["amount"], sum(c.amount for c in self.contributions[0])
+        )
+
+    def test_search_documents_updated_incrementally(self):
+        self.first_candidate.full_name = "Ada Lovelace"
+        self.first_candidate.save()
+        self.second_candidate.delete()
+
+        self.assertTrue(SearchDocumentChange.objects.exists())
+
+        call_command("update_search_documents", stdout=StringIO())
+
+        self.assertEqual(
+            [result["object_id"] for result in self.search("lovelace")],
+            [self.first_candidate.id],
+        )
+        self.assertEqual(
+            {result["object_id"] for result in self.search("candidate")},
+            {self.third_candidate.id, self.non_race_candidate.id},
+        )
+        self.assertFalse(SearchDocumentChange.objects.exists())
+
+    def test_suggest(self):
+        self.first_contribution.full_name = "Ada Lovelace"
+        self.first_contribution.save()
+        self.second_contribution.full_name = " ADA  LOVELACE"
+        self.second_contribution.save()
+        Candidate.objects.filter(id=self.first_candidate.id).update(
+            slug="first-candidate"
+        )
+        # Candidates with the same name are suggested separately
+        Candidate.objects.filter(id=self.second_candidate.id).update(
+            full_name=str(self.first_candidate), slug="second-candidate"
+        )
+
+        call_command("update_search_documents", stdout=StringIO())
+        cached_suggestions.cache_clear()
+
+        def suggest(term):
+            response = self.client.get("/api/suggest/", {"term": term})
+            self.assertEqual(response.status_code, 200)
+            return response.json()["objects"]
+
+        # Every word matches part of the name, in any order
+        results = suggest("cand FIR")
+        self.assertEqual(
+            sorted(
+                (result["kind"], result["name"], result["url"]) for result in results
+            ),
+            [
+                (
+                    "candidate",
+                    str(self.first_candidate),
+                    reverse("candidate-detail", args=[slug]),
+                )
+                for slug in ("first-candidate", "second-candidate")
+            ],
+        )
+
+        # Donors are suggested once per name, with the total of their
+        # contributions
+        results = suggest("lovel")
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["kind"], "donor")
+        self.assertEqual(
+            results[0]["amount"],
+            self.first_contribution.amount + self.second_contribution.amount,
+        )
+
+        # Words too short for the trigram index are ignored
+        self.assertEqual(suggest("lovel a"), results)
+        self.assertEqual(suggest("jo"), [])
+        self.assertEqual(suggest("50%"), [])
+
+
+class TestImportTransactions(DatabaseTestCase):
+    """
+    Test importing transactions from a CFIS CSV export.
+    """
+
+    contribution_fields = [
+        "OrgID",
+        "Committee Name",
+        "Report Name",
+        "Start of Period",
+        "End of Period",
+        "Contribution Type",
+        "Contributor Code",
+        "Prefix",
+        "First Name",
+        "Middle Name",
+        "Last Name",
+        "Suffix",
+        "Contributor Address Line 1",
+        "Contributor Address Line 2",
+        "Contributor City",
+        "Contributor State",
+        "Contributor Zip Code",
+        "Contributor Occupation",
+        "Contributor Employer",
+        "Transaction Amount",
+        "Transaction Date",
+        "Check Number",
+        "Description",
+    ]
+
+    expenditure_fields = [
+        "OrgID",
+        "Committee Name",
+        "Report Name",
+        "Start of Period",
+        "End of Period",
+        "Payee Prefix",
+        "Payee First Name",
+        "Payee Middle Name",
+        "Payee Last Name",
+        "Payee Suffix",
+        "Payee Address 1",
+        "Payee Address 2",
+        "Payee City",
+        "Payee State",
+        "Payee Zip Code",
+        "Expenditure Amount",
+        "Expenditure Date",
+        "Expenditure Type",
+        "Description",
+    ]
+
+    def setUp(self):
+        super().setUp()
+
+        self.committee_entity = Entity.objects.create(
+            user_id=1234,
+            entity_type=EntityType.objects.create(description="Political Committee"),
+        )
+        self.committee = PAC.objects.create(
+            entity=self.committee_entity, name="Committee to Import"
+        )
+
+        filing_period = FilingPeriod.objects.create(
+            description="First Biannual",
+            due_date=datetime.datetime(2024, 4, 8, tzinfo=pytz.utc),
+            allow_no_activity=False,
+            filing_period_type=self.filing_period.filing_period_type,
+            exclude_from_cascading=False,
+            initial_date=datetime.date(2024, 1, 1),
+            end_date=datetime.date(2024, 4, 1),
+            email_sent_status=0,
+        )
+
+        self.filing = Filing.objects.create(
+            entity=self.committee_entity,
+            filing_period=filing_period,
+            filed_date=datetime.datetime(2024, 4, 1, tzinfo=pytz.utc),
+            final=True,
+        )
+
+    def contribution(self, **kwargs):
+        record = {field: "" for field in self.contribution_fields}
+        record.update(
+            {
+                "OrgID": "1234",
+                "Committee Name": "Committee to Import",
+                "Report Name": "First Biannual",
+                "Start of Period": "01/01/2024",
+                "End of Period": "04/01/2024",
+                "Contribution Type": "Monetary Contribution",
+                "Contributor Code": "Individual",
+                "First Name": "Ada",
+                "Last Name": "Lovelace",
+                "Contributor Address Line 1": "1 Main St",
+                "Contributor City": "Santa Fe",
+                "Contributor State": "NM",
+                "Contributor Zip Code": "87501",
+                "Transaction Amount": "100.00",
+                "Transaction Date": "02/14/2024",
+            }
+        )
+        record.update(kwargs)
+        return record
+
+    def expenditure(self, **kwargs):
+        record = {field: "" for field in self.expenditure_fields}
+        record.update(
+            {
+                "OrgID": "1234",
+                "Committee Name": "Committee to Import",
+                "Report Name": "First Biannual",
+                "Start of Period": "01/01/2024",
+                "End of Period": "04/01/2024",
+                "Payee Last Name": "Print Shop",
+                "Payee City": "Albuquerque",
+                "Payee State": "NM",
+                "Expenditure Amount": "40.00",
+                "Expenditure Date": "03/01/2024",
+                "Expenditure Type": "Printing",
+            }
+        )
+        record.update(kwargs)
+        return record
+
+    def write_csv(self, f, fieldnames, records):
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(records)
+        f.flush()
+
+    def import_contributions(self, records, stderr=None, **options):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as f:
+            self.write_csv(f, self.contribution_fields, records)
+
+            call_command(
+                "import_transactions",
+                transaction_type="CON",
+                quarters="1",
+                year="2024",
+                file=f.name,
+                stdout=StringIO(),
+                **options,
+                stderr=stderr or StringIO(),
+            )
+
+    def test_import_contributions(self):
+        records = [
+            self.contribution(),
+            self.contribution(**{"Transaction Amount": "50.00"}),
+            self.contribution(
+                **{
+                    "Contributor Code": "Business",
+                    "First Name": "Analytical Engines",
+                    "Last Name": "",
+                    "Transaction Amount": "25.00",
+                }
+            ),
+        ]
+
+        self.import_contributions(records)
+
+        transactions = self.filing.transaction_set.all()
+
+        self.assertEqual(sorted(t.amount for t in transactions), [25.0, 50.0, 100.0])
+        self.assertEqual(len({t.contact_id for t in transactions}), 2)
+
+        self.filing.refresh_from_db()
+        self.assertEqual(self.filing.total_contributions, 175.0)
+
+        # Importing the same file again should replace the transactions,
+        # reusing the contacts and addresses created the first time
+        n_contacts = Contact.objects.count()
+        n_addresses = Address.objects.count()
+
+        self.import_contributions(records)
+
+        self.assertEqual(self.filing.transaction_set.count(), 3)
+        self.assertEqual(Contact.objects.count(), n_contacts)
+        self.assertEqual(Address.objects.count(), n_addresses)
+
+    def test_import_contributions_with_copy_loader(self):
+        records = [
+            self.contribution(),
+            self.contribution(
+                **{"Contribution Type": "Loans Received", "Transaction Amount": "500"}
+            ),
+            self.contribution(
+                **{"Contribution Type": "Special Event", "Transaction Amount": "75"}
+            ),
+        ]
+
+        for _ in range(2):
+            self.import_contributions(records, loader="copy")
+
+            self.assertEqual(
+                [t.amount for t in self.filing.transaction_set.all()], [100.0]
+            )
+            self.assertEqual(
+                [
+                    (lt.amount, lt.loan.amount)
+                    for lt in self.filing.loantransaction_set.all()
+                ],
+                [(500.0, 500.0)],
+            )
+            self.assertEqual(
+                [e.anonymous_contributions for e in self.filing.specialevent_set.all()],
+                [75.0],
+            )
+
+        transaction = self.filing.transaction_set.get()
+        self.assertEqual(transaction.full_name, "Ada Lovelace")
+        self.assertEqual(transaction.check_number, "")
+        self.assertEqual(transaction.received_date, parse_date("02/14/2024"))
+        self.assertEqual(
+            transaction.transaction_type.description, "Monetary Contribution"
+        )
+
+    def aggregates(self):
+        tables = {}
+
+        with connection.cursor() as cursor:
+            for table in AGGREGATE_TABLES:
+                interval = table.rsplit("_", 1)[1]
+                cursor.execute(
+                    "SELECT entity_id, {0}, amount FROM {1} ORDER BY 1, 2".format(
+                        interval, table
+                    )
+                )
+                tables[table] = cursor.fetchall()
+
+        return tables
+
+    def monthly_contributions(self):
+        return [
+            (month.astimezone(MOUNTAIN_TZ).month, amount)
+            for entity_id, month, amount in self.aggregates()["contributions_by_month"]
+            if entity_id == self.committee_entity.id
+        ]
+
+    def test_import_updates_aggregates(self):
+        self.import_contributions(
+            [
+                self.contribution(**{"Transaction Date": "01/10/2024"}),
+                self.contribution(
+                    **{"Transaction Amount": "50.00", "Transaction Date": "03/20/2024"}
+                ),
+            ]
+        )
+
+        # Months without contributions are only filled in when they're read
+        self.assertEqual(self.monthly_contributions(), [(1, 100), (3, 50)])
+        self.assertEqual(
+            [
+                (start.month, amount)
+                for start, amount in aggregate_series(
+                    self.committee_entity.id, "contributions", since="2024-01-01"
+                )
+            ],
+            [(1, 100), (2, 0), (3, 50)],
+        )
+        self.assertFalse(AggregateChange.objects.exists())
+
+        incremental = self.aggregates()
+        call_command("aggregate_data", full=True, stdout=StringIO())
+        self.assertEqual(incremental, self.aggregates())
+
+        self.import_contributions(
+            [self.contribution(**{"Transaction Date": "01/10/2024"})]
+        )
+
+        self.assertEqual(self.monthly_contributions(), [(1, 100)])
+
+        incremental = self.aggregates()
+        call_command("aggregate_data", full=True, stdout=StringIO())
+        self.assertEqual(incremental, self.aggregates())
+
+    def test_import_transaction_files(self):
+        with tempfile.NamedTemporaryFile(
+            "w", suffix=".csv"
+        ) as contributions, tempfile.NamedTemporaryFile(
+            "w", suffix=".csv"
+        ) as expenditures:
+            self.write_csv(
+                contributions, self.contribution_fields, [self.contribution()]
+            )
+            self.write_csv(expenditures, self.expenditure_fields, [self.expenditure()])
+
+            call_command(
+                "import_transaction_files",
+                "--import",
+                "CON",
+                "2024",
+                "1,2",
+                contributions.name,
+                "--import",
+                "EXP",
+                "2024",
+                "1",
+                expenditures.name,
+                stdout=StringIO(),
+                stderr=StringIO(),
+            )
+
+        self.filing.refresh_from_db()
+        self.assertEqual(self.filing.total_contributions, 100.0)
+        self.assertEqual(self.filing.total_expenditures, 40.0)
+
+        expenditure = self.filing.expenditures().get()
+        self.assertEqual(expenditure.description, "Printing")
+        self.assertEqual(expenditure.company_name, "Print Shop")
+
+    def test_total_imported_filings_only(self):
+        untouched_filing = Filing.objects.create(
+            entity=Entity.objects.create(),
+            filing_period=self.filing.filing_period,
+            filed_date=datetime.datetime(2024, 4, 2, tzinfo=pytz.utc),
+            final=True,
+            total_contributions=999.0,
+        )
+
+        self.import_contributions([self.contribution()], total_imported_only=True)
+
+        untouched_filing.refresh_from_db()
+        self.assertEqual(untouched_filing.total_contributions, 999.0)
+
+        self.filing.refresh_from_db()
+        self.assertEqual(self.filing.total_contributions, 100.0)
+        self.assertEqual(self.filing.total_expenditures, 0)
+        self.assertEqual(self.filing.total_loans, 0)
+
+        self.import_contributions([])
+
+        untouched_filing.refresh_from_db()
+        self.assertEqual(untouched_filing.total_contributions, 0)
+
+    def test_import_matches_committee_by_name(self):
+        self.committee_entity.user_id = None
+        self.committee_entity.save()
+
+        # Transactions should go to the most recently filed of several final
+        # filings for the same period
+        amended_filing = Filing.objects.create(
+            entity=self.committee_entity,
+            filing_period=self.filing.filing_period,
+            filed_date=datetime.datetime(2024, 4, 5, tzinfo=pytz.utc),
+            final=True,
+        )
+
+        self.import_contributions([self.contribution(OrgID="5678")])
+
+        self.committee_entity.refresh_from_db()
+        self.assertEqual(self.committee_entity.user_id, 5678)
+
+        self.assertEqual(amended_filing.transaction_set.count(), 1)
+        self.assertEqual(self.filing.transaction_set.count(), 0)
+
+    def test_import_candidate_committee(self):
+        candidate_entity = Entity.objects.create(
+            entity_type=EntityType.objects.create(description="Candidate")
+        )
+        candidate = Candidate.objects.create(entity=candidate_entity)
+
+        filings = {}
+
+        for user_id in (2468, 1357):
+            committee = PAC.objects.create(
+                entity=Entity.objects.create(user_id=user_id),
+                name=f"Committee {user_id}",
+            )
+            campaign = Campaign.objects.create(
+                candidate=candidate,
+                election_season=self.election_season,
+                office=self.office,
+                political_party=self.first_campaign.political_party,
+                committee=committee,
+            )
+            filings[user_id] = Filing.objects.create(
+                entity=candidate_entity,
+                campaign=campaign,
+                filing_period=self.filing.filing_period,
+                filed_date=datetime.datetime(2024, 4, 1, tzinfo=pytz.utc),
+                final=True,
+            )
+
+        self.import_contributions(
+            [
+                self.contribution(OrgID="1357", **{"Committee Name": "Committee 1357"}),
+                self.contribution(OrgID="2468", **{"Committee Name": "Committee 2468"}),
+                self.contribution(OrgID="2468", **{"Committee Name": "Committee 2468"}),
+            ]
+        )
+
+        self.assertEqual(filings[1357].transaction_set.count(), 1)
+        self.assertEqual(filings[2468].transaction_set.count(), 2)
+
+    def test_import_contributions_with_staging_loader(self):
+        records = [
+            self.contribution(),
+            self.contribution(
+                **{
+                    "Contribution Type": "In-Kind Contribution",
+                    "Transaction Amount": "50.00",
+                    "Description": "x" * 100,
+                }
+            ),
+            self.contribution(
+                **{
+                    "Contributor Code": "Business",
+                    "First Name": "Analytical  Engines",
+                    "Last Name": "",
+                    "Contributor Address Line 2": "Suite 2",
+                    "Transaction Amount": "25.00",
+                }
+            ),
+            self.contribution(
+                **{"Contribution Type": "Loans Received", "Transaction Amount": "500"}
+            ),
+            self.contribution(
+                **{"Contribution Type": "Special Event", "Transaction Amount": "75"}
+            ),
+            self.contribution(**{"Contribution Type": "Unknown"}),
+        ]
+
+        def imported():
+            return (
+                sorted(
+                    self.filing.transaction_set.values_list(
+                        "amount",
+                        "received_date",
+                        "description",
+                        "contact_id",
+                        "full_name",
+                        "first_name",
+                        "company_name",
+                        "address",
+                        "transaction_type__description",
+                        "transaction_type__anonymous",
+                    )
+                ),
+                sorted(
+                    self.filing.loantransaction_set.values_list(
+                        "amount",
+                        "transaction_date",
+                        "transaction_type__description",
+                        "loan__amount",
+                        "loan__contact_id",
+                        "loan__company_name",
+                        "loan__address",
+                    )
+                ),
+                sorted(
+                    self.filing.specialevent_set.values_list(
+                        "anonymous_contributions", "event_date", "sponsors", "address"
+                    )
+                ),
+            )
+
+        self.import_contributions(records)
+
+        expected = imported()
+        n_contacts = Contact.objects.count()
+        n_addresses = Address.objects.count()
+
+        for _ in range(2):
+            self.import_contributions(records, loader="staging")
+
+            self.assertEqual(imported(), expected)
+            self.assertEqual(Contact.objects.count(), n_contacts)
+            self.assertEqual(Address.objects.count(), n_addresses)
+
+        self.filing.refresh_from_db()
+        self.assertEqual(self.filing.total_contributions, 175.0)
+        self.assertEqual(self.filing.total_loans, 500.0)
+
+        # New contributors should be created the same way as by the ORM import
+        Contact.objects.all().delete()
+        self.filing.transaction_set.all().delete()
+        self.import_contributions(records, loader="staging")
+
+        staged = imported()
+
+        self.assertEqual(Contact.objects.count(), n_contacts)
+        self.assertEqual(
+            [row[:3] + row[4:] for row in staged[0]],
+            [row[:3] + row[4:] for row in expected[0]],
+        )
+
+    def test_staging_loader_skips_undated_loans(self):
+        records = [
+            self.contribution(
+                **{"Contribution Type": "Loans Received", "Transaction Amount": "500"}
+            ),
+            self.contribution(
+                **{
+                    "Contribution Type": "Loans Received",
+                    "Transaction Amount": "300",
+                    "Transaction Date": "not a date",
+                }
+            ),
+        ]
+
+        # Staging tables are private to the import, so a table of the same
+        # name, e.g., another import's, is left alone
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TABLE staging_record (id integer)")
+
+        stderr = StringIO()
+        self.import_contributions(records, loader="staging", stderr=stderr)
+
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE public.staging_record")
+
+        self.assertEqual(
+            list(self.filing.loantransaction_set.values_list("amount", flat=True)),
+            [500.0],
+        )
+        self.assertIn(
+            "Could not parse date of loan, skipping record: not a date",
+            stderr.getvalue(),
+        )
+
+    def test_import_expenditures_with_staging_loader(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as expenditures:
+            self.write_csv(
+                expenditures,
+                self.expenditure_fields,
+                [
+                    self.expenditure(),
+                    self.expenditure(
+                        **{"Description": "Services", "Payee First Name": "Fast"}
+                    ),
+                ],
+            )
+
+            for _ in range(2):
+                call_command(
+                    "import_transaction_files",
+                    "--import",
+                    "EXP",
+                    "2024",
+                    "1",
+                    expenditures.name,
+                    loader="staging",
+                    stdout=StringIO(),
+                    stderr=StringIO(),
+                )
+
+        self.filing.refresh_from_db()
+        self.assertEqual(self.filing.total_expenditures, 80.0)
+
+        self.assertEqual(
+            sorted(
+                self.filing.expenditures().values_list(
+                    "description", "company_name", "full_name", "contact_id"
+                )
+            ),
+            [
+                ("Printing", "Print Shop", "Print Shop", None),
+                ("Services", "Fast Print Shop", "Fast Print Shop", None),
+            ],
+        )
+
+
+class TestBulkDownloads(DatabaseTestCase):
+    """
+    Test bulk downloads serialized by Postgres with COPY, which can only see
+    committed rows.
+    """
+
+    def get_rows(self, url, **params):
+        response = self.client.get(url, params)
+
+        self.assertTrue(response.streaming)
+
+        content = b"".join(response.streaming_content).decode("utf-8")
+        return list(csv.reader(content.splitlines()))
+
+    @override_settings(BULK_DOWNLOAD_CHUNK_SIZE=1)
+    def test_bulk_contributions(self):
+        rows = self.get_rows("/api/bulk/contributions/")
+
+        self.assertEqual(rows[0][:4], ["name", "address", "occupation", "amount"])
+        self.assertEqual(
+            len(rows) - 1,
+            Transaction.objects.filter(transaction_type__contribution=True).count(),
+        )
+
+        rows = self.get_rows("/api/bulk/contributions/", **{"from": "2100-01-01"})
+
+        self.assertEqual(len(rows), 1)
+
+    def test_csv_is_the_same_with_or_without_copy(self):
+        query = """
+            SELECT
+              %s::boolean AS flag,
+              '2024-01-02 03:04:05.6-07'::timestamptz AS received_date,
+              100.0::double precision AS amount,
+              NULL AS missing,
+              '' AS empty,
+              'Smith, "Jo"' AS name
+            UNION ALL
+            SELECT
+              FALSE, NULL, 0.1, NULL, 'a
+            b', 'Jo'
+        """
+
+        copied = b"".join(stream_csv(query, [True])).decode("utf-8")
+
+        with transaction.atomic():
+            written = "".join(stream_csv(query, [True]))
+
+        self.assertEqual(written, copied)
+        self.assertIn(
+            'True,2024-01-02 10:04:05.600000+00:00,100.0,,,"Smith, ""Jo"""\r\n'
+            'False,,0.1,,"a\n            b",Jo\r\n',
+            written,
+        )
+
+        for url in (
+            "/api/bulk/contributions/",
+            reverse("bulk-candidates"),
+            reverse("bulk-committees"),
+        ):
+            copied = b"".join(self.client.get(url).streaming_content)
+
+            with transaction.atomic():
+                written = b"".join(self.client.get(url).streaming_content)
+
+            self.assertEqual(written, copied)
+
+    def test_bulk_candidates(self):
+        rows = self.get_rows(reverse("bulk-candidates"))
+
+        self.assertIn("committee_name", rows[0])
+        self.assertEqual(len(rows) - 1, Candidate.objects.count())
+
+        rows = self.get_rows(reverse("bulk-candidates"), to="2000-01-01")
+
+        self.assertEqual(len(rows), 1)
+
+    def test_build_bulk_exports(self):
+        with tempfile.TemporaryDirectory() as export_root, override_settings(
+            BULK_EXPORT_ROOT=export_root
+        ):
+            call_command(
+                "build_bulk_exports",
+                start_year=2017,
+                end_year=2018,
+                stdout=StringIO(),
+            )
+
+            self.assertTrue(
+                os.path.exists(os.path.join(export_root, "contributions-2018.csv.gz"))
+            )
+
+            response = self.client.get(
+                "/api/bulk/contributions/", HTTP_ACCEPT_ENCODING="gzip"
+            )
+            content = b"".join(response.streaming_content)
+
+            self.assertEqual(response["Content-Encoding"], "gzip")
+            self.assertEqual(int(response["Content-Length"]), len(content))
+            self.assertEqual(
+                gzip.decompress(content),
+                b"".join(self.client.get("/api/bulk/contributions/").streaming_content),
+            )
+
+            # Conditional and range requests
+            response = self.client.get(
+                "/api/bulk/contributions/",
+                HTTP_ACCEPT_ENCODING="gzip",
+                HTTP_IF_NONE_MATCH=response["ETag"],
+            )
+            self.assertEqual(response.status_code, 304)
+
+            response = self.client.get(
+                "/api/bulk/contributions/",
+                HTTP_ACCEPT_ENCODING="gzip",
+                HTTP_RANGE="bytes=10-",
+            )
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(b"".join(response.streaming_content), content[10:])
+            self.assertEqual(
+                response["Content-Range"],
+                "bytes 10-{}/{}".format(len(content) - 1, len(content)),
+            )
+
+            response = self.client.get(
+                "/api/bulk/contributions/",
+                HTTP_ACCEPT_ENCODING="gzip",
+                HTTP_RANGE="bytes={}-".format(len(content)),
+            )
+            self.assertEqual(response.status_code, 416)
+
+            # Partitions are only served for whole years
+            response = self.client.get(
+                "/api/bulk/expenditures/",
+                {"from": "2018-01-01", "to": "2018-12-31"},
+                HTTP_ACCEPT_ENCODING="gzip",
+            )
+            self.assertEqual(response["Content-Encoding"], "gzip")
+
+            response = self.client.get(
+                "/api/bulk/expenditures/",
+                {"from": "2018-01-01", "to": "2018-06-30"},
+                HTTP_ACCEPT_ENCODING="gzip",
+            )
+            self.assertFalse(response.has_header("Content-Encoding"))
+
+            response = self.client.get(
+                "/api/bulk/contributions/", {"format": "parquet"}
+            )
+            self.assertEqual(response["Content-Type"], "application/vnd.apache.parquet")
+            self.assertTrue(response.has_header("ETag"))
+            self.assertEqual(
+                pq.read_table(
+                    io.BytesIO(b"".join(response.streaming_content))
+                ).num_rows,
+                Transaction.objects.filter(transaction_type__contribution=True).count(),
+            )
+
+            response = self.client.get(
+                reverse("bulk-candidates"), HTTP_ACCEPT_ENCODING="gzip"
+            )
+            rows = list(
+                csv.reader(
+                    gzip.decompress(b"".join(response.streaming_content))
+                    .decode("utf-8")
+                    .splitlines()
+                )
+            )
+            self.assertEqual(len(rows) - 1, Candidate.objects.count())
+
+    def test_build_bulk_exports_uploads_to_s3(self):
+        with tempfile.TemporaryDirectory() as export_root, override_settings(
+            BULK_EXPORT_ROOT=export_root, BULK_EXPORT_BUCKET="nmid"
+        ), mock.patch("camp_fin.management.commands.build_bulk_exports.boto3") as boto3:
+            call_command(
+                "build_bulk_exports",
+                datasets=["contributions"],
+                start_year=2018,
+                end_year=2018,
+                stdout=StringIO(),
+            )
+
+            uploads = {
+                call.args[2]: call.kwargs["ExtraArgs"]
+                for call in boto3.client.return_value.upload_file.call_args_list
+            }
+
+            self.assertEqual(
+                uploads,
+                {
+                    "exports/contributions.csv.gz": {
+                        "ContentType": "text/csv",
+                        "ContentEncoding": "gzip",
+                        "ContentDisposition": "attachment; filename=contributions.csv",
+                    },
+                    "exports/contributions-2018.csv.gz": {
+                        "ContentType": "text/csv",
+                        "ContentEncoding": "gzip",
+                        "ContentDisposition": (
+                            "attachment; filename=contributions-2018.csv"
+                        ),
+                    },
+                    "exports/contributions.parquet": {
+                        "ContentType": "application/vnd.apache.parquet",
+                        "ContentDisposition": (
+                            "attachment; filename=contributions.parquet"
+                        ),
+                    },
+                },
+            )
+
+            # Matching requests are redirected to S3 rather than served from
+            # the ETL's disk
+            for params, key in (
+                ({}, "contributions.csv.gz"),
+                (
+                    {"from": "2018-01-01", "to": "2018-12-31"},
+                    "contributions-2018.csv.gz",
+                ),
+                ({"format": "parquet"}, "contributions.parquet"),
+            ):
+                response = self.client.get(
+                    "/api/bulk/contributions/", params, HTTP_ACCEPT_ENCODING="gzip"
+                )
+                self.assertEqual(response.status_code, 302)
+                self.assertEqual(
+                    response["Location"], "https://nmid.s3.amazonaws.com/exports/" + key
+                )
+
+            # Clients that don't accept gzip, and years that weren't built,
+            # get the result of the query
+            response = self.client.get("/api/bulk/contributions/")
+            self.assertEqual(response.status_code, 200)
+
+            response = self.client.get(
+                "/api/bulk/contributions/",
+                {"from": "2017-01-01", "to": "2017-12-31"},
+                HTTP_ACCEPT_ENCODING="gzip",
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.has_header("Content-Encoding"))
+
+            # Rebuilding updates the recorded exports
+            call_command(
+                "build_bulk_exports",
+                datasets=["contributions"],
+                start_year=2018,
+                end_year=2018,
+                stdout=StringIO(),
+            )
+            self.assertEqual(BulkExport.objects.count(), 3)
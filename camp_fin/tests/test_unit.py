@@ -1,14 +1,27 @@
+import csv
+import io
+
+import pyarrow.parquet as pq
+from dateutil.parser import parse
 from django.contrib.auth.models import User
 from django.db.utils import IntegrityError
-from django.http import HttpRequest, QueryDict
-from django.test import TestCase
+from django.http import HttpRequest, HttpResponse, QueryDict
+from django.test import RequestFactory, TestCase, override_settings
 from django.urls import reverse
 
+from camp_fin import invalidation
 from camp_fin.base_views import TransactionDownloadViewSet
 from camp_fin.decorators import check_date_params
-from camp_fin.models import OfficeType, Race
+from camp_fin.management.commands.utils import MOUNTAIN_TZ, parse_date
+from camp_fin.middleware import (
+    CacheInvalidationMiddleware,
+    FetchFromCacheMiddleware,
+    UpdateCacheMiddleware,
+)
+from camp_fin.models import PAC, OfficeType, Race, Transaction
 from camp_fin.templatetags.helpers import format_years
 from camp_fin.tests.conftest import StatelessTestCase
+from pages.models import Blob, Page
 
 
 class TestRace(StatelessTestCase):
@@ -257,6 +270,179 @@ class TestUtils(TestCase):
         )
         assert format_years(["2019", "2018", "2018", "2017"]) == "2017 - 2019"
 
+    def test_parse_date(self):
+        # The fast path should agree with dateutil on every format it handles
+        for date_str in (
+            "1/31/2024",
+            "01/31/2024",
+            "01/31/2024 00:00:00",
+            "1/31/2024 12:00:00 AM",
+            "1/31/2024 12:30 PM",
+            "1/31/2024 3:05:09 pm",
+            "2024-01-31",
+            "2024-01-31 13:45:00",
+            "2024-01-31T13:45:00.123",
+            " 2024-01-31 ",
+            "January 31, 2024",
+        ):
+            assert parse_date(date_str) == parse(date_str).replace(
+                tzinfo=MOUNTAIN_TZ
+            ), date_str
+
+        assert parse_date("01/31/2024").tzinfo is MOUNTAIN_TZ
+        assert parse_date("02/30/2024") is None
+        assert parse_date("not a date") is None
+        assert parse_date("") is None
+        assert parse_date(None) is None
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class TestCacheInvalidation(StatelessTestCase):
+    """
+    Test that model changes invalidate the cached pages they affect, and only
+    those pages.
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        self.first_candidate.slug = "first-candidate"
+        self.first_candidate.save()
+        self.second_candidate.slug = "second-candidate"
+        self.second_candidate.save()
+
+    def versions(self):
+        return dict(
+            zip(
+                self.groups,
+                invalidation.get_versions(self.groups),
+            )
+        )
+
+    groups = [
+        invalidation.ALL,
+        invalidation.LISTINGS,
+        "candidate:first-candidate",
+        "candidate:second-candidate",
+    ]
+
+    def test_page_key_prefix(self):
+        request = RequestFactory().get("/candidates/first-candidate/")
+
+        prefix = invalidation.page_key_prefix(request)
+        assert prefix == invalidation.page_key_prefix(request)
+
+        self.first_candidate.save()
+        assert prefix != invalidation.page_key_prefix(request)
+
+        self.second_candidate.save()
+        assert invalidation.page_groups("/candidates/") == [
+            invalidation.ALL,
+            invalidation.LISTINGS,
+        ]
+
+    def test_cache_middleware(self):
+        responses = []
+
+        def view(request):
+            response = HttpResponse(str(len(responses)))
+            responses.append(response)
+            return response
+
+        handler = UpdateCacheMiddleware(
+            CacheInvalidationMiddleware(FetchFromCacheMiddleware(view))
+        )
+
+        def get(path):
+            return handler(RequestFactory().get(path)).content
+
+        assert get("/candidates/first-candidate/") == b"0"
+        assert get("/candidates/first-candidate/") == b"0"
+        assert get("/candidates/second-candidate/") == b"1"
+
+        self.first_candidate.save()
+
+        assert get("/candidates/first-candidate/") == b"2"
+        assert get("/candidates/second-candidate/") == b"1"
+
+    def test_targeted_invalidation(self):
+        before = self.versions()
+
+        # Changing a contribution should invalidate the page of the candidate
+        # who received it, and listings, but not other candidates' pages
+        self.first_contribution.save()
+
+        after = self.versions()
+
+        assert after["candidate:first-candidate"] != before["candidate:first-candidate"]
+        assert after[invalidation.LISTINGS] != before[invalidation.LISTINGS]
+        assert (
+            after["candidate:second-candidate"] == before["candidate:second-candidate"]
+        )
+        assert after[invalidation.ALL] == before[invalidation.ALL]
+
+        # Changing a race should invalidate the pages of its candidates
+        self.race.save()
+
+        after_race = self.versions()
+
+        assert (
+            after_race["candidate:first-candidate"]
+            != after["candidate:first-candidate"]
+        )
+        assert (
+            after_race["candidate:second-candidate"]
+            != after["candidate:second-candidate"]
+        )
+
+    def test_batch_invalidation(self):
+        before = self.versions()
+
+        with invalidation.batch_invalidation():
+            self.first_candidate.save()
+            PAC.objects.get(id=self.some_pac.id).save()
+
+            assert self.versions() == before
+
+        after = self.versions()
+
+        assert after["candidate:first-candidate"] != before["candidate:first-candidate"]
+        assert (
+            after["candidate:second-candidate"] == before["candidate:second-candidate"]
+        )
+
+    def test_bulk_update(self):
+        before = self.versions()
+
+        with invalidation.bulk_update():
+            self.first_candidate.save()
+            self.second_candidate.save()
+
+            assert self.versions() == before
+
+        after = self.versions()
+
+        assert after[invalidation.ALL] != before[invalidation.ALL]
+        assert after["candidate:first-candidate"] == before["candidate:first-candidate"]
+
+    def test_page_content_invalidation(self):
+        page = Page.objects.create(
+            title="About", path="/about/", template="about.html", text=""
+        )
+        blob = Blob.objects.create(context_name="intro", text="")
+
+        before = self.versions()
+        page.blobs.add(blob)
+        after_add = self.versions()
+
+        assert after_add[invalidation.ALL] != before[invalidation.ALL]
+
+        blob.delete()
+
+        assert self.versions()[invalidation.ALL] != after_add[invalidation.ALL]
+
 
 class TestAPI(StatelessTestCase):
     """
@@ -285,6 +471,64 @@ class TestAPI(StatelessTestCase):
 
         self.assertEqual(response.status_code, 200)
 
+    @override_settings(BULK_DOWNLOAD_ITERSIZE=1)
+    def test_bulk_downloads_stream_all_rows(self):
+        response = self.client.get("/api/bulk/contributions/")
+
+        self.assertTrue(response.streaming)
+
+        rows = list(
+            csv.reader(
+                b"".join(response.streaming_content).decode("utf-8").splitlines()
+            )
+        )
+
+        self.assertEqual(rows[0][:4], ["name", "address", "occupation", "amount"])
+        self.assertGreater(len(rows), 2)
+        self.assertEqual(
+            len(rows) - 1,
+            Transaction.objects.filter(transaction_type__contribution=True).count(),
+        )
+
+        response = self.client.get(reverse("bulk-candidates"))
+        content = b"".join(response.streaming_content).decode("utf-8")
+
+        self.assertIn("committee_name", content.splitlines()[0])
+        self.assertIn("first", content)
+
+    @override_settings(BULK_PARQUET_ROW_GROUP_SIZE=2)
+    def test_bulk_downloads_as_parquet(self):
+        response = self.client.get("/api/bulk/contributions/", {"format": "parquet"})
+
+        self.assertEqual(response["Content-Type"], "application/vnd.apache.parquet")
+        self.assertTrue(response["Content-Disposition"].endswith(".parquet"))
+
+        parquet_file = pq.ParquetFile(io.BytesIO(b"".join(response.streaming_content)))
+        table = parquet_file.read()
+
+        self.assertEqual(
+            table.num_rows,
+            Transaction.objects.filter(transaction_type__contribution=True).count(),
+        )
+        self.assertEqual(str(table.schema.field("amount").type), "double")
+        self.assertEqual(
+            str(table.schema.field("received_date").type), "timestamp[us, tz=UTC]"
+        )
+
+        # Row groups hold at most two rows, all from the same year
+        for i in range(parquet_file.num_row_groups):
+            dates = parquet_file.read_row_group(i).column("received_date").to_pylist()
+
+            self.assertLessEqual(len(dates), 2)
+            self.assertEqual(
+                len({date.astimezone(MOUNTAIN_TZ).year for date in dates}), 1
+            )
+
+        response = self.client.get(reverse("bulk-candidates"), {"format": "parquet"})
+        table = pq.read_table(io.BytesIO(b"".join(response.streaming_content)))
+
+        self.assertIn("committee_name", table.column_names)
+
     def test_bulk_expenditures(self):
         url = "/api/bulk/expenditures/"
         response = self.client.get(url)
@@ -34,6 +34,7 @@ from camp_fin.views import (
     ExpenditureDownloadViewSet,
     ExpenditureViewSet,
     FinancialDisclosuresView,
+    GlobalSearchAPIView,
     IndexView,
     LoanViewSet,
     LobbyistDownloadView,
@@ -42,6 +43,7 @@ from camp_fin.views import (
     OrganizationList,
     SearchAPIView,
     SearchView,
+    SuggestAPIView,
     TopDonorsView,
     TopEarnersView,
     TopEarnersWidgetView,
@@ -67,6 +69,8 @@ router.register(r"transactions", TransactionViewSet, basename="transactions")
 router.register(r"top-donors", TopDonorsView, basename="top-donors")
 router.register(r"top-expenses", TopExpensesView, basename="top-expenses")
 router.register(r"search", SearchAPIView, basename="search")
+router.register(r"global-search", GlobalSearchAPIView, basename="global-search")
+router.register(r"suggest", SuggestAPIView, basename="suggest")
 router.register(r"loans", LoanViewSet, basename="loan")
 
 handler404 = "camp_fin.views.four_oh_four"
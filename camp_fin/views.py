@@ -1,6 +1,7 @@
-import csv
 import datetime
 from collections import OrderedDict, namedtuple
+from functools import partial
+from urllib.parse import quote_plus
 
 from django import forms
 from django.conf import settings
@@ -9,10 +10,11 @@ from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
 from django.core.management import call_command
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.db import connection
+from django.db import OperationalError, connection, transaction
 from django.db.models import Max, Q
 from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.urls import reverse
 from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.utils.text import slugify
@@ -20,11 +22,13 @@ from django.views.decorators.cache import never_cache
 from django.views.decorators.clickjacking import xframe_options_exempt
 from django.views.generic import DetailView, FormView, TemplateView
 from django_select2 import forms as s2forms
-from rest_framework import renderers, viewsets
+from psycopg2.errors import QueryCanceled
+from rest_framework import pagination, renderers, viewsets
 from rest_framework.response import Response
 
 from pages.models import Page
 
+from .aggregates import aggregate_totals, first_interval
 from .api_parts import (
     CandidateSearchSerializer,
     DataTablesPagination,
@@ -34,12 +38,12 @@ from .api_parts import (
     OrganizationSearchSerializer,
     PACSearchSerializer,
     SearchCSVRenderer,
+    SearchDocumentSerializer,
     TransactionCSVRenderer,
     TransactionSearchSerializer,
     TransactionSerializer,
 )
 from .base_views import (
-    Echo,
     LobbyistTransactionDownloadViewSet,
     PagesMixin,
     PaginatedList,
@@ -48,8 +52,11 @@ from .base_views import (
     TransactionBaseViewSet,
     TransactionDetail,
     TransactionDownloadViewSet,
-    iterate_cursor,
+    download_response,
+    stream_query,
+    top_earners,
 )
+from .exports import zip_chunks
 from .merge_objects import merge_objects
 from .models import (
     PAC,
@@ -62,8 +69,11 @@ from .models import (
     OfficeType,
     Organization,
     Race,
+    SearchDocument,
     Transaction,
 )
+from .search_pool import SearchTimeout, search_deadline, search_in_parallel
+from .suggest import suggestions
 from .templatetags.helpers import format_money, get_transaction_verb
 
 TWENTY_TEN = timezone.make_aware(datetime.datetime(2010, 1, 1))
@@ -400,34 +410,81 @@ class RaceDetail(DetailView):
         race = self.object
         year = race.funding_period
 
-        # Create a map of entity IDs and funding trends for each candidate
-        active_entities = [
-            Entity.objects.get(id=camp.candidate.entity_id)
-            for camp in race.active_campaigns
+        campaigns = race.campaigns.select_related(
+            "candidate", "political_party", "race"
+        )
+        campaigns = race.sort_by_funds_raised(campaigns)
+
+        # Total the funds raised, expenditures and cash on hand of every
+        # campaign, and generate the funding trends of each candidate, in a
+        # fixed number of queries
+        since = "{year}-01-01".format(year=year) if year else None
+        entity_ids = [camp.candidate.entity_id for camp in campaigns if camp.candidate]
+
+        funds_raised = race.funds_raised_by_campaign(campaigns)
+        cash_on_hand = race.cash_on_hand_by_campaign(campaigns)
+        expenditures = aggregate_totals(entity_ids, "expenditures", since=since)
+        trends = Entity.batch_trends(entity_ids, since=year)
+
+        no_trends = {
+            "balance_trend": [],
+            "debt_trend": [],
+            "donation_trend": [],
+            "expend_trend": [],
+        }
+
+        for camp in campaigns:
+            camp.race_funds_raised = funds_raised[camp.id]
+            camp.race_cash_on_hand = cash_on_hand[camp.id]
+
+            if camp.candidate:
+                camp.race_expenditures = expenditures[camp.candidate.entity_id]
+                camp.trends = trends[camp.candidate.entity_id]
+            else:
+                camp.race_expenditures = 0
+                camp.trends = no_trends
+
+        context["active_campaigns"] = [
+            camp for camp in campaigns if camp.get_status() == "active"
         ]
-        context["active_trends"] = [
-            entity.trends(since=year) for entity in active_entities
+        context["dropout_campaigns"] = [
+            camp for camp in campaigns if camp.get_status() != "active"
         ]
+        context["largest_contribution"] = (
+            campaigns[0].race_funds_raised if campaigns else 0
+        )
 
-        dropout_entities = [
-            Entity.objects.get(id=camp.candidate.entity_id)
-            for camp in race.sorted_dropouts
-        ]
+        # Each campaign's share of the funds raised by the campaign that raised
+        # the most, as a percentage, for scaling its bar
+        largest = context["largest_contribution"]
+        has_funds = largest and race.total_funds > 0
+
+        for camp in campaigns:
+            if has_funds:
+                camp.funds_share = round(
+                    round(camp.race_funds_raised / largest, 2) * 100
+                )
+            else:
+                camp.funds_share = 0
+
+        context["active_trends"] = [camp.trends for camp in context["active_campaigns"]]
         context["dropout_trends"] = [
-            entity.trends(since=year) for entity in dropout_entities
+            camp.trends for camp in context["dropout_campaigns"]
         ]
 
         # Find max and min of contrib/expend
         context["max"], context["min"] = 0, 0
         for cand in context["active_trends"] + context["dropout_trends"]:
             if cand["donation_trend"]:
-                top_donation = max(donation[0] for donation in cand["donation_trend"])
+                top_donation = max(
+                    donation["amount"] for donation in cand["donation_trend"]
+                )
 
                 if top_donation > context["max"]:
                     context["max"] = top_donation
 
             if cand["expend_trend"]:
-                top_expense = min(expense[0] for expense in cand["expend_trend"])
+                top_expense = min(expense["amount"] for expense in cand["expend_trend"])
 
                 if top_expense < context["min"]:
                     context["min"] = top_expense
@@ -1165,26 +1222,10 @@ class CommitteeDetailBaseView(DetailView):
         entity = Entity.objects.get(id=entity_id)
 
         # Determine the date of the first contribution/expenditure
-        min_date_query = """
-            WITH all_cash AS (
-                SELECT month
-                FROM contributions_by_month
-                WHERE entity_id = %s
-                UNION
-                SELECT month
-                FROM expenditures_by_month
-                WHERE entity_id = %s
-              )
-            SELECT COALESCE(MIN(all_cash.month::date), '2010-01-01'::date)
-            FROM all_cash
-        """
-
-        with connection.cursor() as cursor:
-            cursor.execute(min_date_query, [entity.id, entity.id])
-            row = cursor.fetchone()
+        first_month = first_interval(entity.id)
 
-        if row[0].year > 2010:
-            year = str(row[0].year)
+        if first_month and first_month.year > 2010:
+            year = str(first_month.year)
         else:
             year = "2010"
 
@@ -1312,7 +1353,7 @@ class CandidateDetail(FormView, CommitteeDetailBaseView):
 
         obj, aliases, _ = merge_objects(primary_object, alias_objects)
 
-        call_command("aggregate_data")
+        call_command("aggregate_data", full=True)
         call_command("clear_cache")
 
         messages.add_message(
@@ -1527,6 +1568,7 @@ class ContributionDownloadViewSet(TransactionDownloadViewSet):
     """
 
     contribution = True
+    export = "contributions"
 
 
 class ExpenditureDownloadViewSet(TransactionDownloadViewSet):
@@ -1535,6 +1577,7 @@ class ExpenditureDownloadViewSet(TransactionDownloadViewSet):
     """
 
     contribution = False
+    export = "expenditures"
 
 
 class LobbyistContributionViewSet(LobbyistTransactionDownloadViewSet):
@@ -1617,253 +1660,375 @@ class SearchAPIView(viewsets.ViewSet):
                 "lobbyisttransaction",
             ]
 
-        response = {}
+        if request.GET.get("format") == "csv":
+            return StreamingHttpResponse(
+                self.stream_zip(table_names, term, order_by_col, sort_order),
+                content_type=SearchCSVRenderer.media_type,
+            )
 
-        for table in table_names:
-            if table == "pac":
-                query = """
-                    SELECT * FROM (
-                      SELECT DISTINCT ON (pac.id)
-                        pac.*,
-                        address.street || ' ' ||
-                        address.city || ', ' ||
-                        state.postal_code || ' ' ||
-                        address.zipcode AS address
-                     FROM camp_fin_pac AS pac
-                     LEFT JOIN camp_fin_address AS address
-                        ON pac.address_id = address.id
-                     LEFT JOIN camp_fin_state AS state
-                        ON address.state_id = state.id
-                     JOIN camp_fin_filing AS filing
-                        ON filing.entity_id = pac.entity_id
-                     WHERE pac.search_name @@ plainto_tsquery('english', %s)
-                        AND filing.date_added >= '2010-01-01'
-                     ORDER BY pac.id
-                    ) AS s
-                """
-
-            if table == "candidate":
-                query = """
-                    SELECT * FROM (
-                      SELECT DISTINCT ON (candidate.id)
-                        candidate.*,
-                        committee.name as committee_name,
-                        county.name AS county_name,
-                        election.year AS election_year,
-                        party.name AS party_name,
-                        office.description AS office_name,
-                        officetype.description AS office_type,
-                        district.name AS district_name,
-                        division.name AS division_name
-                      FROM camp_fin_candidate AS candidate
-                      JOIN camp_fin_campaign AS campaign
-                        ON candidate.id = campaign.candidate_id
-                      JOIN camp_fin_pac as committee
-                        ON campaign.committee_id = committee.id
-                      JOIN camp_fin_electionseason AS election
-                        ON campaign.election_season_id = election.id
-                      LEFT JOIN camp_fin_politicalparty AS party
-                        ON campaign.political_party_id = party.id
-                      LEFT JOIN camp_fin_county AS county
-                        ON campaign.county_id = county.id
-                      JOIN camp_fin_office AS office
-                        ON campaign.office_id = office.id
-                      LEFT JOIN camp_fin_officetype AS officetype
-                        ON office.office_type_id = officetype.id
-                      LEFT JOIN camp_fin_district AS district
-                        ON campaign.district_id = district.id
-                      LEFT JOIN camp_fin_division AS division
-                        ON campaign.division_id = division.id
-                      WHERE candidate.search_name @@ plainto_tsquery('english', %s)
-                        AND campaign.date_added >= '2010-01-01'
-                      ORDER BY candidate.id, election.year DESC
-                    ) AS s
-                """
-
-            if table == "contribution":
-                query = """
-                    SELECT
-                      o.*,
-                      coalesce(o.full_name, o.company_name) as donor_name,
-                      CASE WHEN o.occupation = 'None' THEN ''
-                           ELSE initcap(o.occupation)
-                      END AS donor_occupation,
-                      tt.description AS transaction_type,
-                      CASE WHEN
-                        pac.name IS NULL OR TRIM(pac.name) = ''
-                      THEN
-                        candidate.full_name
-                      ELSE pac.name
-                      END AS transaction_subject,
-                      pac.slug AS pac_slug,
-                      candidate.slug AS candidate_slug,
-                      o.address || ' ' ||
-                        o.city || ', ' ||
-                        o.state || ' ' ||
-                        o.zipcode AS full_address
-                    FROM camp_fin_transaction AS o
-                    JOIN camp_fin_transactiontype AS tt
-                      ON o.transaction_type_id = tt.id
-                    JOIN camp_fin_filing AS filing
-                      ON o.filing_id = filing.id
-                    JOIN camp_fin_entity AS entity
-                      ON filing.entity_id = entity.id
-                    LEFT JOIN camp_fin_pac AS pac
-                      ON entity.id = pac.entity_id
-                    LEFT JOIN camp_fin_candidate AS candidate
-                      ON entity.id = candidate.entity_id
-                    LEFT JOIN camp_fin_contact AS contact
-                      ON o.contact_id = contact.id
-                    LEFT JOIN camp_fin_address AS address
-                      ON contact.address_id = address.id
-                    LEFT JOIN camp_fin_state AS state
-                      ON address.state_id = state.id
-                    WHERE o.search_name @@ plainto_tsquery('english', %s)
-                      AND tt.contribution = TRUE
-                      AND (o.redact = FALSE OR o.redact IS NULL)
-                      AND o.received_date >= '2010-01-01'
-                """
-
-            elif table == "expenditure":
-                query = """
-                    SELECT
-                      o.*,
-                      tt.description AS transaction_type,
-                      CASE WHEN
-                        pac.name IS NULL OR TRIM(pac.name) = ''
-                      THEN
-                        candidate.full_name
-                      ELSE pac.name
-                      END AS transaction_subject,
-                      coalesce(o.full_name, o.company_name) as donor_name,
-                      pac.slug AS pac_slug,
-                      candidate.slug AS candidate_slug
-                    FROM camp_fin_transaction AS o
-                    JOIN camp_fin_transactiontype AS tt
-                      ON o.transaction_type_id = tt.id
-                    JOIN camp_fin_filing AS filing
-                      ON o.filing_id = filing.id
-                    JOIN camp_fin_entity AS entity
-                      ON filing.entity_id = entity.id
-                    LEFT JOIN camp_fin_pac AS pac
-                      ON entity.id = pac.entity_id
-                    LEFT JOIN camp_fin_candidate AS candidate
-                      ON entity.id = candidate.entity_id
-                    WHERE o.search_name @@ plainto_tsquery('english', %s)
-                      AND tt.contribution = FALSE
-                      AND o.received_date >= '2010-01-01'
-                """
-
-            elif table == "lobbyist":
-                query = """
-                    SELECT
-                        lob.slug,
-                        concat_ws(' ', lob.prefix, lob.first_name, lob.middle_name,
-                                       lob.last_name, lob.suffix)
-                        AS name
-                    FROM camp_fin_lobbyist AS lob
-                    WHERE lob.search_name @@ plainto_tsquery('english', %s)
-                """
-
-            elif table == "organization":
-                query = """
-                    SELECT
-                        org.name AS name,
-                        org.slug AS slug,
-                        CASE WHEN
-                            add.street IS NULL OR TRIM(add.street) = ''
-                        THEN
-                            ''
-                        ELSE
-                            add.street || ' ' ||
-                            add.city || ', ' ||
-                            state.postal_code || ' ' ||
-                            add.zipcode
-                        END AS address
-                    FROM camp_fin_organization AS org
-                    JOIN camp_fin_address AS add
-                      ON org.permanent_address_id = add.id
-                    JOIN camp_fin_state AS state
-                      ON add.state_id = state.id
-                    WHERE org.search_name @@ plainto_tsquery('english', %s)
-                """
-
-            elif table == "lobbyisttransaction":
-                query = """
-                    SELECT
-                      lobbyist.slug AS lobbyist_slug,
-                      concat_ws(' ', lobbyist.prefix, lobbyist.first_name, lobbyist.middle_name,
-                                     lobbyist.last_name, lobbyist.suffix) AS lobbyist_name,
-                      trans.name,
-                      trans.beneficiary,
-                      trans.expenditure_purpose,
-                      trans.received_date,
-                      trans.amount,
-                      trans.date_added,
-                      tt.description AS transaction_type,
-                      CASE WHEN tt.group_id = 2
-                        THEN 'Political contribution'
-                      ELSE 'Candidate'
-                      END AS transaction_group
-                    FROM camp_fin_lobbyisttransaction AS trans
-                    JOIN camp_fin_lobbyisttransactiontype AS tt
-                      ON trans.lobbyist_transaction_type_id = tt.id
-                    JOIN camp_fin_lobbyistreport AS report
-                      ON trans.lobbyist_report_id = report.id
-                    JOIN camp_fin_lobbyist AS lobbyist
-                      ON report.entity_id = lobbyist.entity_id
-                    WHERE trans.search_name @@ plainto_tsquery('english', %s)
-                """
-
-            if order_by_col:
-                query = """
-                    {0} ORDER BY {1} {2}
-                """.format(
-                    query, order_by_col, sort_order
-                )
+        search = partial(
+            self.search_table_with_timeout,
+            request,
+            term=term,
+            order_by_col=order_by_col,
+            sort_order=sort_order,
+            limit=limit,
+            offset=offset,
+        )
 
-            serializer = SERIALIZER_LOOKUP[table]
+        if (
+            len(table_names) > 1
+            and settings.SEARCH_WORKERS > 1
+            and not connection.in_atomic_block
+        ):
+            # Search each table on its own connection, so that search takes
+            # as long as the slowest table, rather than all of them
+            results = search_in_parallel(search, table_names)
+        else:
+            results = [search(table) for table in table_names]
 
-            cursor = connection.cursor()
-            cursor.execute(query, [term])
+        return Response(dict(zip(table_names, results)))
 
-            columns = [c[0] for c in cursor.description]
-            result_tuple = namedtuple(table, columns)
+    def search_table_with_timeout(self, request, table, **kwargs):
+        """
+        Search a table, giving up after SEARCH_TABLE_TIMEOUT milliseconds,
+        counted over all of its queries. A table that times out gets no
+        results, and timed_out in its meta, so the results of the other
+        tables can still be returned.
+        """
+        try:
+            with transaction.atomic(), search_deadline(settings.SEARCH_TABLE_TIMEOUT):
+                result = self.search_table(request, table, **kwargs)
+                result["meta"]["timed_out"] = False
+
+        except (OperationalError, SearchTimeout) as e:
+            if isinstance(e, OperationalError) and not isinstance(
+                e.__cause__, QueryCanceled
+            ):
+                raise
+
+            result = OrderedDict(
+                [
+                    (
+                        "meta",
+                        OrderedDict(
+                            [
+                                ("total_rows", 0),
+                                ("recordsTotal", 0),
+                                ("recordsFiltered", 0),
+                                ("draw", int(request.GET.get("draw", 0))),
+                                ("timed_out", True),
+                            ]
+                        ),
+                    ),
+                    ("objects", []),
+                ]
+            )
 
-            objects = [result_tuple(*r) for r in cursor]
+        return result
 
-            meta = OrderedDict()
+    def stream_zip(self, table_names, term, order_by_col, sort_order):
+        """
+        Yield a ZIP of a CSV of the results of each table, read from a
+        server-side cursor as the archive is sent. CSV exports aren't timed
+        out, since they should be complete.
+        """
+        entries = (
+            (
+                "{}.csv".format(table),
+                stream_query(
+                    self.order(self.search_query(table), order_by_col, sort_order),
+                    [term],
+                ),
+            )
+            for table in SearchCSVRenderer.table_names
+            if table in table_names
+        )
 
-            if not request.GET.get("format") == "csv":
-                paginator = DataTablesPagination()
+        return zip_chunks(entries)
 
-                page = paginator.paginate_queryset(objects, self.request, view=self)
+    def order(self, query, order_by_col, sort_order):
+        if not order_by_col:
+            return query
 
-                serializer = serializer(page, many=True)
+        return """
+            {0} ORDER BY {1} {2}
+        """.format(
+            query, order_by_col, sort_order
+        )
 
-                objects = serializer.data
+    def search_table(
+        self, request, table, term, order_by_col, sort_order, limit, offset
+    ):
+        count_query = self.search_query(table)
+        query = self.order(count_query, order_by_col, sort_order)
 
-                draw = int(request.GET.get("draw", 0))
+        paginator = DataTablesPagination()
 
-                meta = OrderedDict(
-                    [
-                        ("total_rows", paginator.count),
-                        ("limit", limit),
-                        ("offset", offset),
-                        ("recordsTotal", paginator.count),
-                        ("recordsFiltered", limit),
-                        ("draw", draw),
-                    ]
-                )
+        page = self.fetch(
+            table,
+            "{} LIMIT %s OFFSET %s".format(query),
+            [term, paginator.get_limit(request), paginator.get_offset(request)],
+        )
 
-            response[table] = OrderedDict(
-                [
-                    ("meta", meta),
-                    ("objects", objects),
-                ]
+        serializer = SERIALIZER_LOOKUP[table](page, many=True)
+
+        count, approximate = self.count(count_query, [term])
+
+        draw = int(request.GET.get("draw", 0))
+
+        meta = OrderedDict(
+            [
+                ("total_rows", count),
+                ("approximate_count", approximate),
+                ("limit", limit),
+                ("offset", offset),
+                ("recordsTotal", count),
+                ("recordsFiltered", limit),
+                ("draw", draw),
+            ]
+        )
+
+        return OrderedDict(
+            [
+                ("meta", meta),
+                ("objects", serializer.data),
+            ]
+        )
+
+    def search_query(self, table):
+        """
+        Query selecting the rows of a table matching the search term.
+        """
+        if table == "pac":
+            query = """
+                SELECT * FROM (
+                  SELECT DISTINCT ON (pac.id)
+                    pac.*,
+                    address.street || ' ' ||
+                    address.city || ', ' ||
+                    state.postal_code || ' ' ||
+                    address.zipcode AS address
+                 FROM camp_fin_pac AS pac
+                 LEFT JOIN camp_fin_address AS address
+                    ON pac.address_id = address.id
+                 LEFT JOIN camp_fin_state AS state
+                    ON address.state_id = state.id
+                 JOIN camp_fin_filing AS filing
+                    ON filing.entity_id = pac.entity_id
+                 WHERE pac.search_name @@ plainto_tsquery('english', %s)
+                    AND filing.date_added >= '2010-01-01'
+                 ORDER BY pac.id
+                ) AS s
+            """
+
+        if table == "candidate":
+            query = """
+                SELECT * FROM (
+                  SELECT DISTINCT ON (candidate.id)
+                    candidate.*,
+                    committee.name as committee_name,
+                    county.name AS county_name,
+                    election.year AS election_year,
+                    party.name AS party_name,
+                    office.description AS office_name,
+                    officetype.description AS office_type,
+                    district.name AS district_name,
+                    division.name AS division_name
+                  FROM camp_fin_candidate AS candidate
+                  JOIN camp_fin_campaign AS campaign
+                    ON candidate.id = campaign.candidate_id
+                  JOIN camp_fin_pac as committee
+                    ON campaign.committee_id = committee.id
+                  JOIN camp_fin_electionseason AS election
+                    ON campaign.election_season_id = election.id
+                  LEFT JOIN camp_fin_politicalparty AS party
+                    ON campaign.political_party_id = party.id
+                  LEFT JOIN camp_fin_county AS county
+                    ON campaign.county_id = county.id
+                  JOIN camp_fin_office AS office
+                    ON campaign.office_id = office.id
+                  LEFT JOIN camp_fin_officetype AS officetype
+                    ON office.office_type_id = officetype.id
+                  LEFT JOIN camp_fin_district AS district
+                    ON campaign.district_id = district.id
+                  LEFT JOIN camp_fin_division AS division
+                    ON campaign.division_id = division.id
+                  WHERE candidate.search_name @@ plainto_tsquery('english', %s)
+                    AND campaign.date_added >= '2010-01-01'
+                  ORDER BY candidate.id, election.year DESC
+                ) AS s
+            """
+
+        if table == "contribution":
+            query = """
+                SELECT
+                  o.*,
+                  coalesce(o.full_name, o.company_name) as donor_name,
+                  CASE WHEN o.occupation = 'None' THEN ''
+                       ELSE initcap(o.occupation)
+                  END AS donor_occupation,
+                  tt.description AS transaction_type,
+                  CASE WHEN
+                    pac.name IS NULL OR TRIM(pac.name) = ''
+                  THEN
+                    candidate.full_name
+                  ELSE pac.name
+                  END AS transaction_subject,
+                  pac.slug AS pac_slug,
+                  candidate.slug AS candidate_slug,
+                  o.address || ' ' ||
+                    o.city || ', ' ||
+                    o.state || ' ' ||
+                    o.zipcode AS full_address
+                FROM camp_fin_transaction AS o
+                JOIN camp_fin_transactiontype AS tt
+                  ON o.transaction_type_id = tt.id
+                JOIN camp_fin_filing AS filing
+                  ON o.filing_id = filing.id
+                JOIN camp_fin_entity AS entity
+                  ON filing.entity_id = entity.id
+                LEFT JOIN camp_fin_pac AS pac
+                  ON entity.id = pac.entity_id
+                LEFT JOIN camp_fin_candidate AS candidate
+                  ON entity.id = candidate.entity_id
+                LEFT JOIN camp_fin_contact AS contact
+                  ON o.contact_id = contact.id
+                LEFT JOIN camp_fin_address AS address
+                  ON contact.address_id = address.id
+                LEFT JOIN camp_fin_state AS state
+                  ON address.state_id = state.id
+                WHERE o.search_name @@ plainto_tsquery('english', %s)
+                  AND tt.contribution = TRUE
+                  AND (o.redact = FALSE OR o.redact IS NULL)
+                  AND o.received_date >= '2010-01-01'
+            """
+
+        elif table == "expenditure":
+            query = """
+                SELECT
+                  o.*,
+                  tt.description AS transaction_type,
+                  CASE WHEN
+                    pac.name IS NULL OR TRIM(pac.name) = ''
+                  THEN
+                    candidate.full_name
+                  ELSE pac.name
+                  END AS transaction_subject,
+                  coalesce(o.full_name, o.company_name) as donor_name,
+                  pac.slug AS pac_slug,
+                  candidate.slug AS candidate_slug
+                FROM camp_fin_transaction AS o
+                JOIN camp_fin_transactiontype AS tt
+                  ON o.transaction_type_id = tt.id
+                JOIN camp_fin_filing AS filing
+                  ON o.filing_id = filing.id
+                JOIN camp_fin_entity AS entity
+                  ON filing.entity_id = entity.id
+                LEFT JOIN camp_fin_pac AS pac
+                  ON entity.id = pac.entity_id
+                LEFT JOIN camp_fin_candidate AS candidate
+                  ON entity.id = candidate.entity_id
+                WHERE o.search_name @@ plainto_tsquery('english', %s)
+                  AND tt.contribution = FALSE
+                  AND o.received_date >= '2010-01-01'
+            """
+
+        elif table == "lobbyist":
+            query = """
+                SELECT
+                    lob.slug,
+                    concat_ws(' ', lob.prefix, lob.first_name, lob.middle_name,
+                                   lob.last_name, lob.suffix)
+                    AS name
+                FROM camp_fin_lobbyist AS lob
+                WHERE lob.search_name @@ plainto_tsquery('english', %s)
+            """
+
+        elif table == "organization":
+            query = """
+                SELECT
+                    org.name AS name,
+                    org.slug AS slug,
+                    CASE WHEN
+                        add.street IS NULL OR TRIM(add.street) = ''
+                    THEN
+                        ''
+                    ELSE
+                        add.street || ' ' ||
+                        add.city || ', ' ||
+                        state.postal_code || ' ' ||
+                        add.zipcode
+                    END AS address
+                FROM camp_fin_organization AS org
+                JOIN camp_fin_address AS add
+                  ON org.permanent_address_id = add.id
+                JOIN camp_fin_state AS state
+                  ON add.state_id = state.id
+                WHERE org.search_name @@ plainto_tsquery('english', %s)
+            """
+
+        elif table == "lobbyisttransaction":
+            query = """
+                SELECT
+                  lobbyist.slug AS lobbyist_slug,
+                  concat_ws(' ', lobbyist.prefix, lobbyist.first_name, lobbyist.middle_name,
+                                 lobbyist.last_name, lobbyist.suffix) AS lobbyist_name,
+                  trans.name,
+                  trans.beneficiary,
+                  trans.expenditure_purpose,
+                  trans.received_date,
+                  trans.amount,
+                  trans.date_added,
+                  tt.description AS transaction_type,
+                  CASE WHEN tt.group_id = 2
+                    THEN 'Political contribution'
+                  ELSE 'Candidate'
+                  END AS transaction_group
+                FROM camp_fin_lobbyisttransaction AS trans
+                JOIN camp_fin_lobbyisttransactiontype AS tt
+                  ON trans.lobbyist_transaction_type_id = tt.id
+                JOIN camp_fin_lobbyistreport AS report
+                  ON trans.lobbyist_report_id = report.id
+                JOIN camp_fin_lobbyist AS lobbyist
+                  ON report.entity_id = lobbyist.entity_id
+                WHERE trans.search_name @@ plainto_tsquery('english', %s)
+            """
+
+        return query
+
+    def fetch(self, table, query, args):
+        with connection.cursor() as cursor:
+            cursor.execute(query, args)
+
+            columns = [c[0] for c in cursor.description]
+            result_tuple = namedtuple(table, columns)
+
+            return [result_tuple(*r) for r in cursor]
+
+    def count(self, query, args):
+        """
+        Return the number of rows a search matches, and whether the number is
+        an estimate. Rows are counted up to SEARCH_EXACT_COUNT_LIMIT; past
+        that, the planner's estimate is used, since counting every match of a
+        common name would take as long as reading them.
+        """
+        limit = settings.SEARCH_EXACT_COUNT_LIMIT
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM ({} LIMIT %s) AS s".format(query),
+                args + [limit + 1],
             )
+            count = cursor.fetchone()[0]
+
+            if count <= limit:
+                return count, False
+
+            cursor.execute("EXPLAIN (FORMAT JSON) {}".format(query), args)
+            plan = cursor.fetchone()[0][0]["Plan"]
 
-        return Response(response)
+        return max(int(plan["Plan Rows"]), count), True
 
     def finalize_response(self, request, response, *args, **kwargs):
         response = super().finalize_response(request, response, *args, **kwargs)
@@ -1878,60 +2043,119 @@ class SearchAPIView(viewsets.ViewSet):
         return response
 
 
-class TopEarnersView(PaginatedList):
-    template_name = "camp_fin/top-earners.html"
-    per_page = 100
+class GlobalSearchAPIView(viewsets.ViewSet):
+    """
+    Search every kind of search document at once, ordered by relevance.
+    Documents that match equally well are ordered by the dollars behind
+    them. Filter by kind with ?kind=candidate&kind=pac, etc.
+    """
 
-    def get_queryset(self):
-        interval = self.request.GET.get("interval", 90)
+    def list(self, request):
+        term = request.GET.get("term")
 
-        if int(interval) > 0:
-            where_clause = "AND t.received_date >= (NOW() - INTERVAL '%s days')"
-        else:
-            where_clause = "AND t.received_date >= '2010-01-01'"
+        if not term:
+            return Response({"error": "term is required"}, status=400)
+
+        paginator = pagination.LimitOffsetPagination()
+        limit = paginator.get_limit(request)
+        offset = paginator.get_offset(request)
+
+        kinds = request.GET.getlist("kind")
+        args = [term]
+
+        kind_filter = ""
+
+        if kinds:
+            kind_filter = "AND kind IN %s"
+            args.append(tuple(kinds))
 
         query = """
-            SELECT * FROM (
-              SELECT
-                dense_rank() OVER (ORDER BY new_funds DESC) AS rank, *
-              FROM (
-                SELECT
-                  MAX(COALESCE(c.slug, p.slug)) AS slug,
-                  MAX(COALESCE(c.full_name, p.name)) AS name,
-                  SUM(t.amount) AS new_funds,
-                  (array_agg(f.closing_balance ORDER BY f.id DESC))[1] AS current_funds,
-                  CASE WHEN p.id IS NULL
-                    THEN 'Candidate'
-                    ELSE 'PAC'
-                  END AS committee_type
-                  FROM camp_fin_transaction AS t
-                  JOIN camp_fin_transactiontype AS tt
-                    ON t.transaction_type_id = tt.id
-                  JOIN camp_fin_filing AS f
-                    ON t.filing_id = f.id
-                  LEFT JOIN camp_fin_pac AS p
-                    ON f.entity_id = p.entity_id
-                  LEFT JOIN camp_fin_candidate AS c
-                    ON f.entity_id = c.entity_id
-                  WHERE tt.contribution = TRUE
-                    {}
-                  GROUP BY c.id, p.id
-                ) AS s
-                WHERE name NOT ILIKE '%%public election fund%%'
-                  OR name NOT ILIKE '%%department of finance%%'
-              ORDER BY new_funds DESC
-            ) AS s
+            SELECT
+              *,
+              ts_rank(search_vector, query) *
+                (1 + ln(1 + GREATEST(COALESCE(amount, 0), 0))) AS rank
+            FROM camp_fin_searchdocument,
+              plainto_tsquery('english', %s) AS query
+            WHERE search_vector @@ query
+              {}
+            ORDER BY rank DESC, id
+            LIMIT %s OFFSET %s
         """.format(
-            where_clause
+            kind_filter
         )
 
-        cursor = connection.cursor()
-        cursor.execute(query, [int(interval)])
+        documents = SearchDocument.objects.raw(query, args + [limit, offset])
 
-        columns = [c[0] for c in cursor.description]
-        result_tuple = namedtuple("TopEarners", columns)
+        return Response(
+            OrderedDict(
+                [
+                    (
+                        "meta",
+                        OrderedDict([("limit", limit), ("offset", offset)]),
+                    ),
+                    (
+                        "objects",
+                        SearchDocumentSerializer(documents, many=True).data,
+                    ),
+                ]
+            )
+        )
+
+
+class SuggestAPIView(viewsets.ViewSet):
+    """
+    Typeahead suggestions of candidate, PAC, donor, lobbyist and
+    organization names containing every word of ?term=, up to ?limit= of
+    them.
+    """
+
+    default_limit = 10
+    max_limit = 25
+
+    # URL name of the page of each kind of suggestion, looked up by slug
+    DETAIL_URLS = {
+        "candidate": "candidate-detail",
+        "pac": "committee-detail",
+        "organization": "organization-detail",
+    }
+
+    def list(self, request):
+        term = request.GET.get("term", "")
+
+        try:
+            limit = min(
+                int(request.GET.get("limit", self.default_limit)), self.max_limit
+            )
+        except ValueError:
+            limit = self.default_limit
 
-        return [result_tuple(*r) for r in cursor]
+        objects = []
+
+        for kind, name, slug, amount in suggestions(term, max(limit, 1)):
+            if kind == "donor":
+                url = "{}?term={}".format(reverse("search"), quote_plus(name))
+            elif kind in self.DETAIL_URLS and slug:
+                url = reverse(self.DETAIL_URLS[kind], args=[slug])
+            else:
+                url = None
+
+            objects.append(
+                OrderedDict(
+                    [("kind", kind), ("name", name), ("amount", amount), ("url", url)]
+                )
+            )
+
+        return Response(
+            OrderedDict([("meta", OrderedDict([("term", term)])), ("objects", objects)])
+        )
+
+
+class TopEarnersView(PaginatedList):
+    template_name = "camp_fin/top-earners.html"
+    per_page = 100
+
+    def get_queryset(self):
+        return top_earners(int(self.request.GET.get("interval", 90)))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -1956,30 +2180,7 @@ class TopEarnersWidgetView(TopEarnersBase):
     template_name = "camp_fin/widgets/top-earners.html"
 
 
-def make_response(query, filename, args=[]):
-    cursor = connection.cursor()
-
-    if args:
-        cursor.execute(query, args)
-    else:
-        cursor.execute(query)
-
-    header = [c[0] for c in cursor.description]
-
-    streaming_buffer = Echo()
-    writer = csv.writer(streaming_buffer)
-    writer.writerow(header)
-
-    response = StreamingHttpResponse(
-        (writer.writerow(row) for row in iterate_cursor(header, cursor)),
-        content_type="text/csv",
-    )
-    response["Content-Disposition"] = "attachment; filename={}".format(filename)
-
-    return response
-
-
-def bulk_candidates(request):
+def candidates_query(start_date=None, end_date=None):
     copy = """
         SELECT DISTINCT ON (candidate.id)
           candidate.*,
@@ -2015,15 +2216,13 @@ def bulk_candidates(request):
 
     args = []
 
-    if request.GET.get("from"):
-        start_date = request.GET.get("from")
+    if start_date:
         args.append(start_date)
         copy += """
             AND campaign.date_added >= %s
         """
 
-    if request.GET.get("to"):
-        end_date = request.GET.get("to")
+    if end_date:
         args.append(end_date)
         copy += """
             AND campaign.date_added::date <= %s
@@ -2033,12 +2232,16 @@ def bulk_candidates(request):
         ORDER BY candidate.id, election.year DESC
     """
 
-    filename = "Candidates_{}.csv".format(timezone.now().isoformat())
+    return copy, args
 
-    return make_response(copy, filename, args)
 
+def bulk_candidates(request):
+    query, args = candidates_query(request.GET.get("from"), request.GET.get("to"))
 
-def bulk_committees(request):
+    return download_response(request, query, args, "Candidates_{}", export="candidates")
+
+
+def committees_query(start_date=None, end_date=None):
     copy = """
         SELECT DISTINCT ON (pac.id)
           pac.*,
@@ -2053,15 +2256,13 @@ def bulk_committees(request):
 
     args = []
 
-    if request.GET.get("from"):
-        start_date = request.GET.get("from")
+    if start_date:
         args.append(start_date)
         copy += """
             AND filing.date_added >= %s
         """
 
-    if request.GET.get("to"):
-        end_date = request.GET.get("to")
+    if end_date:
         args.append(end_date)
         copy += """
             AND filing.date_added::date <= %s
@@ -2071,9 +2272,13 @@ def bulk_committees(request):
         ORDER BY pac.id
     """
 
-    filename = "PACs_{}.csv".format(timezone.now().isoformat())
+    return copy, args
 
-    return make_response(copy, filename, args)
+
+def bulk_committees(request):
+    query, args = committees_query(request.GET.get("from"), request.GET.get("to"))
+
+    return download_response(request, query, args, "PACs_{}", export="committees")
 
 
 def bulk_lobbyists(request):
@@ -2119,12 +2324,10 @@ def bulk_lobbyists(request):
         ORDER BY lobbyist.id
     """
 
-    filename = "Lobbyists_{}.csv".format(timezone.now().isoformat())
-
-    return make_response(copy, filename, args)
+    return download_response(request, copy, args, "Lobbyists_{}")
 
 
-def bulk_employers(request):
+def employers_query(start_date=None, end_date=None):
     copy = """
         SELECT
             org.id,
@@ -2140,15 +2343,13 @@ def bulk_employers(request):
 
     args = []
 
-    if request.GET.get("from"):
-        start_date = request.GET.get("from")
+    if start_date:
         args.append(start_date)
         copy += """
             AND org.date_added >= %s
         """
 
-    if request.GET.get("to"):
-        end_date = request.GET.get("to")
+    if end_date:
         args.append(end_date)
         copy += """
             AND org.date_added::date <= %s
@@ -2158,12 +2359,16 @@ def bulk_employers(request):
         ORDER BY org.id
     """
 
-    filename = "Employers_{}.csv".format(timezone.now().isoformat())
+    return copy, args
 
-    return make_response(copy, filename, args)
 
+def bulk_employers(request):
+    query, args = employers_query(request.GET.get("from"), request.GET.get("to"))
 
-def bulk_employments(request):
+    return download_response(request, query, args, "Employers_{}", export="employers")
+
+
+def employments_query(start_date=None, end_date=None):
     copy = """
         SELECT
             emp.id,
@@ -2185,9 +2390,7 @@ def bulk_employments(request):
 
     args = []
 
-    if request.GET.get("from"):
-        start_date = request.GET.get("from")
-
+    if start_date:
         # Only get the year
         start_date = start_date[:4]
 
@@ -2196,9 +2399,7 @@ def bulk_employments(request):
             AND year >= %s
         """
 
-    if request.GET.get("to"):
-        end_date = request.GET.get("to")
-
+    if end_date:
         # Only get the year
         end_date = end_date[:4]
 
@@ -2211,9 +2412,15 @@ def bulk_employments(request):
         ORDER BY emp.id
     """
 
-    filename = "Lobbyist_Employment_History_{}.csv".format(timezone.now().isoformat())
+    return copy, args
+
 
-    return make_response(copy, filename, args)
+def bulk_employments(request):
+    query, args = employments_query(request.GET.get("from"), request.GET.get("to"))
+
+    return download_response(
+        request, query, args, "Lobbyist_Employment_History_{}", export="employments"
+    )
 
 
 def four_oh_four(request, exception):